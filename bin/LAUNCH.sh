@@ -287,6 +287,10 @@ function launching_scripts {
     screen -S "Script_AIL" -X screen -t "CEDetector" bash -c "cd ${AIL_BIN}/modules; ${ENV_PY} ./CEDetector.py; read x"
     sleep 0.1
 
+    # HARS
+    screen -S "Script_AIL" -X screen -t "HarExtractor" bash -c "cd ${AIL_BIN}/modules; ${ENV_PY} ./HarExtractor.py; read x"
+    sleep 0.1
+
     ##################################
     #       TRACKERS MODULES         #
     ##################################
@@ -303,6 +307,20 @@ function launching_scripts {
     screen -S "Script_AIL" -X screen -t "Retro_Hunt" bash -c "cd ${AIL_BIN}/trackers; ${ENV_PY} ./Retro_Hunt.py; read x"
     sleep 0.1
 
+    ##################################
+    #         MODULES HOSTS          #
+    ##################################
+    for host_name in $(cd ${AIL_BIN}/core; ${ENV_PY} ./Modules_Host.py --list); do
+        screen -S "Script_AIL" -X screen -t "Modules_Host_${host_name}" bash -c "cd ${AIL_BIN}/core; ${ENV_PY} ./Modules_Host.py -n ${host_name}; read x"
+        sleep 0.1
+    done
+
+    ##################################
+    #      MODULES SUPERVISOR        #
+    ##################################
+    screen -S "Script_AIL" -X screen -t "Modules_Supervisor" bash -c "cd ${AIL_BIN}/core; ${ENV_PY} ./Modules_Supervisor.py; read x"
+    sleep 0.1
+
     ##################################
     #       DISABLED MODULES         #
     ##################################
@@ -596,7 +614,7 @@ function launch_tests() {
   echo -e $GREEN"\t* Flask:   $isflasked"$DEFAULT
   echo -e ""
   echo -e ""
-  python3 -m nose2 --start-dir $tests_dir --coverage $bin_dir --with-coverage test_api test_modules
+  python3 -m nose2 --start-dir $tests_dir --coverage $bin_dir --with-coverage test_api test_modules test_ail_2_ail_sync test_ail_queues test_crawlers test_importers
 }
 
 function reset_password() {
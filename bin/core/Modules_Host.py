@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*-coding:UTF-8 -*
+
+"""
+The Modules Host
+================================
+
+Run several lightweight modules in one process to share the interpreter,
+the imported libraries, the DB connections and the caches.
+
+The modules are scheduled in round robin, one message per module and per round.
+A module with an empty queue is skipped for its pending_seconds.
+
+Placement: [Modules_Hosts] section of core.cfg, <host name> = <module>,<module>,...
+Heavy modules (Duplicates, Decoder, OcrExtractor, ...) should stay in their own process.
+
+"""
+
+##################################
+# Import External packages
+##################################
+import argparse
+import importlib
+import logging.config
+import os
+import signal
+import sys
+import time
+import traceback
+
+sys.path.append(os.environ['AIL_BIN'])
+##################################
+# Import Project packages
+##################################
+from lib import ail_logger
+from lib import ail_queues
+from lib.exceptions import ModuleQueueError
+
+logging.config.dictConfig(ail_logger.get_config(name='modules'))
+
+MODULES_PACKAGES = ['modules', 'trackers', 'crawlers', 'core', 'importer']
+
+
+def get_module_class(module_name):
+    for package in MODULES_PACKAGES:
+        if os.path.isfile(os.path.join(os.environ['AIL_BIN'], package, f'{module_name}.py')):
+            module = importlib.import_module(f'{package}.{module_name}')
+            return getattr(module, module_name)
+    return None
+
+
+class ModulesHost(object):
+    """ModulesHost."""
+
+    def __init__(self, host_name):
+        self.logger = logging.getLogger(f'{self.__class__.__name__}')
+        self.host_name = host_name
+        self.proceed = True
+
+        # module name: module instance
+        self.modules = {}
+        # module name: next time to check an empty queue
+        self.next_check = {}
+        for module_name in ail_queues.get_modules_host_modules(host_name):
+            module_class = get_module_class(module_name)
+            if not module_class:
+                self.logger.error(f'{host_name}: Module not found: {module_name}')
+                continue
+            self.modules[module_name] = module_class()
+            self.next_check[module_name] = 0
+        self.logger.info(f'Modules Host {host_name} Launched: {", ".join(self.modules)}')
+
+    def stop(self, signum=None, frame=None):
+        # Children forked by the hosted modules (regex timeouts, YARA compilation) inherit the handler: terminate them
+        if signum and os.getpid() != self.pid:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+            return None
+        self.proceed = False
+
+    def process_round(self):
+        """
+        Process one message per module with a non-empty queue
+
+        :return: True if at least one message was processed
+        """
+        processed = False
+        for module_name, module in self.modules.items():
+            if not self.proceed:
+                break
+            if self.next_check[module_name] > time.time():
+                continue
+            try:
+                if module.process_message():
+                    processed = True
+                else:
+                    module.computeNone()
+                    self.next_check[module_name] = time.time() + module.pending_seconds
+            except ModuleQueueError:
+                # invalid queue config, stop this module only
+                trace = ''.join(traceback.format_exc())
+                self.logger.critical(f'{self.host_name}: Module {module_name} stopped: {trace}')
+                self.next_check[module_name] = float('inf')
+            except Exception:
+                # the other modules keep running, retry this module later
+                trace = ''.join(traceback.format_exc())
+                self.logger.error(f'{self.host_name}: Module {module_name} error: {trace}')
+                self.next_check[module_name] = time.time() + max(module.pending_seconds, 1)
+        return processed
+
+    def run(self):
+        self.pid = os.getpid()
+        signal.signal(signal.SIGTERM, self.stop)
+        while self.proceed:
+            if not self.process_round():
+                # sleep until the next queue check
+                wait = min(self.next_check.values(), default=time.time() + 10) - time.time()
+                if wait > 0:
+                    time.sleep(min(wait, 10))
+        for module in self.modules.values():
+            module.queue.stop()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run several AIL modules in one process')
+    parser.add_argument('-n', '--name', help='Modules Host name', type=str, dest='host_name', default=None)
+    parser.add_argument('-l', '--list', help='List Modules Hosts', action='store_true', dest='list_hosts')
+    args = parser.parse_args()
+
+    if args.list_hosts:
+        for name in ail_queues.get_modules_hosts():
+            print(name)
+        sys.exit(0)
+
+    if not args.host_name or args.host_name not in ail_queues.get_modules_hosts():
+        parser.print_help()
+        sys.exit(0)
+
+    host = ModulesHost(args.host_name)
+    host.run()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*-coding:UTF-8 -*
+
+"""
+The Modules Supervisor
+================================
+
+Run N workers per module, N scaled between a min and a max number of workers
+depending on the module queue length and processing time.
+Crashed workers are restarted.
+
+Workers launched outside the supervisor (LAUNCH.sh screens) are counted but never stopped.
+
+Config: [Modules_Supervisor] and [Modules_Workers] sections of core.cfg
+
+"""
+
+##################################
+# Import External packages
+##################################
+import logging.config
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import psutil
+
+sys.path.append(os.environ['AIL_BIN'])
+##################################
+# Import Project packages
+##################################
+from lib import ail_logger
+from lib import ail_queues
+from lib.ConfigLoader import ConfigLoader
+
+logging.config.dictConfig(ail_logger.get_config(name='modules'))
+
+MODULES_DIRS = ['modules', 'trackers', 'crawlers', 'core', 'importer']
+
+
+def get_module_script(module_name):
+    for dir_name in MODULES_DIRS:
+        script = os.path.join(os.environ['AIL_BIN'], dir_name, f'{module_name}.py')
+        if os.path.isfile(script):
+            return script
+    return None
+
+
+class ModulesSupervisor(object):
+    """ModulesSupervisor."""
+
+    def __init__(self):
+        self.logger = logging.getLogger(f'{self.__class__.__name__}')
+
+        config_loader = ConfigLoader()
+        self.check_interval = self._get_config_int(config_loader, 'check_interval', 10)
+        # Scale up if the queue can't be processed in less than scale_up_drain_time seconds
+        self.scale_up_drain_time = self._get_config_int(config_loader, 'scale_up_drain_time', 60)
+        # Used if no processing time is available
+        self.scale_up_queue = self._get_config_int(config_loader, 'scale_up_queue', 1000)
+        self.scale_down_queue = self._get_config_int(config_loader, 'scale_down_queue', 10)
+        # Minimum time in seconds between two scaling actions of a module
+        self.scale_cooldown = self._get_config_int(config_loader, 'scale_cooldown', 60)
+        self.stop_timeout = self._get_config_int(config_loader, 'stop_timeout', 60)
+
+        # module_name: {'min': int, 'max': int, 'script': str}
+        self.modules = {}
+        for module_name, bounds in config_loader.get_all_keys_values_from_section('Modules_Workers'):
+            # configparser lowercase keys
+            module_name = self._get_module_section_name(module_name)
+            try:
+                min_workers, max_workers = bounds.split(',', 1)
+                min_workers = int(min_workers)
+                max_workers = int(max_workers)
+            except ValueError:
+                self.logger.error(f'Invalid workers bounds {module_name}: {bounds}')
+                continue
+            if ail_queues.is_hosted_module(module_name):
+                self.logger.error(f'Module run by a modules host: {module_name}')
+                continue
+            script = get_module_script(module_name)
+            if not script:
+                self.logger.error(f'Module script not found: {module_name}')
+                continue
+            self.modules[module_name] = {'min': max(min_workers, 0), 'max': max(max_workers, min_workers),
+                                         'script': script}
+        config_loader = None
+
+        # module_name: {pid: Popen}
+        self.workers = {module_name: {} for module_name in self.modules}
+        # workers stopping: pid: (module_name, Popen, stop time)
+        self.stopping = {}
+        self.last_scaling = {module_name: 0 for module_name in self.modules}
+        self.proceed = True
+
+    def _get_config_int(self, config_loader, key_name, default):
+        if config_loader.has_option('Modules_Supervisor', key_name):
+            return config_loader.get_config_int('Modules_Supervisor', key_name)
+        return default
+
+    def _get_module_section_name(self, module_name):
+        config_loader = ConfigLoader(config_file=ail_queues.MODULES_FILE)
+        for section in config_loader.get_config_sections():
+            if section.lower() == module_name.lower():
+                return section
+        return module_name
+
+    def get_workers(self, module_name):
+        return self.workers[module_name]
+
+    def launch_worker(self, module_name):
+        script = self.modules[module_name]['script']
+        process = subprocess.Popen([sys.executable, script], cwd=os.path.dirname(script),
+                                   stdout=subprocess.DEVNULL)
+        self.workers[module_name][process.pid] = process
+        self.last_scaling[module_name] = time.time()
+        self.logger.info(f'{module_name}: worker {process.pid} launched')
+        print(f'{module_name}: worker {process.pid} launched')
+
+    def stop_worker(self, module_name):
+        # stop the last launched worker
+        pid = sorted(self.workers[module_name])[-1]
+        process = self.workers[module_name].pop(pid)
+        process.terminate()
+        self.stopping[pid] = (module_name, process, time.time())
+        self.last_scaling[module_name] = time.time()
+        self.logger.info(f'{module_name}: worker {pid} stopping')
+        print(f'{module_name}: worker {pid} stopping')
+
+    def check_stopping_workers(self):
+        for pid in list(self.stopping):
+            module_name, process, stop_time = self.stopping[pid]
+            if process.poll() is not None:
+                ail_queues.clear_module_worker(module_name, pid)
+                self.stopping.pop(pid)
+            elif time.time() - stop_time > self.stop_timeout:
+                process.kill()
+
+    def check_crashed_workers(self, module_name):
+        for pid in list(self.workers[module_name]):
+            process = self.workers[module_name][pid]
+            if process.poll() is not None:
+                self.logger.warning(f'{module_name}: worker {pid} exited, return code {process.returncode}')
+                print(f'{module_name}: worker {pid} exited, return code {process.returncode}')
+                ail_queues.clear_module_worker(module_name, pid)
+                self.workers[module_name].pop(pid)
+                # restart
+                self.launch_worker(module_name)
+
+    def clear_dead_workers(self, module_name):
+        # workers registered in the queue stats, launched by the supervisor or not
+        for pid in ail_queues.get_module_pids(module_name):
+            if not psutil.pid_exists(int(pid)):
+                ail_queues.clear_module_worker(module_name, pid)
+
+    def get_nb_workers(self, module_name):
+        pids = set(ail_queues.get_module_pids(module_name))
+        # launched workers not yet registered
+        for pid in self.workers[module_name]:
+            pids.add(str(pid))
+        for pid in self.stopping:
+            pids.discard(str(pid))
+        return len(pids)
+
+    def get_nb_workers_wanted(self, module_name, nb_workers):
+        bounds = self.modules[module_name]
+        if nb_workers < bounds['min']:
+            return bounds['min']
+        if time.time() - self.last_scaling[module_name] < self.scale_cooldown:
+            return nb_workers
+
+        nb_messages = ail_queues.get_module_nb_messages(module_name)
+        avg_time = ail_queues.get_module_avg_processing_time(module_name)
+        if avg_time is not None and nb_workers:
+            scale_up = nb_messages * avg_time / nb_workers > self.scale_up_drain_time
+        else:
+            scale_up = nb_messages > self.scale_up_queue
+        if scale_up and nb_workers < bounds['max']:
+            return nb_workers + 1
+        elif nb_messages <= self.scale_down_queue and nb_workers > bounds['min']:
+            return nb_workers - 1
+        return min(nb_workers, bounds['max'])
+
+    def supervise(self):
+        self.check_stopping_workers()
+        for module_name in self.modules:
+            self.check_crashed_workers(module_name)
+            self.clear_dead_workers(module_name)
+
+            nb_workers = self.get_nb_workers(module_name)
+            nb_wanted = self.get_nb_workers_wanted(module_name, nb_workers)
+            while nb_workers < nb_wanted:
+                self.launch_worker(module_name)
+                nb_workers += 1
+            # only stop workers launched by the supervisor
+            while nb_workers > nb_wanted and self.workers[module_name]:
+                self.stop_worker(module_name)
+                nb_workers -= 1
+
+    def stop(self, signum=None, frame=None):
+        self.proceed = False
+
+    def stop_all_workers(self):
+        for module_name in self.workers:
+            while self.workers[module_name]:
+                self.stop_worker(module_name)
+        while self.stopping:
+            self.check_stopping_workers()
+            time.sleep(1)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGHUP, self.stop)
+        self.logger.info(f'Modules Supervisor Launched: {", ".join(self.modules)}')
+        while self.proceed:
+            # wait for the modules launched by LAUNCH.sh
+            time.sleep(self.check_interval)
+            if self.proceed:
+                self.supervise()
+        self.stop_all_workers()
+
+
+if __name__ == '__main__':
+    supervisor = ModulesSupervisor()
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        supervisor.stop_all_workers()
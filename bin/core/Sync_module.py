@@ -63,17 +63,20 @@ class Sync_module(AbstractModule):
 
         # check filter + tags
         # print(message)
+        queues_uuid = []
         for queue_uuid in self.dict_sync_queues:
             filter_tags = self.dict_sync_queues[queue_uuid]['filter']
             if filter_tags and tags:
                 # print('tags: {tags} filter: {filter_tags}')
                 if filter_tags.issubset(tags):
-                    obj_dict = obj.get_default_meta()
-                    # send to queue push and/or pull
+                    queues_uuid.append(queue_uuid)
                     for dict_ail in self.dict_sync_queues[queue_uuid]['ail_instances']:
                         print(f'ail_uuid: {dict_ail["ail_uuid"]} obj: {obj.type}:{obj.get_subtype(r_str=True)}:{obj.id}')
-                        ail_2_ail.add_object_to_sync_queue(queue_uuid, dict_ail['ail_uuid'], obj_dict,
-                                                           push=dict_ail['push'], pull=dict_ail['pull'])
+
+        # send to queues push and/or pull
+        if queues_uuid:
+            obj_dict = obj.get_default_meta()
+            ail_2_ail.add_object_to_sync_queues(self.dict_sync_queues, queues_uuid, obj_dict)
 
     def run(self):
         """
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*-coding:UTF-8 -*
 
+import asyncio
 import os
 import json
 import secrets
@@ -8,6 +9,7 @@ import re
 import sys
 import time
 import uuid
+import zlib
 
 import subprocess
 
@@ -26,8 +28,37 @@ config_loader = ConfigLoader.ConfigLoader()
 r_cache = config_loader.get_redis_conn("Redis_Cache")
 r_serv_db = config_loader.get_db_conn("Kvrocks_DB")
 r_serv_sync = config_loader.get_db_conn("Kvrocks_DB")
+
+# SYNC FRAMING: json (one object per frame) or batch (compressed batches + credits)
+if config_loader.has_option('AIL_2_AIL', 'sync_framing'):
+    SYNC_FRAMING = config_loader.get_config_str('AIL_2_AIL', 'sync_framing')
+else:
+    SYNC_FRAMING = 'json'
+if SYNC_FRAMING not in ['json', 'batch']:
+    SYNC_FRAMING = 'json'
+if config_loader.has_option('AIL_2_AIL', 'batch_size'):
+    SYNC_BATCH_SIZE = config_loader.get_config_int('AIL_2_AIL', 'batch_size')
+else:
+    SYNC_BATCH_SIZE = 50
+if config_loader.has_option('AIL_2_AIL', 'batch_compression'):
+    SYNC_BATCH_COMPRESSION = config_loader.get_config_str('AIL_2_AIL', 'batch_compression')
+else:
+    SYNC_BATCH_COMPRESSION = 'deflate'
+if config_loader.has_option('AIL_2_AIL', 'batch_credits'):
+    SYNC_BATCH_CREDITS = config_loader.get_config_int('AIL_2_AIL', 'batch_credits')
+else:
+    SYNC_BATCH_CREDITS = 4
 config_loader = None
 
+try:
+    import zstandard
+    ZSTD_ENABLED = True
+except ImportError:
+    ZSTD_ENABLED = False
+
+if SYNC_BATCH_COMPRESSION == 'zstd' and not ZSTD_ENABLED:
+    SYNC_BATCH_COMPRESSION = 'deflate'
+
 WEBSOCKETS_CLOSE_CODES = {
                             1000: 'Normal Closure',
                             1001: 'Going Away',
@@ -909,6 +940,7 @@ def get_sync_queue_metadata(queue_uuid):
     dict_meta['description'] = get_sync_queue_description(queue_uuid)
     dict_meta['max_size'] = get_sync_queue_max_size(queue_uuid)
     dict_meta['tags'] = get_sync_queue_filter(queue_uuid)
+    dict_meta['dropped'] = get_sync_queue_dropped(queue_uuid)
 
     # # TODO: TO ADD:
     # - get uuid instance
@@ -934,6 +966,7 @@ def get_all_sync_queue_dict():
         if is_queue_used_by_ail_instance(queue_uuid):
             dict_queue = {}
             dict_queue['filter'] = get_sync_queue_filter(queue_uuid)
+            dict_queue['max_size'] = int(get_sync_queue_max_size(queue_uuid) or 100)
 
             dict_queue['ail_instances'] = [] ############ USE DICT ?????????
             for ail_uuid in get_sync_queue_all_ail_instance(queue_uuid):
@@ -1175,21 +1208,105 @@ def get_sync_queue_objects_by_queue_uuid(queue_uuid, ail_uuid, push=True):
         sync_mode = 'pull'
     return r_serv_sync.lrange(f'sync:queue:{sync_mode}:{queue_uuid}:{ail_uuid}', 0, -1)
 
-# # TODO: use queue max_size
-def add_object_to_sync_queue(queue_uuid, ail_uuid, obj_dict, push=True, pull=True, json_obj=True):
+def get_sync_queue_batch_by_queue_uuid(queue_uuid, ail_uuid, batch_size, push=True):
+    """
+    Pop up to batch_size objects from a sync queue in one round trip
+    """
+    if push:
+        sync_mode = 'push'
+    else:
+        sync_mode = 'pull'
+    pipe = r_serv_sync.pipeline()
+    pipe.lrange(f'sync:queue:{sync_mode}:{queue_uuid}:{ail_uuid}', 0, batch_size - 1)
+    pipe.ltrim(f'sync:queue:{sync_mode}:{queue_uuid}:{ail_uuid}', batch_size, -1)
+    objs = []
+    for obj_dict in pipe.execute()[0]:
+        obj_dict = json.loads(obj_dict)
+        # # REVIEW: # TODO: create by obj type
+        objs.append(Item(obj_dict['id']))
+    return objs
+
+def get_sync_queue_batch(ail_uuid, batch_size, push=True):
+    """
+    Return a list of (queue_uuid, Obj) with at most batch_size objects, popped from all the instance queues
+    """
+    batch = []
+    for queue_uuid in get_ail_instance_all_sync_queue(ail_uuid):
+        for obj in get_sync_queue_batch_by_queue_uuid(queue_uuid, ail_uuid, batch_size - len(batch), push=push):
+            batch.append((queue_uuid, obj))
+        if len(batch) >= batch_size:
+            break
+    return batch
+
+def get_sync_queue_dropped(queue_uuid):
+    """
+    :return: dict: ail_uuid: number of objects trimmed from the full sync queue
+    """
+    ail_uuids = list(get_sync_queue_all_ail_instance(queue_uuid))
+    if not ail_uuids:
+        return {}
+    res = r_serv_sync.hmget('ail2ail:sync_queue:dropped', [f'{queue_uuid}:{ail_uuid}' for ail_uuid in ail_uuids])
+    return {ail_uuid: int(nb or 0) for ail_uuid, nb in zip(ail_uuids, res)}
+
+def _add_object_to_sync_queue(pipe, queue_uuid, ail_uuid, obj, max_size, push=True, pull=True):
+    if push:
+        pipe.lpush(f'sync:queue:push:{queue_uuid}:{ail_uuid}', obj)
+        pipe.ltrim(f'sync:queue:push:{queue_uuid}:{ail_uuid}', 0, max_size - 1)
+    if pull:
+        pipe.lpush(f'sync:queue:pull:{queue_uuid}:{ail_uuid}', obj)
+        pipe.ltrim(f'sync:queue:pull:{queue_uuid}:{ail_uuid}', 0, max_size - 1)
+
+def _count_dropped_objects(pipe_res, targets, max_size):
+    # lpush result: queue length before the ltrim
+    i = 0
+    dropped = {}
+    for queue_uuid, ail_uuid, push, pull in targets:
+        for sync_mode in (push, pull):
+            if sync_mode:
+                if pipe_res[i] > max_size[queue_uuid]:
+                    key = f'{queue_uuid}:{ail_uuid}'
+                    dropped[key] = dropped.get(key, 0) + 1
+                i += 2
+    if dropped:
+        pipe = r_serv_sync.pipeline(transaction=False)
+        for key in dropped:
+            pipe.hincrby('ail2ail:sync_queue:dropped', key, dropped[key])
+        pipe.execute()
+
+def add_object_to_sync_queue(queue_uuid, ail_uuid, obj_dict, push=True, pull=True, json_obj=True, max_size=None):
     if json_obj:
         obj = json.dumps(obj_dict)
     else:
         obj = obj_dict
-
-    # # TODO: # FIXME: USE CACHE ??????
-    if push:
-        r_serv_sync.lpush(f'sync:queue:push:{queue_uuid}:{ail_uuid}', obj)
-        r_serv_sync.ltrim(f'sync:queue:push:{queue_uuid}:{ail_uuid}', 0, 200)
-
-    if pull:
-        r_serv_sync.lpush(f'sync:queue:pull:{queue_uuid}:{ail_uuid}', obj)
-        r_serv_sync.ltrim(f'sync:queue:pull:{queue_uuid}:{ail_uuid}', 0, 200)
+    if not max_size:
+        max_size = int(get_sync_queue_max_size(queue_uuid) or 100)
+
+    pipe = r_serv_sync.pipeline(transaction=False)
+    _add_object_to_sync_queue(pipe, queue_uuid, ail_uuid, obj, max_size, push=push, pull=pull)
+    res = pipe.execute()
+    _count_dropped_objects(res, [(queue_uuid, ail_uuid, push, pull)], {queue_uuid: max_size})
+
+def add_object_to_sync_queues(dict_sync_queues, queues_uuid, obj_dict):
+    """
+    Push an object to all the AIL instances of the matching sync queues with one pipeline
+
+    :param dict_sync_queues: dict returned by get_all_sync_queue_dict()
+    :param queues_uuid: sync queues matching the object filter
+    :param obj_dict: object default meta
+    """
+    obj = json.dumps(obj_dict)
+    targets = []
+    max_size = {}
+    pipe = r_serv_sync.pipeline(transaction=False)
+    for queue_uuid in queues_uuid:
+        max_size[queue_uuid] = dict_sync_queues[queue_uuid].get('max_size', 100)
+        for dict_ail in dict_sync_queues[queue_uuid]['ail_instances']:
+            _add_object_to_sync_queue(pipe, queue_uuid, dict_ail['ail_uuid'], obj, max_size[queue_uuid],
+                                      push=dict_ail['push'], pull=dict_ail['pull'])
+            targets.append((queue_uuid, dict_ail['ail_uuid'], dict_ail['push'], dict_ail['pull']))
+    if targets:
+        res = pipe.execute()
+        _count_dropped_objects(res, targets, max_size)
 
 def resend_object_to_sync_queue(ail_uuid, queue_uuid, Obj, push=True):
     if queue_uuid is not None and Obj is not None:
@@ -1200,6 +1317,10 @@ def resend_object_to_sync_queue(ail_uuid, queue_uuid, Obj, push=True):
             pull = True
         add_object_to_sync_queue(queue_uuid, ail_uuid, obj_dict, push=push, pull=pull)
 
+def resend_objects_to_sync_queue(ail_uuid, batch, push=True):
+    for queue_uuid, Obj in batch:
+        resend_object_to_sync_queue(ail_uuid, queue_uuid, Obj, push=push)
+
 # # TODO: # REVIEW: USE CACHE ????? USE QUEUE FACTORY ?????
 def get_sync_importer_ail_stream():
     return r_serv_sync.spop('sync:queue:importer')
@@ -1208,6 +1329,10 @@ def add_ail_stream_to_sync_importer(ail_stream):
     ail_stream = json.dumps(ail_stream)
     r_serv_sync.sadd('sync:queue:importer', ail_stream)
 
+def add_ail_streams_to_sync_importer(ail_streams):
+    if ail_streams:
+        r_serv_sync.sadd('sync:queue:importer', *[json.dumps(ail_stream) for ail_stream in ail_streams])
+
 #############################
 #                           #
 #### AIL EXCHANGE FORMAT ####
@@ -1243,6 +1368,127 @@ def create_ail_stream(Object):
 
     return ail_stream
 
+#############################
+#                           #
+#### SYNC BATCH FRAMING #####
+
+# Batch frame: <json header>\n<compressed ndjson ail streams>
+# Flow control: the receiver grants credits ({"credit": <nb frames>}), the sender only sends a frame if it has a credit
+
+SYNC_FRAMING_HEADER = 'AIL-Sync-Framing'
+
+def get_sync_framing():
+    return SYNC_FRAMING
+
+def get_sync_framing_from_headers(headers):
+    """
+    Framing requested by a client or accepted by a server.
+    Older instances don't send the header: one JSON object per frame.
+    """
+    sync_framing = headers.get(SYNC_FRAMING_HEADER, 'json')
+    if sync_framing not in ['json', 'batch']:
+        sync_framing = 'json'
+    return sync_framing
+
+def _compress_batch(data, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    elif compression == 'deflate':
+        return zlib.compress(data)
+    else:
+        return data
+
+def _decompress_batch(data, compression):
+    if compression == 'zstd':
+        if not ZSTD_ENABLED:
+            raise ValueError('zstd compression not supported')
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif compression == 'deflate':
+        return zlib.decompress(data)
+    elif compression == 'none':
+        return data
+    else:
+        raise ValueError(f'Unknown batch compression: {compression}')
+
+def create_ail_stream_batch_frame(ail_streams, compression=None):
+    if not compression:
+        compression = SYNC_BATCH_COMPRESSION
+    payload = '\n'.join([json.dumps(ail_stream) for ail_stream in ail_streams]).encode()
+    header = {'format': 'ail-batch', 'version': 1, 'compress': compression, 'nb': len(ail_streams)}
+    return json.dumps(header).encode() + b'\n' + _compress_batch(payload, compression)
+
+def unpack_ail_stream_batch_frame(frame):
+    header, payload = frame.split(b'\n', 1)
+    header = json.loads(header)
+    if header.get('format') != 'ail-batch':
+        raise ValueError('Invalid batch frame')
+    payload = _decompress_batch(payload, header.get('compress'))
+    if not payload:
+        return []
+    ail_streams = [json.loads(ail_stream) for ail_stream in payload.split(b'\n')]
+    if len(ail_streams) != header.get('nb'):
+        raise ValueError('Invalid batch frame size')
+    return ail_streams
+
+def create_credit_message(nb_credits):
+    return json.dumps({'credit': nb_credits})
+
+def unpack_credit_message(message):
+    try:
+        return int(json.loads(message)['credit'])
+    except (ValueError, KeyError, TypeError):
+        return 0
+
+async def send_batch_frames(websocket, get_batch, to_ail_stream=None, on_error=None, idle_time=10, max_idle=None):
+    """
+    Send batch frames, only when the receiver granted credits.
+
+    :param get_batch: function returning a batch to send, an empty list if nothing to send
+    :param to_ail_stream: function converting a batch element to an AIL stream
+    :param on_error: function called with the unsent batch on connection error
+    :param max_idle: stop after max_idle empty batches (None: endless)
+    """
+    credits = 0
+    nb_idle = 0
+    while True:
+        # wait for credits
+        while credits <= 0:
+            credits += unpack_credit_message(await websocket.recv())
+
+        batch = get_batch()
+        if batch:
+            nb_idle = 0
+            try:
+                if to_ail_stream:
+                    ail_streams = [to_ail_stream(elem) for elem in batch]
+                else:
+                    ail_streams = batch
+                await websocket.send(create_ail_stream_batch_frame(ail_streams))
+                credits -= 1
+            except Exception as err:
+                if on_error:
+                    on_error(batch)
+                raise err
+        else:
+            nb_idle += 1
+            if max_idle is not None and nb_idle >= max_idle:
+                return None
+            await asyncio.sleep(idle_time)
+
+async def receive_batch_frames(websocket, add_ail_streams, nb_credits=None):
+    """
+    Receive batch frames and grant a new credit after each processed frame
+    """
+    if not nb_credits:
+        nb_credits = SYNC_BATCH_CREDITS
+    await websocket.send(create_credit_message(nb_credits))
+    while True:
+        frame = await websocket.recv()
+        if isinstance(frame, str):
+            frame = frame.encode()
+        add_ail_streams(unpack_ail_stream_batch_frame(frame))
+        await websocket.send(create_credit_message(1))
+
 if __name__ == '__main__':
 
     ail_uuid = '03c51929-eeab-4d47-9dc0-c667f94c7d2d'
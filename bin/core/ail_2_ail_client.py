@@ -95,6 +95,15 @@ async def push(websocket, ail_uuid):
         ail_2_ail.resend_object_to_sync_queue(ail_uuid, queue_uuid, Obj, push=True)
         raise err
 
+async def push_batch(websocket, ail_uuid):
+    await ail_2_ail.send_batch_frames(websocket,
+                                      lambda: ail_2_ail.get_sync_queue_batch(ail_uuid, ail_2_ail.SYNC_BATCH_SIZE),
+                                      to_ail_stream=lambda elem: ail_2_ail.create_ail_stream(elem[1]),
+                                      on_error=lambda batch: ail_2_ail.resend_objects_to_sync_queue(ail_uuid, batch))
+
+async def pull_batch(websocket, ail_uuid):
+    await ail_2_ail.receive_batch_frames(websocket, ail_2_ail.add_ail_streams_to_sync_importer)
+
 async def ail_to_ail_client(ail_uuid, sync_mode, api, ail_key=None, client_id=None):
     if not ail_2_ail.exists_ail_instance(ail_uuid):
         print('AIL server not found')
@@ -116,22 +125,34 @@ async def ail_to_ail_client(ail_uuid, sync_mode, api, ail_key=None, client_id=No
     if client_id is None:
         client_id = ail_2_ail.create_sync_client_cache(ail_uuid, sync_mode)
 
+    sync_framing = ail_2_ail.get_sync_framing()
+
     try:
         async with websockets.connect(
             uri,
             ssl=ssl_context,
             local_addr=local_addr,
             #open_timeout=10, websockers 10.0 /!\ python>=3.7
-            extra_headers={"Authorization": f"{ail_key}"}
+            extra_headers={"Authorization": f"{ail_key}", ail_2_ail.SYNC_FRAMING_HEADER: sync_framing}
         ) as websocket:
             # success
             ail_2_ail.clear_save_ail_server_error(ail_uuid)
 
+            # framing accepted by the server, older servers only support JSON frames
+            if sync_framing == 'batch':
+                sync_framing = ail_2_ail.get_sync_framing_from_headers(websocket.response_headers)
+
             if sync_mode == 'pull':
-                await pull(websocket, ail_uuid)
+                if sync_framing == 'batch':
+                    await pull_batch(websocket, ail_uuid)
+                else:
+                    await pull(websocket, ail_uuid)
 
             elif sync_mode == 'push':
-                await push(websocket, ail_uuid)
+                if sync_framing == 'batch':
+                    await push_batch(websocket, ail_uuid)
+                else:
+                    await push(websocket, ail_uuid)
                 await websocket.close()
 
             elif sync_mode == 'api':
@@ -151,6 +151,16 @@ async def pull(websocket, ail_uuid):
     return None
 
 
+# PULL: Send batches of data to client, flow controlled by the client credits
+async def pull_batch(websocket, ail_uuid):
+    await ail_2_ail.send_batch_frames(websocket,
+                                      lambda: ail_2_ail.get_sync_queue_batch(ail_uuid, ail_2_ail.SYNC_BATCH_SIZE, push=False),
+                                      to_ail_stream=lambda elem: ail_2_ail.create_ail_stream(elem[1]),
+                                      on_error=lambda batch: ail_2_ail.resend_objects_to_sync_queue(ail_uuid, batch, push=False),
+                                      max_idle=1)
+    # END PULL
+    return None
+
 # PUSH: receive data from client
 # # TODO: optional queue_uuid
 async def push(websocket, ail_uuid):
@@ -165,6 +175,10 @@ async def push(websocket, ail_uuid):
         # # TODO: Close connection on junk
         ail_2_ail.add_ail_stream_to_sync_importer(ail_stream)
 
+# PUSH: receive batches of data from client
+async def push_batch(websocket, ail_uuid):
+    await ail_2_ail.receive_batch_frames(websocket, ail_2_ail.add_ail_streams_to_sync_importer)
+
 # API: server API
 # # TODO: ADD TIMEOUT ???
 async def api(websocket, ail_uuid, api):
@@ -199,13 +213,19 @@ async def ail_to_ail_serv(websocket, path):
     await register(websocket)
     try:
         if sync_mode == 'pull':
-            await pull(websocket, websocket.ail_uuid)
+            if websocket.sync_framing == 'batch':
+                await pull_batch(websocket, websocket.ail_uuid)
+            else:
+                await pull(websocket, websocket.ail_uuid)
             await websocket.close()
             logger.info(f'Connection closed: {ail_uuid} {remote_address}')
             print(f'Connection closed: {ail_uuid} {remote_address}')
 
         elif sync_mode == 'push':
-            await push(websocket, websocket.ail_uuid)
+            if websocket.sync_framing == 'batch':
+                await push_batch(websocket, websocket.ail_uuid)
+            else:
+                await push(websocket, websocket.ail_uuid)
 
         elif sync_mode == 'api':
             await api(websocket, websocket.ail_uuid, path['api'])
@@ -267,6 +287,8 @@ class AIL_2_AIL_Protocol(websockets.WebSocketServerProtocol):
         self.ail_key = api_key
         self.ail_uuid = ail_uuid
         self.sync_mode = dict_path['sync_mode']
+        # Default: one JSON object per frame
+        self.sync_framing = ail_2_ail.get_sync_framing_from_headers(request_headers)
 
         if self.sync_mode == 'pull' or self.sync_mode == 'push':
 
@@ -318,7 +340,9 @@ if __name__ == '__main__':
     cert_dir = os.environ['AIL_FLASK']
     ssl_context.load_cert_chain(certfile=os.path.join(cert_dir, 'server.crt'), keyfile=os.path.join(cert_dir, 'server.key'))
 
-    start_server = websockets.serve(ail_to_ail_serv, host, port, ssl=ssl_context, create_protocol=AIL_2_AIL_Protocol, max_size=None)
+    # Return the accepted framing, the clients fall back to JSON frames if the header is missing
+    start_server = websockets.serve(ail_to_ail_serv, host, port, ssl=ssl_context, create_protocol=AIL_2_AIL_Protocol, max_size=None,
+                                    extra_headers=lambda path, request_headers: [(ail_2_ail.SYNC_FRAMING_HEADER, ail_2_ail.get_sync_framing_from_headers(request_headers))])
 
     print(f'Server Launched:    wss://{host}:{port}')
     logger.info(f'Server Launched:    wss://{host}:{port}')
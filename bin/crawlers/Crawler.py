@@ -4,8 +4,11 @@
 import os
 import logging.config
 import sys
+import threading
 import time
+import traceback
 
+from concurrent.futures import ThreadPoolExecutor
 from pyail import PyAIL
 from requests.exceptions import ConnectionError
 
@@ -15,12 +18,11 @@ sys.path.append(os.environ['AIL_BIN'])
 ##################################
 from modules.abstract_module import AbstractModule
 from lib import ail_logger
+from lib import ail_queues
 from lib import crawlers
 from lib.ConfigLoader import ConfigLoader
-from lib.exceptions import TimeoutException, OnionFilteringError
+from lib.exceptions import TimeoutException
 from lib.Tag import get_domain_vanity_tags
-from lib.objects import CookiesNames
-from lib.objects import Etags
 from lib.objects.Domains import Domain
 from lib.objects import DomHashs
 from lib.objects import Favicons
@@ -40,6 +42,20 @@ def timeout_handler(signum, frame):
 signal.signal(signal.SIGALRM, timeout_handler)
 
 
+class CaptureState:
+    """Ingestion state of one capture"""
+
+    def __init__(self, task, domain):
+        self.domain = Domain(domain)
+        self.parent = self.domain.get_parent()
+        self.original_domain = Domain(domain)
+        self.har = task.get_har()
+        self.screenshot = task.get_screenshot()
+        self.date = crawlers.get_current_date(separator=True)
+        self.items_dir = crawlers.get_date_crawled_items_source(self.date)
+        self.root_item = None
+
+
 class Crawler(AbstractModule):
 
     def __init__(self):
@@ -51,6 +67,7 @@ class Crawler(AbstractModule):
         self.pending_seconds = 1
 
         self.tracker_yara = Tracker_Yara(queue=False)
+        self.tracker_yara_lock = threading.Lock()
 
         self.vanity_tags = get_domain_vanity_tags()
         print('vanity tags:', self.vanity_tags)
@@ -65,6 +82,32 @@ class Crawler(AbstractModule):
         self.default_screenshot = config_loader.get_config_boolean('Crawler', 'default_screenshot')
         self.default_depth_limit = config_loader.get_config_int('Crawler', 'default_depth_limit')
 
+        # Captures status: concurrent Lacus requests
+        if config_loader.has_option('Crawler', 'captures_status_workers'):
+            captures_status_workers = config_loader.get_config_int('Crawler', 'captures_status_workers')
+        else:
+            captures_status_workers = 10
+        # Done captures saved in parallel
+        if config_loader.has_option('Crawler', 'ingestion_workers'):
+            self.ingestion_workers = config_loader.get_config_int('Crawler', 'ingestion_workers')
+        else:
+            self.ingestion_workers = 4
+        self.ingestion_workers = max(self.ingestion_workers, 1)
+        self.status_pool = ThreadPoolExecutor(max_workers=max(captures_status_workers, 1),
+                                              thread_name_prefix='CaptureStatus')
+        self.ingestion_pool = ThreadPoolExecutor(max_workers=self.ingestion_workers,
+                                                 thread_name_prefix='CaptureIngestion')
+        # capture uuid: Future
+        self.ingesting = {}
+
+        # Onion lookups of the next tasks, prefetched in background
+        self.nb_onion_prefetch = 50
+        self.onion_lookup_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='OnionLookup')
+        # Priority of the onions tasks whose lookup failed, retried after the other tasks
+        self.onion_error_priority = -1
+        # onion: Future
+        self.onion_lookups = {}
+
         ail_url_to_push_discovery = config_loader.get_config_str('Crawler', 'ail_url_to_push_onion_discovery')
         ail_key_to_push_discovery = config_loader.get_config_str('Crawler', 'ail_key_to_push_onion_discovery')
         if ail_url_to_push_discovery and ail_key_to_push_discovery:
@@ -84,21 +127,13 @@ class Crawler(AbstractModule):
         crawlers.reload_crawlers_stats()
 
         self.crawler_scheduler = crawlers.CrawlerScheduler()
+        # arm the schedules, then re-armed at the end of their tasks
+        self.crawler_scheduler.update_queue()
 
         # LACUS
         self.lacus = crawlers.get_lacus()
         self.is_lacus_up = crawlers.is_lacus_connected(delta_check=0)
 
-        # Capture
-        self.har = None
-        self.screenshot = None
-        self.root_item = None
-        self.date = None
-        self.items_dir = None
-        self.original_domain = None
-        self.domain = None
-        self.parent = None
-
         # TODO Replace with warning list ???
         self.placeholder_screenshots = {'07244254f73e822bd4a95d916d8b27f2246b02c428adc29082d09550c6ed6e1a'   # blank
                                         '27e14ace10b0f96acd2bd919aaa98a964597532c35b6409dff6cc8eec8214748',  # not found
@@ -123,21 +158,13 @@ class Crawler(AbstractModule):
             except TimeoutException:
                 pass
 
-    def print_crawler_start_info(self, url, domain_url):
-        print()
-        print()
-        print('\033[92m------------------START CRAWLER------------------\033[0m')
-        print(f'crawler type:     {self.domain}')
-        print('\033[92m-------------------------------------------------\033[0m')
-        print(f'url:         {url}')
-        print(f'domain:      {self.domain}')
-        print(f'domain_url:  {domain_url}')
-        print()
-
     def get_message(self):
+        # Backpressure: don't launch new captures while a module queue is saturated
+        backpressured = ail_queues.is_backpressured()
+
         # Crawler Scheduler
-        self.crawler_scheduler.update_queue()
-        self.crawler_scheduler.process_queue()
+        if not backpressured:
+            self.crawler_scheduler.process_queue()
 
         self.refresh_lacus_status()  # TODO LOG ERROR
         if not self.is_lacus_up:
@@ -149,24 +176,18 @@ class Crawler(AbstractModule):
             self.filter_unknown_onion = crawlers.is_onion_filter_unknown()
             self.last_config_check = int(time.time())
 
+        if self.filter_unsafe_onion:
+            self.prefetch_onion_lookups()
+
         # Check if a new Capture can be Launched
-        if crawlers.get_nb_crawler_captures() < crawlers.get_crawler_max_captures():
+        if not backpressured and crawlers.get_nb_crawler_captures() < crawlers.get_crawler_max_captures():
             task_row = crawlers.add_task_to_lacus_queue()
             if task_row:
                 task, priority = task_row
                 domain = task.get_domain()
                 if self.filter_unsafe_onion:
                     if domain.endswith('.onion'):
-                        try:
-                            if not crawlers.check_if_onion_is_safe(domain, unknown=self.filter_unknown_onion):
-                                # print('---------------------------------------------------------')
-                                # print('DOMAIN FILTERED')
-                                task.delete()
-                                return None
-                        except OnionFilteringError:
-                            task.reset()
-                            self.logger.warning(f'Onion Filtering Connection Error, {task.uuid} Send back in queue')
-                            time.sleep(10)
+                        if not self.filter_onion(task, priority, domain):
                             return None
 
                 task.start()
@@ -180,59 +201,146 @@ class Crawler(AbstractModule):
                     self.refresh_lacus_status()
                     return None
 
-        # Get CrawlerCapture Object
-        capture = crawlers.get_crawler_capture()
-        if capture:
-            try:
-                status = self.lacus.get_capture_status(capture.uuid)
-                print(status)
-                if status == crawlers.CaptureStatus.DONE:
-                    return capture
-                elif status == crawlers.CaptureStatus.UNKNOWN:
-                    capture_start = capture.get_start_time(r_str=False)
-                    if capture_start == 0:
-                        task = capture.get_task()
-                        task.delete()
-                        capture.delete()
-                        self.logger.warning(f'capture UNKNOWN ERROR STATE, {task.uuid} Removed from queue')
-                        return None
-                    if int(time.time()) - capture_start > 600:  # TODO ADD in new crawler config
-                        task = capture.get_task()
-                        task.reset()
-                        capture.delete()
-                        self.logger.warning(f'capture UNKNOWN Timeout, {task.uuid} Send back in queue')
-                    else:
-                        capture.update(status)
-                elif status == crawlers.CaptureStatus.QUEUED:
-                    capture_start = capture.get_start_time(r_str=False)
-                    if int(time.time()) - capture_start > 36000:  # TODO ADD in new crawler config
-                        task = capture.get_task()
-                        task.reset()
-                        capture.delete()
-                        self.logger.warning(f'capture QUEUED Timeout, {task.uuid}, {task.get_url()} Send back in queue, start_time={capture_start}')
-                    else:
-                        capture.update(status)
-                    print(capture.uuid, crawlers.CaptureStatus(status).name, int(time.time()))
-                elif status == crawlers.CaptureStatus.ONGOING:
-                    capture.update(status)
-                    print(capture.uuid, crawlers.CaptureStatus(status).name, int(time.time()))
-                # Invalid State
-                else:
-                    task = capture.get_task()
-                    task.reset()
-                    capture.delete()
-                    self.logger.warning(f'ERROR INVALID CAPTURE STATUS {status}, {task.uuid} Send back in queue')
-
-            except ConnectionError:
-                self.logger.warning(f'Lacus ConnectionError, capture {capture.uuid}')
-                capture.update(-1)
-                self.refresh_lacus_status()
+        # Captures Status
+        self.check_ingested_captures()
+        self.check_captures_status()
 
         try:
             time.sleep(self.pending_seconds)
         except TimeoutException:
             pass
 
+    def filter_onion(self, task, priority, domain):
+        """
+        The onions are looked up by the prefetch workers, never in the main loop
+
+        :return: True if the onion can be captured, else the task is deleted or sent back in the queue
+        """
+        verdict = crawlers.get_onion_verdict(domain)
+        if not verdict:
+            if crawlers.is_onion_lookup_unreachable():
+                task.add_to_db_crawler_queue(priority)
+                self.logger.warning(f'Onion Filtering Connection Error, {task.uuid} Send back in queue')
+                time.sleep(10)
+                return False
+            if crawlers.get_onion_lookup_error(domain):
+                # retried after the other tasks, once the onion error expired
+                task.add_to_db_crawler_queue(min(priority, self.onion_error_priority))
+                self.logger.warning(f'Onion Filtering Error, {domain}, {task.uuid} Send back in queue')
+                return False
+            # lookup in progress: checked at the next pass
+            if domain not in self.onion_lookups:
+                self.onion_lookups[domain] = self.onion_lookup_pool.submit(crawlers.prefetch_onion_lookup, domain)
+            task.add_to_db_crawler_queue(priority)
+            return False
+        if not crawlers.is_onion_verdict_safe(verdict, self.filter_unknown_onion):
+            # print('DOMAIN FILTERED')
+            task.delete()
+            return False
+        return True
+
+    def prefetch_onion_lookups(self):
+        """
+        Lookup the onions of the next tasks of the crawler queue, if their verdict isn't cached
+        """
+        for onion, future in list(self.onion_lookups.items()):
+            if future.done():
+                self.onion_lookups.pop(onion)
+        if len(self.onion_lookups) >= self.nb_onion_prefetch:
+            return None
+        onions = [domain for domain in crawlers.get_crawler_queue_next_domains(self.nb_onion_prefetch)
+                  if domain.endswith('.onion') and domain not in self.onion_lookups]
+        for onion, verdict in zip(onions, crawlers.get_onions_verdicts(onions)):
+            if not verdict and len(self.onion_lookups) < self.nb_onion_prefetch:
+                self.onion_lookups[onion] = self.onion_lookup_pool.submit(crawlers.prefetch_onion_lookup, onion)
+
+    def check_captures_status(self):
+        """
+        Get the status of all the in-flight captures in one concurrent sweep,
+        the done captures are saved by the ingestion workers
+        """
+        captures_uuids = [capture_uuid for capture_uuid in crawlers.get_crawler_captures_to_check()
+                          if capture_uuid not in self.ingesting]
+        if not captures_uuids:
+            return None
+        lacus_error = False
+        statuses = crawlers.get_captures_lacus_status(self.lacus, captures_uuids, self.status_pool)
+        for capture_uuid, status in statuses.items():
+            capture = crawlers.CrawlerCapture(capture_uuid)
+            if isinstance(status, Exception):
+                if isinstance(status, ConnectionError):
+                    lacus_error = True
+                self.logger.warning(f'Lacus {status.__class__.__name__}, capture {capture.uuid}')
+                capture.update(-1)
+            elif status == crawlers.CaptureStatus.DONE:
+                if len(self.ingesting) < self.ingestion_workers:
+                    capture.pop()
+                    self.ingesting[capture.uuid] = self.ingestion_pool.submit(self.compute, capture)
+                else:
+                    # wait for a free ingestion worker
+                    capture.update(status)
+            else:
+                self.update_capture_status(capture, status)
+        if lacus_error:
+            self.refresh_lacus_status()
+
+    def check_ingested_captures(self):
+        for capture_uuid, future in list(self.ingesting.items()):
+            if not future.done():
+                continue
+            self.ingesting.pop(capture_uuid)
+            err = future.exception()
+            if err:
+                # never raised: a failed capture must not stop the other captures ingestion
+                trace = ''.join(traceback.format_tb(err.__traceback__))
+                self.logger.critical(f'Error saving capture {capture_uuid}: {err}')
+                self.logger.critical(trace)
+                # the capture is failed, not saved again: the items and correlations already saved would be duplicated
+                capture = crawlers.CrawlerCapture(capture_uuid)
+                task = capture.get_task()
+                if task:
+                    self.logger.error(f'Capture {capture_uuid} failed, task {task.uuid} removed')
+                    task.remove()
+                else:
+                    self.logger.error(f'Capture {capture_uuid} failed, no task')
+                capture.remove()
+
+    def update_capture_status(self, capture, status):
+        if status == crawlers.CaptureStatus.UNKNOWN:
+            capture_start = capture.get_start_time(r_str=False)
+            if capture_start == 0:
+                task = capture.get_task()
+                task.delete()
+                capture.delete()
+                self.logger.warning(f'capture UNKNOWN ERROR STATE, {task.uuid} Removed from queue')
+                return None
+            if int(time.time()) - capture_start > 600:  # TODO ADD in new crawler config
+                task = capture.get_task()
+                task.reset()
+                capture.delete()
+                self.logger.warning(f'capture UNKNOWN Timeout, {task.uuid} Send back in queue')
+            else:
+                capture.update(status)
+        elif status == crawlers.CaptureStatus.QUEUED:
+            capture_start = capture.get_start_time(r_str=False)
+            if int(time.time()) - capture_start > 36000:  # TODO ADD in new crawler config
+                task = capture.get_task()
+                task.reset()
+                capture.delete()
+                self.logger.warning(f'capture QUEUED Timeout, {task.uuid}, {task.get_url()} Send back in queue, start_time={capture_start}')
+            else:
+                capture.update(status)
+            print(capture.uuid, crawlers.CaptureStatus(status).name, int(time.time()))
+        elif status == crawlers.CaptureStatus.ONGOING:
+            capture.update(status)
+            print(capture.uuid, crawlers.CaptureStatus(status).name, int(time.time()))
+        # Invalid State
+        else:
+            task = capture.get_task()
+            task.reset()
+            capture.delete()
+            self.logger.warning(f'ERROR INVALID CAPTURE STATUS {status}, {task.uuid} Send back in queue')
+
     def enqueue_capture(self, task_uuid, priority):
         task = crawlers.CrawlerTask(task_uuid)
         # print(task)
@@ -293,6 +401,9 @@ class Crawler(AbstractModule):
 
     # CRAWL DOMAIN
     def compute(self, capture):
+        """
+        Save a done capture, run by the ingestion workers
+        """
         print('saving capture', capture.uuid)
 
         task = capture.get_task()
@@ -306,9 +417,7 @@ class Crawler(AbstractModule):
                 print(f'Error: domain {domain}')
             return None
 
-        self.domain = Domain(domain)
-        self.parent = self.domain.get_parent()
-        self.original_domain = Domain(domain)
+        state = CaptureState(task, domain)
 
         epoch = int(time.time())
         parent_id = task.get_parent()
@@ -316,47 +425,39 @@ class Crawler(AbstractModule):
         entries = self.lacus.get_capture(capture.uuid)
 
         print(entries.get('status'))
-        self.har = task.get_har()
-        self.screenshot = task.get_screenshot()
-        # DEBUG
-        # self.har = True
-        # self.screenshot = True
-        self.date = crawlers.get_current_date(separator=True)
-        self.items_dir = crawlers.get_date_crawled_items_source(self.date)
-        self.root_item = None
 
         # Save Capture
-        saved = self.save_capture_response(parent_id, entries)
+        saved = self.save_capture_response(state, parent_id, entries)
         if saved:
-            if self.parent != 'lookup':
+            if state.parent != 'lookup':
                 # Update domain first/last seen
-                self.domain.update_daterange(self.date.replace('/', ''))
+                state.domain.update_daterange(state.date.replace('/', ''))
             # Origin + History + tags
-            if self.root_item:
-                self.domain.set_last_origin(parent_id)
+            if state.root_item:
+                state.domain.set_last_origin(parent_id)
                 # Vanity
-                self.domain.update_vanity_cluster()
-                domain_vanity = self.domain.get_vanity()
+                state.domain.update_vanity_cluster()
+                domain_vanity = state.domain.get_vanity()
                 if domain_vanity in self.vanity_tags:
                     for tag in self.vanity_tags[domain_vanity]:
-                        self.domain.add_tag(tag)
+                        state.domain.add_tag(tag)
                 # Tags
                 for tag in task.get_tags():
-                    self.domain.add_tag(tag)
+                    state.domain.add_tag(tag)
             # Crawler stats
-            self.domain.add_history(epoch, root_item=self.root_item)
+            state.domain.add_history(epoch, root_item=state.root_item)
 
-            if self.domain != self.original_domain:
-                self.original_domain.update_daterange(self.date.replace('/', ''))
-                if self.root_item:
-                    self.original_domain.set_last_origin(parent_id)
+            if state.domain != state.original_domain:
+                state.original_domain.update_daterange(state.date.replace('/', ''))
+                if state.root_item:
+                    state.original_domain.set_last_origin(parent_id)
                     # Tags
                     for tag in task.get_tags():
-                        self.domain.add_tag(tag)
-                self.original_domain.add_history(epoch, root_item=self.root_item)
-                # crawlers.update_last_crawled_domain(self.original_domain.get_domain_type(), self.original_domain.id, epoch)
+                        state.domain.add_tag(tag)
+                state.original_domain.add_history(epoch, root_item=state.root_item)
+                # crawlers.update_last_crawled_domain(state.original_domain.get_domain_type(), state.original_domain.id, epoch)
 
-            crawlers.update_last_crawled_domain(self.domain.get_domain_type(), self.domain.id, epoch)
+            crawlers.update_last_crawled_domain(state.domain.get_domain_type(), state.domain.id, epoch)
             print('capture:', capture.uuid, 'completed')
             print('task:   ', task.uuid, 'completed')
             print()
@@ -365,9 +466,8 @@ class Crawler(AbstractModule):
             print('task:   ', task.uuid, 'Unsafe Content Filtered')
             print()
         task.remove()
-        self.root_item = None
 
-    def save_capture_response(self, parent_id, entries):
+    def save_capture_response(self, state, parent_id, entries):
         print(entries.keys())
         if 'error' in entries:
             # TODO IMPROVE ERROR MESSAGE
@@ -382,11 +482,11 @@ class Crawler(AbstractModule):
             unpacked_last_url = crawlers.unpack_url(last_url)
             current_domain = unpacked_last_url['domain']
             # REDIRECTION TODO CHECK IF TYPE CHANGE
-            if current_domain != self.domain.id and not self.root_item:
-                self.logger.warning(f'External redirection {self.domain.id} -> {current_domain}')
-                print(f'External redirection {self.domain.id} -> {current_domain}')
-                if not self.root_item:
-                    self.domain = Domain(current_domain)
+            if current_domain != state.domain.id and not state.root_item:
+                self.logger.warning(f'External redirection {state.domain.id} -> {current_domain}')
+                print(f'External redirection {state.domain.id} -> {current_domain}')
+                if not state.root_item:
+                    state.domain = Domain(current_domain)
                     # Filter Domain
                     if self.filter_unsafe_onion:
                         if current_domain.endswith('.onion'):
@@ -396,10 +496,10 @@ class Crawler(AbstractModule):
         # TODO LAST URL
         # FIXME
         else:
-            last_url = f'http://{self.domain.id}'
+            last_url = f'http://{state.domain.id}'
 
         if 'html' in entries and entries.get('html'):
-            item_id = crawlers.create_item_id(self.items_dir, self.domain.id)
+            item_id = crawlers.create_item_id(state.items_dir, state.domain.id)
             item = Item(item_id)
             print(item.id)
 
@@ -414,65 +514,57 @@ class Crawler(AbstractModule):
 
             # TODO replace me with metadata to add
             crawlers.create_item_metadata(item_id, last_url, parent_id)
-            if self.root_item is None:
-                self.root_item = item_id
+            if state.root_item is None:
+                state.root_item = item_id
             parent_id = item_id
 
-            # DOM-HASH
-            dom_hash = DomHashs.create(entries['html'])
-            dom_hash.add(self.date.replace('/', ''), item)
-            dom_hash.add_correlation('domain', '', self.domain.id)
+            # HTML METADATA: DOM-HASH + TITLE, single pass
+            html_meta = crawlers.extract_html_metadata(entries['html'], url=last_url)
+            if html_meta['truncated']:
+                self.logger.warning(f'{state.domain.id}: HTML metadata extraction truncated, item {item.id}')
 
-            # TITLE
-            signal.alarm(60)
-            try:
-                title_content = crawlers.extract_title_from_html(entries['html'])
-            except TimeoutException:
-                self.logger.warning(f'BeautifulSoup HTML parser timeout: {item_id}')
-                title_content = None
-            else:
-                signal.alarm(0)
+            # DOM-HASH, skipped if the page wasn't fully parsed
+            if html_meta['dom_hash']:
+                dom_hash = DomHashs.create(entries['html'], obj_id=html_meta['dom_hash'])
+                dom_hash.add(state.date.replace('/', ''), item)
+                dom_hash.add_correlation('domain', '', state.domain.id)
 
+            # TITLE
+            title_content = html_meta['title']
             if title_content:
                 title = Titles.create_title(title_content)
                 title.add(item.get_date(), item)
                 # Tracker
-                self.tracker_yara.compute_manual(title)
+                with self.tracker_yara_lock:
+                    self.tracker_yara.compute_manual(title)
                 # if not title.is_tags_safe():
                 #     unsafe_tag = 'dark-web:topic="pornography-child-exploitation"'
-                #     self.domain.add_tag(unsafe_tag)
+                #     state.domain.add_tag(unsafe_tag)
                 #     item.add_tag(unsafe_tag)
                 self.add_message_to_queue(obj=title, message=msg, queue='Titles')
 
             # SCREENSHOT
-            if self.screenshot:
+            if state.screenshot:
                 if 'png' in entries and entries.get('png'):
                     screenshot = Screenshots.create_screenshot(entries['png'], b64=False)
                     if screenshot:
                         if not screenshot.is_tags_safe():
                             unsafe_tag = 'dark-web:topic="pornography-child-exploitation"'
-                            self.domain.add_tag(unsafe_tag)
+                            state.domain.add_tag(unsafe_tag)
                             item.add_tag(unsafe_tag)
                         # Remove Placeholder pages # TODO Replace with warning list ???
                         if screenshot.id not in self.placeholder_screenshots:
                             # Create Correlations
                             screenshot.add_correlation('item', '', item_id)
-                            screenshot.add_correlation('domain', '', self.domain.id)
+                            screenshot.add_correlation('domain', '', state.domain.id)
                         self.add_message_to_queue(obj=screenshot, queue='Images')
             # HAR
-            if self.har:
+            if state.har:
                 if 'har' in entries and entries.get('har'):
-                    har_id = crawlers.create_har_id(self.date, item_id)
+                    har_id = crawlers.create_har_id(state.date, item_id)
                     crawlers.save_har(har_id, entries['har'])
-                    for cookie_name in crawlers.extract_cookies_names_from_har(entries['har']):
-                        print(cookie_name)
-                        cookie = CookiesNames.create(cookie_name)
-                        cookie.add(self.date.replace('/', ''), self.domain)
-                    for etag_content in crawlers.extract_etag_from_har(entries['har']):
-                        print(etag_content)
-                        etag = Etags.create(etag_content)
-                        etag.add(self.date.replace('/', ''), self.domain)
-                    crawlers.extract_hhhash(entries['har'], self.domain.id, self.date.replace('/', ''))
+                    # Cookies names, etags and HHHashs
+                    self.add_message_to_queue(obj=state.domain, message=har_id, queue='Hars')
 
             # FAVICON
             if entries.get('potential_favicons'):
@@ -484,11 +576,19 @@ class Crawler(AbstractModule):
         entries_children = entries.get('children')
         if entries_children:
             for children in entries_children:
-                self.save_capture_response(parent_id, children)
+                self.save_capture_response(state, parent_id, children)
         return True
 
 
 if __name__ == '__main__':
     module = Crawler()
     module.debug = True
-    module.run()
+    try:
+        module.run()
+    finally:
+        module.ingestion_pool.shutdown(wait=True)
+        module.status_pool.shutdown()
+        # cancel the pending prefetches, shutdown(cancel_futures=True) requires python 3.9
+        for future in module.onion_lookups.values():
+            future.cancel()
+        module.onion_lookup_pool.shutdown()
@@ -12,6 +12,15 @@ import sys
 
 import importlib
 import json
+import traceback
+
+import psutil
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 sys.path.append(os.environ['AIL_BIN'])
 ##################################
@@ -20,19 +29,50 @@ sys.path.append(os.environ['AIL_BIN'])
 from importer.abstract_importer import AbstractImporter
 from modules.abstract_module import AbstractModule
 from lib.ConfigLoader import ConfigLoader
+from lib import ail_queues
 
 #### CONFIG ####
 config_loader = ConfigLoader()
 r_db = config_loader.get_db_conn('Kvrocks_DB')
+# Number of JSON messages popped and processed at once
+if config_loader.has_option('FeederImporter', 'batch_size'):
+    FEEDER_BATCH_SIZE = config_loader.get_config_int('FeederImporter', 'batch_size')
+else:
+    FEEDER_BATCH_SIZE = 1000
+if config_loader.has_option('FeederImporter', 'api_max_batch_size'):
+    API_MAX_BATCH_SIZE = config_loader.get_config_int('FeederImporter', 'api_max_batch_size')
+else:
+    API_MAX_BATCH_SIZE = 10000
 config_loader = None
 # --- CONFIG --- #
 
+NDJSON_MIMETYPES = {'application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines'}
+
 #### FUNCTIONS ####
 
 def add_json_feeder_to_queue(json_data):
     json_data = json.dumps(json_data)
     return r_db.rpush('importer:feeder', json_data)
 
+def add_json_feeders_to_queue(json_strs):
+    """
+    :param json_strs: list of JSON messages, already serialized
+    """
+    return r_db.rpush('importer:feeder', *json_strs)
+
+def get_feeder_processing_workers():
+    return r_db.smembers('importer:feeder:processing')
+
+def requeue_feeder_processing_messages():
+    """
+    Move the JSON messages of the dead importers back to the head of the feeder queue
+    """
+    for pid in get_feeder_processing_workers():
+        if not psutil.pid_exists(int(pid)):
+            while r_db.lmove(f'importer:feeder:processing:{pid}', 'importer:feeder', 'RIGHT', 'LEFT'):
+                pass
+            r_db.srem('importer:feeder:processing', pid)
+
 def api_add_json_feeder_to_queue(json_data):
     if not json_data:
         return {'status': 'error', 'reason': 'Malformed JSON'}, 400
@@ -42,6 +82,47 @@ def api_add_json_feeder_to_queue(json_data):
         return {'status': 'error'}, 400
     return {'status': 'success'}, 200
 
+def api_add_ndjson_feeder_to_queue(ndjson):
+    """
+    Add a batch of JSON messages, one JSON object per line (NDJSON)
+
+    :param ndjson: bytes or str
+    """
+    if isinstance(ndjson, bytes):
+        ndjson = ndjson.decode(errors='replace')
+    json_strs = []
+    for i, line in enumerate(ndjson.splitlines()):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            json_data = json_loads(line)
+        except ValueError:
+            return {'status': 'error', 'reason': f'Malformed JSON, line {i + 1}'}, 400
+        if not json_data or not isinstance(json_data, dict):
+            return {'status': 'error', 'reason': f'Malformed JSON, line {i + 1}'}, 400
+        json_strs.append(line)
+    if not json_strs:
+        return {'status': 'error', 'reason': 'Empty batch'}, 400
+    if len(json_strs) > API_MAX_BATCH_SIZE:
+        return {'status': 'error', 'reason': f'Batch too large, max {API_MAX_BATCH_SIZE} messages'}, 413
+    res = add_json_feeders_to_queue(json_strs)
+    if not res:
+        return {'status': 'error'}, 400
+    return {'status': 'success', 'nb_messages': len(json_strs)}, 200
+
+def get_json_group(json_data):
+    """
+    Group key of a JSON message: (feeder name, chat ID)
+    """
+    meta = json_data.get('meta')
+    chat_id = None
+    if isinstance(meta, dict):
+        chat = meta.get('chat')
+        if isinstance(chat, dict):
+            chat_id = chat.get('id')
+    return str(json_data.get('source')), str(chat_id)
+
 # --- FUNCTIONS --- #
 
 class FeederImporter(AbstractImporter):
@@ -82,9 +163,13 @@ class FeederImporter(AbstractImporter):
         cls = self.feeders[class_name]
         return cls(json_data)
 
-    def importer(self, json_data):
-
+    def importer(self, json_data, batch_cache=None):
+        """
+        :param batch_cache: dict shared by the messages of a batch, skip the chats and users metas already saved
+        """
         feeder = self.get_feeder(json_data)
+        if batch_cache is not None and hasattr(feeder, 'set_batch_cache'):
+            feeder.set_batch_cache(batch_cache)
 
         feeder_name = feeder.get_name()
         print(f'importing: {feeder_name} feeder')
@@ -130,16 +215,70 @@ class FeederModuleImporter(AbstractModule):
         config = ConfigLoader()
         self.r_db = config.get_db_conn('Kvrocks_DB')
         self.importer = FeederImporter()
+        self.batch_size = FEEDER_BATCH_SIZE
+        # JSON messages of the batch in process, moved back to the feeder queue if the importer dies
+        self.processing_key = f'importer:feeder:processing:{self.pid}'
+        requeue_feeder_processing_messages()
 
     def get_message(self):
-        return self.r_db.lpop('importer:feeder')
-        # TODO RELOAD LIST after delta
+        # Bulk mode: move a batch of JSON messages in the processing list, deleted once the batch is imported
+        nb_messages = min(self.r_db.llen('importer:feeder'), self.batch_size)
+        if not nb_messages:
+            return None
+        # the JSON messages are kept in the feeder queue while a module queue is saturated
+        ail_queues.wait_backpressure(self.module_name)
+        pipe = self.r_db.pipeline(transaction=False)
+        pipe.sadd('importer:feeder:processing', self.pid)
+        for _ in range(nb_messages):
+            pipe.lmove('importer:feeder', self.processing_key, 'LEFT', 'RIGHT')
+        messages = [json_str for json_str in pipe.execute()[1:] if json_str]
+        if not messages:
+            return None
+        return messages
+
+    def import_json(self, json_data, batch_cache=None):
+        """
+        :return: list of (AILObject, message) to send
+        """
+        return [(obj_message['obj'], obj_message['message'])
+                for obj_message in self.importer.importer(json_data, batch_cache=batch_cache)]
 
     def compute(self, message):
-        # TODO HANDLE Invalid JSON
-        json_data = json.loads(message)
-        for obj_message in self.importer.importer(json_data):
-            self.add_message_to_queue(obj=obj_message['obj'], message=obj_message['message'])
+        if isinstance(message, str):
+            self.add_messages_to_queue(self.import_json(json_loads(message)))
+            return None
+
+        # Group the messages by feeder and chat, the chats and users metas are saved once per batch
+        groups = {}
+        for json_str in message:
+            try:
+                json_data = json_loads(json_str)
+            except ValueError as e:
+                self.logger.error(f'Invalid JSON: {e}: {json_str[:200]}')
+                continue
+            if not isinstance(json_data, dict):
+                self.logger.error(f'Invalid JSON: not an object: {json_str[:200]}')
+                continue
+            groups.setdefault(get_json_group(json_data), []).append(json_data)
+
+        batch_cache = {}
+        objs_messages = []
+        try:
+            for json_datas in groups.values():
+                for json_data in json_datas:
+                    try:
+                        objs_messages.extend(self.import_json(json_data, batch_cache=batch_cache))
+                    except Exception as e:
+                        if self.debug:
+                            raise e
+                        # the other messages of the batch are still imported
+                        trace = ''.join(traceback.format_tb(e.__traceback__))
+                        self.logger.critical(f'Error importing JSON message: {e}, meta: {json_data.get("meta")}')
+                        self.logger.critical(trace)
+        finally:
+            # the objects of the batch are sent at once, pipelined
+            self.add_messages_to_queue(objs_messages)
+            self.r_db.delete(self.processing_key)
 
 
 # Launch Importer
@@ -7,10 +7,15 @@ Importer Class
 Import Content
 
 """
+import datetime
+import json
 import logging.config
+import multiprocessing
 import os
 import sys
+import time
 
+import xxhash
 
 sys.path.append(os.environ['AIL_BIN'])
 ##################################
@@ -19,13 +24,41 @@ sys.path.append(os.environ['AIL_BIN'])
 from importer.abstract_importer import AbstractImporter
 # from modules.abstract_module import AbstractModule
 from lib import ail_logger
+from lib import ail_queues
 # from lib.ail_queues import AILQueue
 from lib import ail_files  # TODO RENAME ME
+from lib import ConfigLoader
 
 from lib.objects.Items import Item
 
 logging.config.dictConfig(ail_logger.get_config(name='modules'))
 
+#### CONFIG ####
+config_loader = ConfigLoader.ConfigLoader()
+r_db = config_loader.get_db_conn('Kvrocks_DB')
+config_loader = None
+# --- CONFIG --- #
+
+# Number of files sent at once to a DirImporter worker
+DIR_IMPORT_CHUNK_SIZE = 16
+# Seconds between two progress reports
+DIR_IMPORT_REPORT_INTERVAL = 10
+
+def get_content_hash(content):
+    return xxhash.xxh3_128_hexdigest(content)
+
+def claim_imported_file(feeder_name, content_hash):
+    """
+    :return: True if the content was not already imported by this feeder, the content hash is claimed atomically
+    """
+    return r_db.sadd(f'importer:file:hashes:{feeder_name}', content_hash) == 1
+
+def delete_imported_file(feeder_name, content_hash):
+    r_db.srem(f'importer:file:hashes:{feeder_name}', content_hash)
+
+def delete_imported_files(feeder_name):
+    r_db.delete(f'importer:file:hashes:{feeder_name}')
+
 class FileImporter(AbstractImporter):
     def __init__(self, feeder='file_import'):
         super().__init__(queue=True)
@@ -33,42 +66,184 @@ class FileImporter(AbstractImporter):
 
         self.feeder_name = feeder  # TODO sanityze feeder name
 
-    def importer(self, path):
+    def importer(self, path, skip_imported=False):
+        """
+        :param skip_imported: skip the files already imported by this feeder, by content hash
+        :return: item id if the file was imported
+        """
         if os.path.isfile(path):
             with open(path, 'rb') as f:
                 content = f.read()
             if content:
-                mimetype = ail_files.get_mimetype(content)
-                item_id = ail_files.create_item_id(self.feeder_name, path)
-                gzipped = False
-                if mimetype == 'application/gzip':
-                    gzipped = True
-                elif not ail_files.is_text(mimetype):  # # # #
+                if not skip_imported:
+                    return self._import_content(path, content)
+                # claimed before sending: an identical file imported by another worker is skipped
+                content_hash = get_content_hash(content)
+                if not claim_imported_file(self.feeder_name, content_hash):
                     return None
+                try:
+                    item_id = self._import_content(path, content)
+                except Exception:
+                    delete_imported_file(self.feeder_name, content_hash)
+                    raise
+                if not item_id:
+                    delete_imported_file(self.feeder_name, content_hash)
+                return item_id
+
+    def _import_content(self, path, content):
+        """
+        :return: item id if the content was sent
+        """
+        mimetype = ail_files.get_mimetype(content)
+        item_id = ail_files.create_item_id(self.feeder_name, path)
+        gzipped = False
+        if mimetype == 'application/gzip':
+            gzipped = True
+        elif not ail_files.is_text(mimetype):  # # # #
+            return None
+
+        source = 'dir_import'
+        message = self.create_message(content, gzipped=gzipped, source=source)
+        self.logger.info(f'{source} {item_id}')
+        obj = Item(item_id)
+        if message:
+            self.add_message_to_queue(obj, message=message)
+            return item_id
+
+# DirImporter worker process
+_worker = {}
 
-                source = 'dir_import'
-                message = self.create_message(content, gzipped=gzipped, source=source)
-                self.logger.info(f'{source} {item_id}')
-                obj = Item(item_id)
-                if message:
-                    self.add_message_to_queue(obj, message=message)
+def _init_dir_importer_worker(feeder_name, skip_imported):
+    ConfigLoader.reset_connection_pools()
+    _worker['importer'] = FileImporter(feeder=feeder_name)
+    _worker['skip_imported'] = skip_imported
+
+def _import_dir_file(file_meta):
+    path, size = file_meta
+    # bulk import: pause while a module queue is saturated
+    ail_queues.wait_backpressure(_worker['importer'].feeder_name)
+    try:
+        item_id = _worker['importer'].importer(path, skip_imported=_worker['skip_imported'])
+    except Exception as e:
+        return path, size, None, str(e)
+    return path, size, item_id, None
+
+def get_dir_files(dir_path):
+    """
+    :return: sorted list of (path, size)
+    """
+    files = []
+    for dirname, _, filenames in os.walk(dir_path):
+        for filename in filenames:
+            path = os.path.join(dirname, filename)
+            try:
+                files.append((path, os.path.getsize(path)))
+            except OSError:
+                continue
+    files.sort()
+    return files
+
+def get_dir_checkpoint(dir_path):
+    """
+    Default checkpoint file of a directory import
+    """
+    dir_hash = xxhash.xxh3_64_hexdigest(os.fsencode(os.path.abspath(dir_path)))
+    return os.path.join(os.getcwd(), f'dir_import_{dir_hash}.checkpoint')
+
+def get_checkpoint_paths(checkpoint):
+    """
+    :return: set of the files already processed, one JSON encoded path per line
+    """
+    paths = set()
+    if os.path.isfile(checkpoint):
+        with open(checkpoint, 'r') as f:
+            for line in f:
+                try:
+                    paths.add(json.loads(line))
+                except ValueError:  # interrupted write
+                    continue
+    return paths
 
 class DirImporter(AbstractImporter):
-    def __init__(self):
+    def __init__(self, feeder='file_import', nb_processes=None, checkpoint=None, skip_imported=True):
+        """
+        Import a directory with a pool of processes, resumable
+
+        :param nb_processes: number of processes, default: number of CPUs
+        :param checkpoint: file of the processed paths, default: get_dir_checkpoint
+        :param skip_imported: skip the files already imported by this feeder, by content hash
+        """
         super().__init__()
         self.logger = logging.getLogger(f'{self.__class__.__name__}')
-        self.file_importer = FileImporter()
+        self.feeder_name = feeder
+        self.nb_processes = nb_processes
+        self.checkpoint = checkpoint
+        self.skip_imported = skip_imported
+
+    def report(self, nb_files, nb_done, size, size_done, start):
+        duration = time.time() - start
+        if duration and size_done:
+            eta = datetime.timedelta(seconds=int((size - size_done) * duration / size_done))
+        else:
+            eta = '-'
+        message = (f'{nb_done}/{nb_files} files, {nb_done / duration if duration else 0:.1f} files/s, '
+                   f'{size_done / (1024 * 1024 * duration) if duration else 0:.1f} MB/s, ETA {eta}')
+        self.logger.info(message)
+        print(message)
 
     def importer(self, dir_path):
+        """
+        The processed files are saved in the checkpoint file, a restarted import skips them.
+        The workers pause while the Importers queue is saturated (Modules_Backpressure).
+
+        :return: number of imported files, number of errors
+        """
         if not os.path.isdir(dir_path):
             message = f'Error, {dir_path} is not a directory'
             self.logger.warning(message)
             raise Exception(message)
+        checkpoint = self.checkpoint
+        if not checkpoint:
+            checkpoint = get_dir_checkpoint(dir_path)
+
+        files = get_dir_files(dir_path)
+        done = get_checkpoint_paths(checkpoint)
+        if done:
+            files = [file_meta for file_meta in files if file_meta[0] not in done]
+            print(f'Resuming {dir_path}: {len(done)} files already processed, checkpoint: {checkpoint}')
+        else:
+            print(f'Importing {dir_path}, checkpoint: {checkpoint}')
+        done = None
 
-        for dirname, _, filenames in os.walk(dir_path):
-            for filename in filenames:
-                path = os.path.join(dirname, filename)
-                self.file_importer.importer(path)
+        nb_files = len(files)
+        size = sum(file_meta[1] for file_meta in files)
+        nb_done = 0
+        nb_imported = 0
+        nb_errors = 0
+        size_done = 0
+        start = time.time()
+        next_report = start + DIR_IMPORT_REPORT_INTERVAL
+        with open(checkpoint, 'a') as f_checkpoint:
+            with multiprocessing.Pool(processes=self.nb_processes, initializer=_init_dir_importer_worker,
+                                      initargs=(self.feeder_name, self.skip_imported)) as pool:
+                for path, file_size, item_id, error in pool.imap_unordered(_import_dir_file, files,
+                                                                           chunksize=DIR_IMPORT_CHUNK_SIZE):
+                    nb_done += 1
+                    size_done += file_size
+                    if error:
+                        # retried at the next run
+                        nb_errors += 1
+                        self.logger.error(f'{path}: {error}')
+                    else:
+                        if item_id:
+                            nb_imported += 1
+                        f_checkpoint.write(f'{json.dumps(path)}\n')
+                    if time.time() > next_report:
+                        f_checkpoint.flush()
+                        self.report(nb_files, nb_done, size, size_done, start)
+                        next_report = time.time() + DIR_IMPORT_REPORT_INTERVAL
+        self.report(nb_files, nb_done, size, size_done, start)
+        return nb_imported, nb_errors
 
 
 # if __name__ == '__main__':
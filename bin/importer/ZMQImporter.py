@@ -7,8 +7,12 @@ Importer Class
 ZMQ Importer
 
 """
+import base64
+import binascii
 import os
 import sys
+import zlib
+
 import zmq
 
 sys.path.append(os.environ['AIL_BIN'])
@@ -21,39 +25,97 @@ from lib.ConfigLoader import ConfigLoader
 
 from lib.objects.Items import Item
 
+#### CONFIG ####
+config_loader = ConfigLoader()
+r_db = config_loader.get_db_conn('Kvrocks_DB')
+# Receive queue size of each ZMQ socket, the messages received once the queue is full are dropped
+if config_loader.has_option('ZMQ_Global', 'receive_hwm'):
+    ZMQ_RCVHWM = config_loader.get_config_int('ZMQ_Global', 'receive_hwm')
+else:
+    ZMQ_RCVHWM = 10000
+config_loader = None
+# --- CONFIG --- #
+
+# milliseconds
+ZMQ_POLL_TIMEOUT = 1000
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+def is_valid_gzip64(gzip64encoded):
+    """
+    Check a base64 encoded gzip payload without decompressing all of it
+
+    :return: False if the base64 or the gzip is invalid or if the content is empty
+    """
+    try:
+        gzipped = base64.b64decode(gzip64encoded)
+    except (binascii.Error, ValueError):
+        return False
+    if not gzipped.startswith(GZIP_MAGIC):
+        return False
+    try:
+        # decompress the first byte
+        return bool(zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(gzipped, 1))
+    except zlib.error:
+        return False
+
+def get_zmq_stats():
+    return r_db.hgetall('importer:zmq:stats')
+
 class ZMQImporters(AbstractImporter):
-    def __init__(self):
+    def __init__(self, rcvhwm=ZMQ_RCVHWM):
         super().__init__()
+        self.context = zmq.Context()
         self.subscribers = []
+        self.rcvhwm = rcvhwm
+        # Number of times a socket receive queue was found full, the publishers drop the next messages
+        self.nb_hwm_reached = 0
         # Initialize poll set
         self.poller = zmq.Poller()
 
     def add(self, address, channel):
-        context = zmq.Context()
-        subscriber = context.socket(zmq.SUB)
-        r = subscriber.connect(address)
-        print(r)
+        subscriber = self.context.socket(zmq.SUB)
+        # set before connect
+        subscriber.setsockopt(zmq.RCVHWM, self.rcvhwm)
+        subscriber.connect(address)
         subscriber.setsockopt_string(zmq.SUBSCRIBE, channel)
         self.subscribers.append(subscriber)
 
         self.poller.register(subscriber, zmq.POLLIN)
 
-    def importer(self, timeout=None):  # -> FOR loop required
+    def importer(self, timeout=None):
         """
+        Wait for messages, then drain all the ready messages of the sockets
+
         :param timeout: The timeout (in milliseconds) to wait for an event.
         If unspecified (or specified None), will wait forever for an event.
-        :returns: messages generator
+        :returns: list of messages
         """
-        for event in self.poller.poll(timeout=timeout):
-            socket, event_mask = event
-            # DEBUG
-            print(socket, event_mask)
-            yield socket.recv()
+        messages = []
+        for socket, _ in self.poller.poll(timeout=timeout):
+            nb_messages = 0
+            # a socket queue holds at most rcvhwm messages
+            while nb_messages < self.rcvhwm:
+                try:
+                    messages.append(socket.recv(zmq.NOBLOCK))
+                except zmq.Again:
+                    break
+                nb_messages += 1
+            if nb_messages >= self.rcvhwm:
+                self.nb_hwm_reached += 1
+        return messages
+
+    def close(self):
+        for subscriber in self.subscribers:
+            subscriber.close(linger=0)
+        self.context.term()
 
 
 class ZMQModuleImporter(AbstractModule):
     def __init__(self):
         super().__init__()
+        # the poll timeout is the waiting time
+        self.pending_seconds = 0
 
         config_loader = ConfigLoader()
         self.default_feeder_name = config_loader.get_config_str("Module_Mixer", "default_unnamed_feed_name")
@@ -64,29 +126,55 @@ class ZMQModuleImporter(AbstractModule):
         self.zmq_importer = ZMQImporters()
         for address in addresses:
             self.zmq_importer.add(address.strip(), channel)
+        self.nb_hwm_reached = 0
 
     def get_message(self):
-        for message in self.zmq_importer.importer():
+        return self.zmq_importer.importer(timeout=ZMQ_POLL_TIMEOUT)
+
+    def parse_message(self, message):
+        """
+        :param message: b'<channel> <feeder_name>>><obj_id> <gzip64encoded>'
+        :return: (obj, relay message) or None if the message is invalid
+        """
+        try:
             # remove channel from message
-            yield message.split(b' ', 1)[1]
+            message = message.split(b' ', 1)[1].decode()
+            obj_id, gzip64encoded = message.split(' ', 1)
+        except (IndexError, ValueError):
+            return None
+        if not is_valid_gzip64(gzip64encoded):
+            return None
+        splitted = obj_id.split('>>', 1)
+        if len(splitted) == 2:
+            feeder_name, obj_id = splitted
+        else:
+            feeder_name = self.default_feeder_name
+        # f'{source} {content}'
+        return Item(obj_id), f'{feeder_name} {gzip64encoded}'
 
     def compute(self, messages):
+        objs_messages = []
+        nb_invalid = 0
         for message in messages:
-            message = message.decode()
-
-            obj_id, gzip64encoded = message.split(' ', 1)  # TODO ADD LOGS
-            splitted = obj_id.split('>>', 1)
-            if len(splitted) == 2:
-                feeder_name, obj_id = splitted
+            obj_message = self.parse_message(message)
+            if obj_message:
+                objs_messages.append(obj_message)
             else:
-                feeder_name = self.default_feeder_name
-
-            obj = Item(obj_id)
-            # f'{source} {content}'
-            relay_message = f'{feeder_name} {gzip64encoded}'
-
-            print(f'feeder_name item::{obj_id}')
-            self.add_message_to_queue(obj=obj, message=relay_message)
+                nb_invalid += 1
+        self.add_messages_to_queue(objs_messages)
+
+        # Stats
+        nb_hwm_reached = self.zmq_importer.nb_hwm_reached - self.nb_hwm_reached
+        self.nb_hwm_reached = self.zmq_importer.nb_hwm_reached
+        pipe = r_db.pipeline(transaction=False)
+        pipe.hincrby('importer:zmq:stats', 'received', len(messages))
+        if nb_invalid:
+            self.logger.warning(f'{nb_invalid} invalid messages')
+            pipe.hincrby('importer:zmq:stats', 'invalid', nb_invalid)
+        if nb_hwm_reached:
+            self.logger.warning('ZMQ receive queue full, messages may be dropped, increase [ZMQ_Global] receive_hwm')
+            pipe.hincrby('importer:zmq:stats', 'hwm_reached', nb_hwm_reached)
+        pipe.execute()
 
 
 if __name__ == '__main__':
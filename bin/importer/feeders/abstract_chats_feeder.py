@@ -57,6 +57,34 @@ class AbstractChatFeeder(DefaultFeeder, ABC):
         super().__init__(json_data)
         self.obj = None
         self.name = name
+        self.chat_instance_uuid = None
+        # metas saved by the previous messages of the batch: (obj global id, field): value
+        self.batch_cache = None
+
+    def set_batch_cache(self, batch_cache):
+        self.batch_cache = batch_cache
+
+    def _is_new_meta(self, obj, field, value):
+        """
+        Return False if the same meta was already saved by a previous message of the batch
+        """
+        if self.batch_cache is None:
+            return True
+        key = (obj.get_global_id(), field)
+        if key in self.batch_cache and self.batch_cache[key] == value:
+            return False
+        self.batch_cache[key] = value
+        return True
+
+    def _create_image(self, b64_content):
+        if self.batch_cache is None:
+            return Images.create(b64_content, b64=True)
+        key = ('image', b64_content)
+        img = self.batch_cache.get(key)
+        if not img:
+            img = Images.create(b64_content, b64=True)
+            self.batch_cache[key] = img
+        return img
 
     def get_chat_protocol(self):  # TODO # # # # # # # # # # # # #
         return self.name
@@ -68,11 +96,18 @@ class AbstractChatFeeder(DefaultFeeder, ABC):
         self.json_data['meta'].get('address', None)
 
     def get_chat_instance_uuid(self):
-        chat_instance_uuid = chats_viewer.create_chat_service_instance(self.get_chat_protocol(),
-                                                                       network=self.get_chat_network(),
-                                                                       address=self.get_chat_address())
+        if not self.chat_instance_uuid:
+            key = ('chat_instance', self.get_chat_protocol(), self.get_chat_network(), self.get_chat_address())
+            if self.batch_cache is not None and key in self.batch_cache:
+                self.chat_instance_uuid = self.batch_cache[key]
+            else:
+                self.chat_instance_uuid = chats_viewer.create_chat_service_instance(self.get_chat_protocol(),
+                                                                                    network=self.get_chat_network(),
+                                                                                    address=self.get_chat_address())
+                if self.batch_cache is not None:
+                    self.batch_cache[key] = self.chat_instance_uuid
         # TODO SET
-        return chat_instance_uuid
+        return self.chat_instance_uuid
 
     def get_chat_id(self):  # TODO RAISE ERROR IF NONE
         return self.json_data['meta']['chat']['id']
@@ -180,19 +215,20 @@ class AbstractChatFeeder(DefaultFeeder, ABC):
         # Obj Daterange
         chat.add(date)
 
-        if meta_chat.get('name'):
+        if meta_chat.get('name') and self._is_new_meta(chat, 'name', meta_chat['name']):
             chat.set_name(meta_chat['name'])
 
-        if meta_chat.get('info'):
+        if meta_chat.get('info') and self._is_new_meta(chat, 'info', meta_chat['info']):
             chat.set_info(meta_chat['info'])
 
-        if meta_chat.get('date'): # TODO check if already exists
+        if meta_chat.get('date') and self._is_new_meta(chat, 'created_at', meta_chat['date']['timestamp']): # TODO check if already exists
             chat.set_created_at(int(meta_chat['date']['timestamp']))
 
         if meta_chat.get('icon'):
-            img = Images.create(meta_chat['icon'], b64=True)
+            img = self._create_image(meta_chat['icon'])
             img.add(date, chat)
-            chat.set_icon(img.get_global_id())
+            if self._is_new_meta(chat, 'icon', img.id):
+                chat.set_icon(img.get_global_id())
             if new_objs:
                 new_objs.add(img)
 
@@ -214,19 +250,20 @@ class AbstractChatFeeder(DefaultFeeder, ABC):
         # date stat + correlation
         chat.add(date, obj)
 
-        if meta.get('name'):
+        if meta.get('name') and self._is_new_meta(chat, 'name', meta['name']):
             chat.set_name(meta['name'])
 
-        if meta.get('info'):
+        if meta.get('info') and self._is_new_meta(chat, 'info', meta['info']):
             chat.set_info(meta['info'])
 
-        if meta.get('date'): # TODO check if already exists
+        if meta.get('date') and self._is_new_meta(chat, 'created_at', meta['date']['timestamp']): # TODO check if already exists
             chat.set_created_at(int(meta['date']['timestamp']))
 
         if meta.get('icon'):
-            img = Images.create(meta['icon'], b64=True)
+            img = self._create_image(meta['icon'])
             img.add(date, chat)
-            chat.set_icon(img.get_global_id())
+            if self._is_new_meta(chat, 'icon', img.id):
+                chat.set_icon(img.get_global_id())
             new_objs.add(img)
 
         if meta.get('username'):
@@ -235,8 +272,9 @@ class AbstractChatFeeder(DefaultFeeder, ABC):
 
         if meta.get('subchannel'):
             subchannel, thread = self.process_subchannel(obj, date, timestamp, reply_id=reply_id)
-            chat.add_children(obj_global_id=subchannel.get_global_id())
-            if obj.type == 'message':
+            if self._is_new_meta(chat, f'child:{subchannel.get_global_id()}', True):
+                chat.add_children(obj_global_id=subchannel.get_global_id())
+            if obj.type == 'message' and self._is_new_meta(chat, 'with_messages', True):
                 chat.add_chat_with_messages()
         else:
             if obj.type == 'message':
@@ -244,7 +282,8 @@ class AbstractChatFeeder(DefaultFeeder, ABC):
                     thread = self.process_thread(obj, chat, date, timestamp, reply_id=reply_id)
                 else:
                     chat.add_message(obj.get_global_id(), self.get_message_id(), timestamp, reply_id=reply_id)
-                chat.add_chat_with_messages()
+                if self._is_new_meta(chat, 'with_messages', True):
+                    chat.add_chat_with_messages()
 
         chats_obj = [chat]
         if subchannel:
@@ -260,14 +299,14 @@ class AbstractChatFeeder(DefaultFeeder, ABC):
 
         subchannel.add(date, obj)
 
-        if meta.get('date'): # TODO check if already exists
+        if meta.get('date') and self._is_new_meta(subchannel, 'created_at', meta['date']['timestamp']): # TODO check if already exists
             subchannel.set_created_at(int(meta['date']['timestamp']))
 
-        if meta.get('name'):
+        if meta.get('name') and self._is_new_meta(subchannel, 'name', meta['name']):
             subchannel.set_name(meta['name'])
             # subchannel.update_name(meta['name'], timestamp) # TODO #################
 
-        if meta.get('info'):
+        if meta.get('info') and self._is_new_meta(subchannel, 'info', meta['info']):
             subchannel.set_info(meta['info'])
 
         if obj.type == 'message':
@@ -315,20 +354,21 @@ class AbstractChatFeeder(DefaultFeeder, ABC):
             username.add(date)  # TODO # correlation message ??? ###############################################################
 
         # ADDITIONAL METAS
-        if meta.get('firstname'):
+        if meta.get('firstname') and self._is_new_meta(user_account, 'firstname', meta['firstname']):
             user_account.set_first_name(meta['firstname'])
-        if meta.get('lastname'):
+        if meta.get('lastname') and self._is_new_meta(user_account, 'lastname', meta['lastname']):
             user_account.set_last_name(meta['lastname'])
-        if meta.get('phone'):
+        if meta.get('phone') and self._is_new_meta(user_account, 'phone', meta['phone']):
             user_account.set_phone(meta['phone'])
 
         if meta.get('icon'):
-            img = Images.create(meta['icon'], b64=True)
+            img = self._create_image(meta['icon'])
             img.add(date, user_account)
-            user_account.set_icon(img.get_global_id())
+            if self._is_new_meta(user_account, 'icon', img.id):
+                user_account.set_icon(img.get_global_id())
             new_objs.add(img)
 
-        if meta.get('info'):
+        if meta.get('info') and self._is_new_meta(user_account, 'info', meta['info']):
             user_account.set_info(meta['info'])
 
         user_account.add(date)
@@ -354,20 +394,21 @@ class AbstractChatFeeder(DefaultFeeder, ABC):
             username.add(date)  # TODO # correlation message ???
 
         # ADDITIONAL METAS
-        if meta.get('firstname'):
+        if meta.get('firstname') and self._is_new_meta(user_account, 'firstname', meta['firstname']):
             user_account.set_first_name(meta['firstname'])
-        if meta.get('lastname'):
+        if meta.get('lastname') and self._is_new_meta(user_account, 'lastname', meta['lastname']):
             user_account.set_last_name(meta['lastname'])
-        if meta.get('phone'):
+        if meta.get('phone') and self._is_new_meta(user_account, 'phone', meta['phone']):
             user_account.set_phone(meta['phone'])
 
         if meta.get('icon'):
-            img = Images.create(meta['icon'], b64=True)
+            img = self._create_image(meta['icon'])
             img.add(date, user_account)
-            user_account.set_icon(img.get_global_id())
+            if self._is_new_meta(user_account, 'icon', img.id):
+                user_account.set_icon(img.get_global_id())
             new_objs.add(img)
 
-        if meta.get('info'):
+        if meta.get('info') and self._is_new_meta(user_account, 'info', meta['info']):
             user_account.set_info(meta['info'])
 
         return user_account
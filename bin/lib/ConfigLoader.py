@@ -13,7 +13,8 @@ import redis
 import configparser
 
 # Get Config file
-config_dir = os.path.join(os.environ['AIL_HOME'], 'configs')
+# AIL_CONFIG_DIR: alternative configs directory, used by the benchmark throwaway instance
+config_dir = os.environ.get('AIL_CONFIG_DIR', os.path.join(os.environ['AIL_HOME'], 'configs'))
 default_config_file = os.path.join(config_dir, 'core.cfg')
 if not os.path.exists(default_config_file):
     raise Exception('Unable to find the configuration file. \
@@ -24,6 +25,61 @@ if not os.path.exists(default_config_file):
 
  # # TODO: add config_field to reload
 
+# # # # Connections Pools # # # #
+
+# Process-wide connection pools, shared by all the Redis/Kvrocks clients with the same (host, port, db)
+# (host, port, db, password, decode_responses): redis.ConnectionPool
+CONNECTION_POOLS = {}
+CONNECTION_POOLS_PID = os.getpid()
+
+def _get_connection_pools_config(cfg):
+    pools_config = {'max_connections': None, 'socket_keepalive': True, 'health_check_interval': 30}
+    if cfg and cfg.has_section('DB_Connections'):
+        if cfg.has_option('DB_Connections', 'max_connections'):
+            pools_config['max_connections'] = cfg.getint('DB_Connections', 'max_connections')
+        if cfg.has_option('DB_Connections', 'socket_keepalive'):
+            pools_config['socket_keepalive'] = cfg.getboolean('DB_Connections', 'socket_keepalive')
+        if cfg.has_option('DB_Connections', 'health_check_interval'):
+            pools_config['health_check_interval'] = cfg.getint('DB_Connections', 'health_check_interval')
+    return pools_config
+
+def get_connection_pool(host, port, db=0, password=None, decode_responses=True, max_connections=None, cfg=None):
+    """
+    Return the process connection pool of a DB, the connections are lazily created on first use
+    """
+    if os.getpid() != CONNECTION_POOLS_PID:
+        reset_connection_pools()
+    key = (host, port, db, password, decode_responses)
+    pool = CONNECTION_POOLS.get(key)
+    if not pool:
+        pools_config = _get_connection_pools_config(cfg)
+        if max_connections:
+            pools_config['max_connections'] = max_connections
+        pool_kwargs = {'host': host, 'port': port, 'db': db, 'password': password,
+                       'decode_responses': decode_responses,
+                       'socket_keepalive': pools_config['socket_keepalive'],
+                       'health_check_interval': pools_config['health_check_interval']}
+        if pools_config['max_connections']:
+            # limited pool: wait up to 20s for a free connection, then raise a ConnectionError
+            pool = redis.BlockingConnectionPool(max_connections=pools_config['max_connections'], **pool_kwargs)
+        else:
+            pool = redis.ConnectionPool(**pool_kwargs)
+        CONNECTION_POOLS[key] = pool
+    return pool
+
+def reset_connection_pools():
+    """
+    Drop the connections inherited from the parent process. Call it after a fork (multiprocessing).
+    """
+    global CONNECTION_POOLS_PID
+    for pool in CONNECTION_POOLS.values():
+        pool.reset()
+    CONNECTION_POOLS_PID = os.getpid()
+
+def get_nb_connection_pools():
+    return len(CONNECTION_POOLS)
+
+
 class ConfigLoader(object):
     """docstring for Config_Loader."""
 
@@ -34,17 +90,28 @@ class ConfigLoader(object):
         else:
             self.cfg.read(default_config_file)
 
+    def _get_max_connections(self, db_name):
+        if self.cfg.has_option(db_name, 'max_connections'):
+            return self.cfg.getint(db_name, 'max_connections')
+        return None
+
     def get_redis_conn(self, redis_name, decode_responses=True):
-        return redis.StrictRedis(host=self.cfg.get(redis_name, "host"),
-                                  port=self.cfg.getint(redis_name, "port"),
-                                  db=self.cfg.getint(redis_name, "db"),
-                                  decode_responses=decode_responses)
+        pool = get_connection_pool(self.cfg.get(redis_name, "host"),
+                                   self.cfg.getint(redis_name, "port"),
+                                   db=self.cfg.getint(redis_name, "db"),
+                                   decode_responses=decode_responses,
+                                   max_connections=self._get_max_connections(redis_name),
+                                   cfg=self.cfg)
+        return redis.StrictRedis(connection_pool=pool)
 
     def get_db_conn(self, db_name, decode_responses=True):
-        return redis.StrictRedis(host=self.cfg.get(db_name, "host"),
-                                  port=self.cfg.getint(db_name, "port"),
-                                  password=self.cfg.get(db_name, "password"),
-                                  decode_responses=decode_responses)
+        pool = get_connection_pool(self.cfg.get(db_name, "host"),
+                                   self.cfg.getint(db_name, "port"),
+                                   password=self.cfg.get(db_name, "password"),
+                                   decode_responses=decode_responses,
+                                   max_connections=self._get_max_connections(db_name),
+                                   cfg=self.cfg)
+        return redis.StrictRedis(connection_pool=pool)
 
     def get_files_directory(self, key_name):
         directory_path = self.cfg.get('Directories', key_name)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 # -*-coding:UTF-8 -*
+import hashlib
 import json
 import os
 import logging
@@ -38,6 +39,10 @@ logger = logging.getLogger()
 config_loader = ConfigLoader.ConfigLoader()
 r_cache = config_loader.get_redis_conn("Redis_Cache")
 r_tracker = config_loader.get_db_conn("Kvrocks_Trackers")
+if config_loader.has_option('Directories', 'yara_compiled'):
+    YARA_COMPILED_DIR = config_loader.get_files_directory('yara_compiled')
+else:
+    YARA_COMPILED_DIR = os.path.join(os.environ['AIL_HOME'], 'YARA_COMPILED')
 config_loader = None
 
 # NLTK tokenizer
@@ -320,7 +325,7 @@ class Tracker:
 
     def get_rule(self):
         yar_path = self.get_tracked()
-        return yara.compile(filepath=os.path.join(get_yara_rules_dir(), yar_path))
+        return load_yara_rules({'default': os.path.join(get_yara_rules_dir(), yar_path)})
 
     def get_meta(self, options):
         if not options:
@@ -460,13 +465,7 @@ class Tracker:
             tracker_type = 'yara'
 
         elif tracker_type == 'typosquatting':
-
-            from ail_typo_squatting import runAll
-
-            domain = to_track.split(" ")[0]
-            typo_generation = runAll(domain=domain, limit=math.inf, formatoutput="text", pathOutput="-", verbose=False) # TODO REPLACE LIMIT BY -1
-            for typo in typo_generation:
-                r_tracker.sadd(f'tracker:typosquatting:{to_track}', typo)
+            _add_typosquatting_domains(to_track, generate_typosquatting_domains(to_track))
 
         # create metadata
         self._set_field('tracked', to_track)
@@ -533,9 +532,9 @@ class Tracker:
             to_track = save_yara_rule(tracker_type, to_track, tracker_uuid=self.uuid)
             tracker_type = 'yara'
 
-        # TODO TYPO EDIT
         elif tracker_type == 'typosquatting':
-            pass
+            if old_type != 'typosquatting' or to_track != old_to_track:
+                _add_typosquatting_domains(to_track, generate_typosquatting_domains(to_track))
 
         if tracker_type != old_type:
             # LEVEL
@@ -547,7 +546,8 @@ class Tracker:
                     if filepath:
                         os.remove(filepath)
             if old_type == 'typosquatting':
-                r_tracker.delete(f'tracker:typosquatting:{old_to_track}')
+                if not get_trackers_by_tracked(old_type, old_to_track) - {self.uuid}:
+                    _delete_typosquatting_domains(old_to_track)
             self._set_field('type', tracker_type)
 
             # create all tracker set
@@ -568,6 +568,9 @@ class Tracker:
         # To Track Edited
         if to_track != old_to_track:
             self._set_field('tracked', to_track)
+            if old_type == 'typosquatting' and tracker_type == old_type:
+                if not get_trackers_by_tracked(old_type, old_to_track) - {self.uuid}:
+                    _delete_typosquatting_domains(old_to_track)
 
         self._set_field('description', description)
         self._set_field('webhook', webhook)
@@ -612,7 +615,9 @@ class Tracker:
         tracked = self.get_tracked()
 
         if tracker_type == 'typosquatting':
-            r_tracker.delete(f'tracker:typosquatting:{tracked}')
+            # typo domains shared with other trackers
+            if not get_trackers_by_tracked(tracker_type, tracked) - {self.uuid}:
+                _delete_typosquatting_domains(tracked)
         elif tracker_type == 'yara':
             if not is_default_yara_rule(tracked):
                 filepath = get_yara_rule_file_by_tracker_name(tracked)
@@ -1236,15 +1241,53 @@ def get_tracked_regexs():
 ########################
 #### TYPO SQUATTING ####
 
+# Inverted index: typo host -> tracked domains
+
 def get_tracked_typosquatting_domains(tracked):
     return r_tracker.smembers(f'tracker:typosquatting:{tracked}')
 
+def get_typosquatting_tracked_by_host(host):
+    return r_tracker.smembers(f'tracker:typosquatting:host:{host}')
+
+def generate_typosquatting_domains(tracked):
+    from ail_typo_squatting import runAll
+
+    domain = tracked.split(" ")[0]
+    return runAll(domain=domain, limit=math.inf, formatoutput="text", pathOutput="-", verbose=False) # TODO REPLACE LIMIT BY -1
+
+def _add_typosquatting_domains(tracked, domains):
+    pipe = r_tracker.pipeline(transaction=False)
+    for i, typo in enumerate(domains):
+        pipe.sadd(f'tracker:typosquatting:{tracked}', typo)
+        pipe.sadd(f'tracker:typosquatting:host:{typo}', tracked)
+        if i % 1000 == 999:
+            pipe.execute()
+    pipe.execute()
+
+def _delete_typosquatting_domains(tracked):
+    pipe = r_tracker.pipeline(transaction=False)
+    for i, typo in enumerate(r_tracker.sscan_iter(f'tracker:typosquatting:{tracked}', count=1000)):
+        pipe.srem(f'tracker:typosquatting:host:{typo}', tracked)
+        if i % 1000 == 999:
+            pipe.execute()
+    pipe.delete(f'tracker:typosquatting:{tracked}')
+    pipe.execute()
+
+def is_typosquatting_host_index_built():
+    return r_tracker.exists('tracker:typosquatting:host:index')
+
+def build_typosquatting_host_index():
+    for tracked in r_tracker.smembers('all:tracker:typosquatting'):
+        _add_typosquatting_domains(tracked, r_tracker.sscan_iter(f'tracker:typosquatting:{tracked}', count=1000))
+    r_tracker.set('tracker:typosquatting:host:index', time.time())
+
 def get_tracked_typosquatting():
+    """
+    Return the tracked domains by object type, the typo domains are looked up with get_typosquatting_tracked_by_host()
+    """
     to_track = {}
     for obj_type in get_objects_tracked():
-        to_track[obj_type] = []
-        for tracked in _get_tracked_by_obj_type('typosquatting', obj_type):
-            to_track[obj_type].append({'domains': get_tracked_typosquatting_domains(tracked), 'tracked': tracked})
+        to_track[obj_type] = _get_tracked_by_obj_type('typosquatting', obj_type)
     return to_track
 
 ##############
@@ -1285,7 +1328,73 @@ def get_all_tracked_yara_files(filter_disabled=False):
         pass
     return yara_files
 
-def get_tracked_yara_rules():
+## Compiled rules cache ##
+# Compiled rule sets are saved with yara.Rules.save(), keyed by a hash of the rules content
+
+def get_yara_compiled_dir():
+    return YARA_COMPILED_DIR
+
+def get_yara_rules_hash(rules):
+    """
+    :param rules: dict {namespace: rule filepath}
+    """
+    h = hashlib.sha256()
+    for namespace in sorted(rules):
+        h.update(namespace.encode())
+        h.update(b'\x00')
+        with open(rules[namespace], 'rb') as f:
+            h.update(f.read())
+        h.update(b'\x00')
+    return h.hexdigest()
+
+def _get_yara_compiled_filepath(rules_hash):
+    return os.path.join(get_yara_compiled_dir(), f'{rules_hash}.yarc')
+
+def compile_yara_rules(rules):
+    """
+    Compile a rule set if not already in the compiled rules cache
+
+    :param rules: dict {namespace: rule filepath}
+    :return: compiled rules filepath
+    """
+    rules_hash = get_yara_rules_hash(rules)
+    filepath = _get_yara_compiled_filepath(rules_hash)
+    if not os.path.isfile(filepath):
+        os.makedirs(get_yara_compiled_dir(), exist_ok=True)
+        compiled = yara.compile(filepaths=rules)
+        # atomic swap: never load a partially written file
+        tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+        compiled.save(tmp_filepath)
+        os.replace(tmp_filepath, filepath)
+    return filepath
+
+def load_yara_rules(rules):
+    """
+    Load a rule set from the compiled rules cache, compile it if needed
+    """
+    filepath = compile_yara_rules(rules)
+    try:
+        return yara.load(filepath)
+    except yara.Error:
+        # invalid cache file
+        os.remove(filepath)
+        return yara.load(compile_yara_rules(rules))
+
+def is_yara_rules_compiled(rules):
+    return os.path.isfile(_get_yara_compiled_filepath(get_yara_rules_hash(rules)))
+
+def clean_yara_compiled_rules(used_hashes, max_age=3600):
+    if not os.path.isdir(get_yara_compiled_dir()):
+        return None
+    now = time.time()
+    for filename in os.listdir(get_yara_compiled_dir()):
+        rules_hash = filename.split('.', 1)[0]
+        if rules_hash not in used_hashes:
+            filepath = os.path.join(get_yara_compiled_dir(), filename)
+            if now - os.path.getmtime(filepath) > max_age:
+                os.remove(filepath)
+
+def _get_tracked_yara_rules_filepaths():
     to_track = {}
     for obj_type in get_objects_tracked():
         rules = {}
@@ -1295,21 +1404,60 @@ def get_tracked_yara_rules():
                 logger.critical(f"Yara rule don't exists {tracked} : {obj_type}")
             else:
                 rules[tracked] = rule
-        to_track[obj_type] = yara.compile(filepaths=rules)
+        to_track[obj_type] = rules
     return to_track
 
-def reload_yara_rules():
+def _get_used_yara_rules_hashes():
+    """
+    :return: set of the hashes of all the rule sets loaded from the compiled rules cache:
+             Tracker_Yara rule sets, reload_yara_rules and Tracker.get_rule
+    """
+    rules_sets = list(_get_tracked_yara_rules_filepaths().values())
+    trackers_rules = _get_trackers_yara_rules_filepaths()
+    rules_sets.append(trackers_rules)
+    for rule in set(trackers_rules.values()):
+        rules_sets.append({'default': rule})
+    used_hashes = set()
+    for rules in rules_sets:
+        if all(os.path.isfile(rule) for rule in rules.values()):
+            used_hashes.add(get_yara_rules_hash(rules))
+    return used_hashes
+
+def compile_tracked_yara_rules():
+    """
+    Compile all the tracked rule sets in the compiled rules cache. Run it in a background process.
+    """
+    for obj_type, rules in _get_tracked_yara_rules_filepaths().items():
+        compile_yara_rules(rules)
+    clean_yara_compiled_rules(_get_used_yara_rules_hashes())
+
+def get_tracked_yara_rules():
+    to_track = {}
+    loaded = {}
+    for obj_type, rules in _get_tracked_yara_rules_filepaths().items():
+        # rule sets shared by several object types are only loaded once
+        rules_hash = get_yara_rules_hash(rules)
+        if rules_hash not in loaded:
+            loaded[rules_hash] = load_yara_rules(rules)
+        to_track[obj_type] = loaded[rules_hash]
+    return to_track
+
+def _get_trackers_yara_rules_filepaths():
     yara_files = get_all_tracked_yara_files()
     # {uuid: filename}
     rule_dict = {}
     for yar_path in yara_files:
         for tracker_uuid in get_trackers_by_tracked('yara', yar_path):
             rule_dict[tracker_uuid] = os.path.join(get_yara_rules_dir(), yar_path)
+    return rule_dict
+
+def reload_yara_rules():
+    rule_dict = _get_trackers_yara_rules_filepaths()
     for tracker_uuid in rule_dict:
         if not os.path.isfile(rule_dict[tracker_uuid]):
             # TODO IGNORE + LOGS
             raise Exception(f"Error: {rule_dict[tracker_uuid]} doesn't exists")
-    rules = yara.compile(filepaths=rule_dict)
+    rules = load_yara_rules(rule_dict)
     return rules
 
 def is_valid_yara_rule(yara_rule):
@@ -4,6 +4,8 @@
 import os
 import sys
 import datetime
+import math
+import re
 import time
 
 import xxhash
@@ -20,16 +22,233 @@ config_loader = ConfigLoader()
 r_queues = config_loader.get_redis_conn("Redis_Queues")
 r_obj_process = config_loader.get_redis_conn("Redis_Process")
 timeout_queue_obj = 172800
+
+# Modules run by a modules host: host name: [module names]
+MODULES_HOSTS = {}
+for host_name, host_modules in config_loader.get_all_keys_values_from_section('Modules_Hosts'):
+    MODULES_HOSTS[host_name] = [module_name.strip() for module_name in host_modules.split(',') if module_name.strip()]
+
+# Reliable queues: at-least-once delivery
+if config_loader.has_option('Modules_Queues', 'reliable'):
+    RELIABLE_QUEUES = config_loader.get_config_boolean('Modules_Queues', 'reliable')
+else:
+    RELIABLE_QUEUES = False
+if config_loader.has_option('Modules_Queues', 'visibility_timeout'):
+    VISIBILITY_TIMEOUT = config_loader.get_config_int('Modules_Queues', 'visibility_timeout')
+else:
+    VISIBILITY_TIMEOUT = 900
+if config_loader.has_option('Modules_Queues', 'max_retries'):
+    MAX_RETRIES = config_loader.get_config_int('Modules_Queues', 'max_retries')
+else:
+    MAX_RETRIES = 3
+
+# Backpressure: queue name: (high watermark, low watermark)
+BACKPRESSURE_WATERMARKS = {}
+if config_loader.has_option('Modules_Backpressure', 'watermarks'):
+    for watermark in config_loader.get_config_str('Modules_Backpressure', 'watermarks').split(','):
+        watermark = watermark.strip()
+        if watermark:
+            try:
+                queue_name, high, low = watermark.split(':')
+                BACKPRESSURE_WATERMARKS[queue_name] = (int(high), min(int(low), int(high)))
+            except ValueError:
+                print(f'Invalid backpressure watermark: {watermark}')
+if config_loader.has_option('Modules_Backpressure', 'check_interval'):
+    BACKPRESSURE_CHECK_INTERVAL = config_loader.get_config_int('Modules_Backpressure', 'check_interval')
+else:
+    BACKPRESSURE_CHECK_INTERVAL = 5
+if config_loader.has_option('Modules_Backpressure', 'max_wait'):
+    BACKPRESSURE_MAX_WAIT = config_loader.get_config_int('Modules_Backpressure', 'max_wait')
+else:
+    BACKPRESSURE_MAX_WAIT = 300
 config_loader = None
+# Seconds between two checks of the messages not acknowledged
+REDELIVERY_CHECK_INTERVAL = 60
 
 MODULES_FILE = os.path.join(os.environ['AIL_HOME'], 'configs', 'modules.cfg')
 
+# Processing time histograms: log2 buckets in ms, by window of LATENCY_WINDOW seconds
+LATENCY_WINDOW = 300
+LATENCY_NB_WINDOWS = 12
+NB_SLOWEST_OBJS = 10
+
+# # # # # # # # #
+#               #
+#  PREFILTERS   #
+#               #
+# # # # # # # # #
+
+# Cheap content predicates, modules.cfg: prefilter = <predicate>,<predicate>,...
+#   literal:<text>              the content contains <text>
+#   run:<class>:<min length>    the content contains a run of <min length> chars of <class>
+# The object is sent to the module if one of its predicates match.
+# Predicates must never reject an object the module could match.
+PREFILTER_CLASSES = {'digits': '0-9',
+                     'hex': '0-9A-Fa-f',
+                     'alpha': 'A-Za-z',
+                     'alnum': '0-9A-Za-z',
+                     'base64': '0-9A-Za-z+/'}
+
+def _parse_prefilter_predicate(predicate):
+    predicate_type, value = predicate.split(':', 1)
+    if predicate_type == 'literal':
+        if not value:
+            raise ModuleQueueError(f'Invalid prefilter, empty literal: {predicate}')
+        return 'literal', value
+    elif predicate_type == 'run':
+        char_class, min_length = value.rsplit(':', 1)
+        if char_class not in PREFILTER_CLASSES or not min_length.isdigit():
+            raise ModuleQueueError(f'Invalid prefilter: {predicate}')
+        return 'run', re.compile(f'[{PREFILTER_CLASSES[char_class]}]{{{int(min_length)}}}')
+    else:
+        raise ModuleQueueError(f'Invalid prefilter type: {predicate}')
+
+def parse_prefilter(prefilter):
+    """
+    :return: tuple of predicates strings
+    """
+    predicates = []
+    for predicate in prefilter.split(','):
+        predicate = predicate.strip()
+        if predicate:
+            _get_prefilter_predicate(predicate)  # check predicate
+            predicates.append(predicate)
+    return tuple(predicates)
+
+# predicate string: (type, literal or compiled regex)
+PREFILTER_PREDICATES = {}
+
+def _get_prefilter_predicate(predicate):
+    if predicate not in PREFILTER_PREDICATES:
+        PREFILTER_PREDICATES[predicate] = _parse_prefilter_predicate(predicate)
+    return PREFILTER_PREDICATES[predicate]
+
+def match_prefilter_predicate(predicate, content):
+    predicate_type, value = _get_prefilter_predicate(predicate)
+    if predicate_type == 'literal':
+        return value in content
+    else:
+        return value.search(content) is not None
+
+def filter_modules_by_prefilters(modules, prefilters, content):
+    """
+    Scan the content once per distinct predicate
+
+    :param modules: modules names
+    :param prefilters: dict module name: tuple of predicates
+    :param content: object content
+    :return: set of modules names to send the object to
+    """
+    matches = {}
+    selected = set()
+    for module_name in modules:
+        predicates = prefilters.get(module_name)
+        if not predicates:
+            selected.add(module_name)
+            continue
+        for predicate in predicates:
+            if predicate not in matches:
+                matches[predicate] = match_prefilter_predicate(predicate, content)
+            if matches[predicate]:
+                selected.add(module_name)
+                break
+    return selected
+
+def get_modules_prefiltered_stats():
+    return r_queues.hgetall('queues:prefiltered')
+
+# # # # # # # # # # #
+#                   #
+#   BACKPRESSURE    #
+#                   #
+# # # # # # # # # # #
+
+# Cached by process, the queues length are checked every BACKPRESSURE_CHECK_INTERVAL seconds
+_BACKPRESSURE = {'next_check': 0, 'saturated': set()}
+
+def get_saturated_queues():
+    """
+    A queue is saturated once its length reach its high watermark, until it goes back under its low watermark
+
+    :return: set of saturated queues names
+    """
+    if not BACKPRESSURE_WATERMARKS:
+        return set()
+    if _BACKPRESSURE['next_check'] > time.time():
+        return _BACKPRESSURE['saturated']
+
+    queues_names = list(BACKPRESSURE_WATERMARKS)
+    pipe = r_queues.pipeline(transaction=False)
+    for queue_name in queues_names:
+        pipe.llen(f'queue:{queue_name}:in')
+    saturated = set()
+    for queue_name, nb_messages in zip(queues_names, pipe.execute()):
+        high, low = BACKPRESSURE_WATERMARKS[queue_name]
+        if queue_name in _BACKPRESSURE['saturated']:
+            if nb_messages > low:
+                saturated.add(queue_name)
+        elif nb_messages >= high:
+            saturated.add(queue_name)
+    _BACKPRESSURE['saturated'] = saturated
+    _BACKPRESSURE['next_check'] = time.time() + BACKPRESSURE_CHECK_INTERVAL
+    return saturated
+
+def is_backpressured():
+    return bool(get_saturated_queues())
+
+def wait_backpressure(name=None, max_wait=BACKPRESSURE_MAX_WAIT):
+    """
+    Block a bulk importer while a queue is saturated, at most max_wait seconds
+
+    :return: waiting time in seconds
+    """
+    start = time.time()
+    saturated = get_saturated_queues()
+    if saturated:
+        print(f'{name}: paused, saturated queues: {", ".join(sorted(saturated))}')
+        while get_saturated_queues():
+            if time.time() - start >= max_wait:
+                print(f'{name}: resumed after the maximum wait, {max_wait}s')
+                return time.time() - start
+            time.sleep(BACKPRESSURE_CHECK_INTERVAL)
+        print(f'{name}: resumed after {int(time.time() - start)}s')
+    return time.time() - start
+
+def get_queue_watermarks(name, high=None, low=None):
+    """
+    :return: (high watermark, low watermark) of a module queue, Modules_Backpressure config if not provided
+    """
+    if not high:
+        if name in BACKPRESSURE_WATERMARKS:
+            return BACKPRESSURE_WATERMARKS[name]
+        return None, None
+    if low is None or low > high:
+        low = high // 2
+    return high, low
+
+def wait_module_queue(name, high, low):
+    """
+    Block while the module queue is above its high watermark, until it goes under its low watermark
+
+    :return: waiting time in seconds
+    """
+    start = time.time()
+    if r_queues.llen(f'queue:{name}:in') >= high:
+        print(f'{name}: queue saturated, paused')
+        while r_queues.llen(f'queue:{name}:in') > low:
+            time.sleep(BACKPRESSURE_CHECK_INTERVAL)
+        print(f'{name}: resumed after {int(time.time() - start)}s')
+    return time.time() - start
+
 # # # # # # # #
 #             #
 #  AIL QUEUE  #
 #             #
 # # # # # # # #
 
+def get_message_hash(message):
+    return xxhash.xxh3_64_hexdigest(message.encode())
+
 class AILQueue:
 
     def __init__(self, module_name, module_pid):
@@ -42,8 +261,20 @@ class AILQueue:
         r_queues.sadd('modules', self.name)
         r_queues.hset(f'module:{self.name}', self.pid, -1)
 
+        # Processing time of the current message
+        self.start_time = None
+
+        # Reliable queue: message not acknowledged
+        self.reliable = RELIABLE_QUEUES
+        self.in_flight = None
+        self.next_redelivery_check = 0
+        if self.reliable:
+            # messages left by a previous worker with the same pid
+            requeue_worker_messages(self.name, self.pid)
+
     def _set_subscriber(self):
         subscribers = {}
+        prefilters = {}
         module_config_loader = ConfigLoader(config_file=MODULES_FILE)  # TODO CHECK IF FILE EXISTS
         if not module_config_loader.has_section(self.name):
             raise ModuleQueueError(f'No Section defined for this module: {self.name}. Please add one in configs/module.cfg')
@@ -60,7 +291,12 @@ class AILQueue:
                             queue_name = module_config_loader.get_config_str(module, 'subscribe')
                             if queue_name in subscribers:
                                 subscribers[queue_name].add(module)
+                                if module_config_loader.has_option(module, 'prefilter'):
+                                    prefilter = module_config_loader.get_config_str(module, 'prefilter')
+                                    prefilters[module] = parse_prefilter(prefilter)
         self.subscribers_modules = subscribers
+        # subscriber module name: prefilter predicates
+        self.subscribers_prefilters = prefilters
 
     def get_out_queues(self):
         return list(self.subscribers_modules.keys())
@@ -69,12 +305,25 @@ class AILQueue:
         return r_queues.llen(f'queue:{self.name}:in')
 
     def get_message(self):
-        # Update queues stats
-        r_queues.hset('queues', self.name, self.get_nb_messages())
-        r_queues.hset(f'module:{self.name}', self.pid, int(time.time()))
+        if self.reliable and self.next_redelivery_check < time.time():
+            redeliver_module_messages(self.name)
+            self.next_redelivery_check = time.time() + REDELIVERY_CHECK_INTERVAL
 
+        pipe = r_queues.pipeline(transaction=False)
+        pipe.llen(f'queue:{self.name}:in')
+        pipe.hset(f'module:{self.name}', self.pid, int(time.time()))
         # Get Message
-        message = r_queues.lpop(f'queue:{self.name}:in')
+        if self.reliable:
+            pipe.lmove(f'queue:{self.name}:in', f'queue:{self.name}:processing:{self.pid}', 'LEFT', 'RIGHT')
+            pipe.hset(f'queue:{self.name}:processing', self.pid, int(time.time()))
+        else:
+            pipe.lpop(f'queue:{self.name}:in')
+        res = pipe.execute()
+        # Update queues stats
+        r_queues.hset('queues', self.name, res[0])
+        message = res[2]
+        if self.reliable:
+            self.in_flight = message
         if not message:
             return None
         else:
@@ -84,8 +333,9 @@ class AILQueue:
                 # raise Exception(f'Error: queue {self.name}, no AIL object provided')
             else:
                 obj_global_id, mess = row_mess
-                m_hash = xxhash.xxh3_64_hexdigest(message)
-                add_processed_obj(obj_global_id, m_hash, module=self.name)
+                m_hash = get_message_hash(message)
+                add_processed_obj(obj_global_id, module=self.name)
+                self.start_time = time.time()
                 return obj_global_id, m_hash, mess
 
     def rename_message_obj(self, new_id, old_id):
@@ -98,10 +348,51 @@ class AILQueue:
         # condition -> not in any queue
         # TODO EDIT meta
 
+    def ack(self, pipe=None):
+        """
+        Acknowledge the message in process
+
+        :return: True if a message was in process, the LREM result is the first result of the pipeline
+        """
+        if not self.in_flight:
+            return False
+        if pipe:
+            execute = False
+        else:
+            pipe = r_queues.pipeline(transaction=False)
+            execute = True
+        pipe.lrem(f'queue:{self.name}:processing:{self.pid}', 1, self.in_flight)
+        pipe.hdel(f'queue:{self.name}:retries', get_message_hash(self.in_flight))
+        if execute:
+            pipe.execute()
+        self.in_flight = None
+        return True
+
     def end_message(self, obj_global_id, m_hash):
-        end_processed_obj(obj_global_id, m_hash, module=self.name)
+        pipe = r_queues.pipeline(transaction=False)
+        acked = self.ack(pipe=pipe)
+        # Worker stats
+        if self.start_time:
+            duration = time.time() - self.start_time
+            pipe.hincrby(f'module:stats:{self.name}:{self.pid}', 'processed', 1)
+            pipe.hincrbyfloat(f'module:stats:{self.name}:{self.pid}', 'time', duration)
+            _add_processing_time(pipe, self.name, obj_global_id, duration)
+            self.start_time = None
+        res = pipe.execute()
+        # The message was removed from the processing list if it was redelivered to another worker after the
+        # visibility timeout, or moved to the dead-letter queue: the object is ended by them, only once
+        if not acked or res[0]:
+            end_processed_obj(obj_global_id, module=self.name)
+
+    def has_prefilters(self, queue_name=None):
+        if not queue_name and len(self.subscribers_modules) == 1:
+            queue_name = list(self.subscribers_modules)[0]
+        for module_name in self.subscribers_modules.get(queue_name, []):
+            if module_name in self.subscribers_prefilters:
+                return True
+        return False
 
-    def send_message(self, obj_global_id, message='', queue_name=None):
+    def _get_queue_name(self, queue_name=None):
         if not self.subscribers_modules:
             raise ModuleQueueError('This Module don\'t have any subscriber')
         if queue_name:
@@ -111,23 +402,63 @@ class AILQueue:
             if len(self.subscribers_modules) > 1:
                 raise ModuleQueueError('Queue name required. This module push to multiple queues')
             queue_name = list(self.subscribers_modules)[0]
+        return queue_name
+
+    def send_message(self, obj_global_id, message='', queue_name=None, content=None):
+        """
+        :param content: object content, used to skip the subscribers whose prefilter doesn't match
+        """
+        queue_name = self._get_queue_name(queue_name)
 
         message = f'{obj_global_id};{message}'
-        if obj_global_id != '::':
-            m_hash = xxhash.xxh3_64_hexdigest(message)
-        else:
-            m_hash = None
 
-        # Add message to all modules
-        for module_name in self.subscribers_modules[queue_name]:
-            if m_hash:
-                add_processed_obj(obj_global_id, m_hash, queue=module_name)
+        modules = self.subscribers_modules[queue_name]
+        if content is not None and self.subscribers_prefilters:
+            selected = filter_modules_by_prefilters(modules, self.subscribers_prefilters, content)
+            if len(selected) != len(modules):
+                pipe = r_queues.pipeline(transaction=False)
+                for module_name in modules - selected:
+                    pipe.hincrby('queues:prefiltered', module_name, 1)
+                pipe.execute()
+            modules = selected
 
+        # Add message to all modules
+        if obj_global_id != '::':
+            add_processed_objs_queues([(obj_global_id, module_name) for module_name in modules])
+        for module_name in modules:
             r_queues.rpush(f'queue:{module_name}:in', message)
             # stats
             nb_mess = r_queues.llen(f'queue:{module_name}:in')
             r_queues.hset('queues', module_name, nb_mess)
 
+    def send_messages(self, messages, queue_name=None):
+        """
+        Send a batch of messages, pipelined. The subscribers prefilters are not applied.
+
+        :param messages: list of (obj_global_id, message)
+        """
+        if not messages:
+            return None
+        queue_name = self._get_queue_name(queue_name)
+
+        modules = list(self.subscribers_modules[queue_name])
+        processed = []
+        pipe = r_queues.pipeline(transaction=False)
+        for obj_global_id, message in messages:
+            message = f'{obj_global_id};{message}'
+            for module_name in modules:
+                if obj_global_id != '::':
+                    processed.append((obj_global_id, module_name))
+                pipe.rpush(f'queue:{module_name}:in', message)
+        # the objects are marked as queued before being pushed
+        add_processed_objs_queues(processed)
+        for module_name in modules:
+            pipe.llen(f'queue:{module_name}:in')
+        res = pipe.execute()
+        # stats
+        if modules:
+            r_queues.hset('queues', mapping=dict(zip(modules, res[-len(modules):])))
+
     def start(self):
         r_queues.hset(f'module:start:{self.name}', self.pid, int(time.time()))
 
@@ -140,18 +471,192 @@ class AILQueue:
         r_queues.delete(f'queue:{self.name}:in')
 
     def _stop_module(self):
-        r_queues.hdel(f'module:{self.name}', self.pid)
-        if r_queues.hlen(f'module:{self.name}') == 0:
-            r_queues.srem('modules', self.name)
+        if self.reliable:
+            # message not processed, redelivered to another worker
+            requeue_worker_messages(self.name, self.pid)
+            self.in_flight = None
+        clear_module_worker(self.name, self.pid)
 
     def error(self):
-        self._stop_module
+        self._stop_module()
+
+    def stop(self):
+        self._stop_module()
 
     def end(self):
-        self.clear()
+        # Queue shared with other workers
+        if r_queues.hlen(f'module:{self.name}') <= 1:
+            self.clear()
         self._stop_module()
 
 
+# # # # # # # # # # # #
+#                     #
+#   RELIABLE QUEUES   #
+#                     #
+# # # # # # # # # # # #
+
+# queue:{module}:processing:{pid}   list of the messages in process by a worker
+# queue:{module}:processing         hash: pid -> time of the last message fetched by the worker
+# queue:{module}:retries            hash: message hash -> nb redeliveries
+# queue:{module}:dead               zset: message -> time of the move to the dead-letter queue
+
+def _is_pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except ValueError:
+        return False
+    return True
+
+def get_module_processing_workers(name):
+    return r_queues.hgetall(f'queue:{name}:processing')
+
+def get_module_worker_processing_messages(name, pid):
+    return r_queues.lrange(f'queue:{name}:processing:{pid}', 0, -1)
+
+# Move a message from a processing list to the head of a module queue, if not acknowledged in the meantime
+# KEYS[1]: processing list, KEYS[2]: module queue, ARGV[1]: message
+_LUA_REQUEUE_MESSAGE = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 0 then
+    return 0
+end
+redis.call('LPUSH', KEYS[2], ARGV[1])
+return 1
+"""
+
+_requeue_message = r_queues.register_script(_LUA_REQUEUE_MESSAGE)
+
+def _requeue_worker_message(name, pid, message):
+    """
+    The object is counted as queued before the message is moved, another worker can dequeue it at once
+
+    :return: True if the message was moved back in the module queue
+    """
+    row_mess = message.split(';', 1)
+    obj_global_id = None
+    if len(row_mess) == 2 and row_mess[0] != '::':
+        obj_global_id = row_mess[0]
+        requeue_processed_obj(obj_global_id, name)
+    moved = bool(_requeue_message(keys=[f'queue:{name}:processing:{pid}', f'queue:{name}:in'], args=[message]))
+    if obj_global_id:
+        end_requeue_processed_obj(obj_global_id, name, moved=moved)
+    return moved
+
+def requeue_worker_messages(name, pid):
+    """
+    Move the messages of a worker back to the head of the module queue, without counting a retry
+    """
+    # last message first: the messages order is kept
+    for message in reversed(get_module_worker_processing_messages(name, pid)):
+        _requeue_worker_message(name, pid, message)
+    r_queues.hdel(f'queue:{name}:processing', pid)
+
+def _redeliver_worker_messages(name, pid):
+    for message in get_module_worker_processing_messages(name, pid):
+        m_hash = get_message_hash(message)
+        retries = r_queues.hincrby(f'queue:{name}:retries', m_hash, 1)
+        if retries > MAX_RETRIES:
+            # LREM: the message may have been acknowledged in the meantime
+            if r_queues.lrem(f'queue:{name}:processing:{pid}', 1, message):
+                add_dead_letter_message(name, message)
+        elif _requeue_worker_message(name, pid, message):
+            print(f'{name}: message redelivered, retry {retries}: {message}')
+        else:
+            r_queues.hincrby(f'queue:{name}:retries', m_hash, -1)
+
+def redeliver_module_messages(name):
+    """
+    Redeliver the messages of the dead workers and the messages not acknowledged after VISIBILITY_TIMEOUT
+    """
+    for pid, last_time in get_module_processing_workers(name).items():
+        if not _is_pid_alive(pid):
+            _redeliver_worker_messages(name, pid)
+            r_queues.hdel(f'queue:{name}:processing', pid)
+        elif int(last_time) + VISIBILITY_TIMEOUT < time.time():
+            _redeliver_worker_messages(name, pid)
+
+def add_dead_letter_message(name, message):
+    m_hash = get_message_hash(message)
+    r_queues.zadd(f'queue:{name}:dead', {message: int(time.time())})
+    r_queues.hdel(f'queue:{name}:retries', m_hash)
+    row_mess = message.split(';', 1)
+    if len(row_mess) == 2:
+        end_processed_obj(row_mess[0], module=name)
+    print(f'{name}: message moved to the dead-letter queue: {message}')
+
+def get_dead_letter_messages(name):
+    return r_queues.zrange(f'queue:{name}:dead', 0, -1, withscores=True)
+
+def get_nb_dead_letter_messages(name):
+    return r_queues.zcard(f'queue:{name}:dead')
+
+def get_modules_dead_letter_messages():
+    dead = {}
+    for name in get_queues_modules():
+        messages = get_dead_letter_messages(name)
+        if messages:
+            dead[name] = [{'message': message, 'time': int(epoch)} for message, epoch in messages]
+    return dead
+
+def replay_dead_letter_message(name, message):
+    if r_queues.zrem(f'queue:{name}:dead', message):
+        row_mess = message.split(';', 1)
+        if len(row_mess) == 2 and row_mess[0] != '::':
+            add_processed_obj(row_mess[0], queue=name)
+        r_queues.rpush(f'queue:{name}:in', message)
+        return True
+    return False
+
+def send_module_messages(name, messages):
+    """
+    Push a batch of messages in a module input queue, pipelined
+
+    :param messages: list of (obj_global_id, message)
+    :return: queue length
+    """
+    if not messages:
+        return get_module_nb_messages(name)
+    processed = []
+    pipe = r_queues.pipeline(transaction=False)
+    for obj_global_id, message in messages:
+        message = f'{obj_global_id};{message}'
+        if obj_global_id != '::':
+            processed.append((obj_global_id, name))
+        pipe.rpush(f'queue:{name}:in', message)
+    pipe.llen(f'queue:{name}:in')
+    # the objects are marked as queued before being pushed
+    add_processed_objs_queues(processed)
+    nb_messages = pipe.execute()[-1]
+    r_queues.hset('queues', name, nb_messages)
+    return nb_messages
+
+def replay_dead_letter_messages(name):
+    for message, _ in get_dead_letter_messages(name):
+        replay_dead_letter_message(name, message)
+
+def delete_dead_letter_message(name, message):
+    return r_queues.zrem(f'queue:{name}:dead', message)
+
+def delete_dead_letter_messages(name):
+    r_queues.delete(f'queue:{name}:dead')
+
+
+def get_modules_hosts():
+    return list(MODULES_HOSTS.keys())
+
+def get_modules_host_modules(host_name):
+    return MODULES_HOSTS.get(host_name, [])
+
+def is_hosted_module(module_name):
+    for host_name in MODULES_HOSTS:
+        if module_name in MODULES_HOSTS[host_name]:
+            return True
+    return False
+
 def get_queues_modules():
     return r_queues.hkeys('queues')
 
@@ -175,26 +680,175 @@ def get_module_start_time(name, pid):
 def get_module_last_time(name, pid):
     return r_queues.hget(f'module:{name}', pid)
 
+def get_module_worker_stats(name, pid):
+    stats = r_queues.hgetall(f'module:stats:{name}:{pid}')
+    processed = int(stats.get('processed', 0))
+    total_time = float(stats.get('time', 0))
+    if processed:
+        avg_time = total_time / processed
+    else:
+        avg_time = 0
+    return {'processed': processed, 'time': total_time, 'avg_time': avg_time}
+
+def get_module_nb_messages(name):
+    return r_queues.llen(f'queue:{name}:in')
+
+def get_module_nb_workers(name):
+    return r_queues.hlen(f'module:{name}')
+
+def get_module_avg_processing_time(name):
+    """
+    Return the average processing time of a message, all workers included, None if no message was processed
+    """
+    processed = 0
+    total_time = 0
+    for pid in get_module_pids(name):
+        stats = get_module_worker_stats(name, pid)
+        processed += stats['processed']
+        total_time += stats['time']
+    if processed:
+        return total_time / processed
+    return None
+
+def clear_module_worker(name, pid):
+    r_queues.hdel(f'module:{name}', pid)
+    r_queues.hdel(f'module:start:{name}', pid)
+    r_queues.delete(f'module:stats:{name}:{pid}')
+    if r_queues.hlen(f'module:{name}') == 0:
+        r_queues.srem('modules', name)
+
+def clear_module_dead_workers(name):
+    """
+    Remove the workers of a module whose process is dead
+    """
+    for pid in r_queues.hkeys(f'module:{name}'):
+        if int(pid) > 0 and not _is_pid_alive(pid):
+            clear_module_worker(name, pid)
+
+## Processing time ##
+
+def _get_latency_bucket(duration):
+    ms = duration * 1000
+    if ms <= 1:
+        return 0
+    return math.ceil(math.log2(ms))
+
+def _get_latency_bucket_time(bucket):
+    # bucket upper bound in seconds
+    return (2 ** int(bucket)) / 1000
+
+def _add_processing_time(pipe, name, obj_global_id, duration):
+    obj_type = obj_global_id.split(':', 1)[0]
+    window = int(time.time() // LATENCY_WINDOW)
+    bucket = _get_latency_bucket(duration)
+    expire = LATENCY_WINDOW * (LATENCY_NB_WINDOWS + 1)
+    for key in (f'module:latency:{name}:{window}', f'module:latency:{name}:{obj_type}:{window}'):
+        pipe.hincrby(key, bucket, 1)
+        pipe.expire(key, expire)
+    pipe.zadd(f'module:latency:max:{name}:{window}', {obj_type: duration}, gt=True)
+    pipe.expire(f'module:latency:max:{name}:{window}', expire)
+    pipe.sadd(f'module:latency:types:{name}', obj_type)
+    # slowest objects
+    pipe.zadd(f'module:slowest:{name}', {obj_global_id: duration}, gt=True)
+    pipe.zremrangebyrank(f'module:slowest:{name}', 0, -(NB_SLOWEST_OBJS + 1))
+    pipe.expire(f'module:slowest:{name}', expire)
+
+def _get_latency_windows():
+    window = int(time.time() // LATENCY_WINDOW)
+    return range(window - LATENCY_NB_WINDOWS + 1, window + 1)
+
+def _get_percentile(buckets, count, percent):
+    rank = math.ceil(count * percent / 100)
+    nb = 0
+    for bucket in sorted(buckets):
+        nb += buckets[bucket]
+        if nb >= rank:
+            return _get_latency_bucket_time(bucket)
+    return 0
+
+def get_module_latency_stats(name, obj_type=None):
+    """
+    Return the processing time of the last LATENCY_NB_WINDOWS windows: count, p50, p95, p99, max (seconds).
+    Percentiles are bucket upper bounds.
+    """
+    if obj_type:
+        prefix = f'module:latency:{name}:{obj_type}'
+    else:
+        prefix = f'module:latency:{name}'
+    pipe = r_queues.pipeline(transaction=False)
+    for window in _get_latency_windows():
+        pipe.hgetall(f'{prefix}:{window}')
+    for window in _get_latency_windows():
+        if obj_type:
+            pipe.zscore(f'module:latency:max:{name}:{window}', obj_type)
+        else:
+            pipe.zrange(f'module:latency:max:{name}:{window}', -1, -1, withscores=True)
+    res = pipe.execute()
+    nb_windows = len(_get_latency_windows())
+
+    buckets = {}
+    for window_buckets in res[:nb_windows]:
+        for bucket, nb in window_buckets.items():
+            buckets[int(bucket)] = buckets.get(int(bucket), 0) + int(nb)
+    max_time = 0
+    for window_max in res[nb_windows:]:
+        if obj_type:
+            if window_max:
+                max_time = max(max_time, float(window_max))
+        elif window_max:
+            max_time = max(max_time, window_max[0][1])
+    count = sum(buckets.values())
+    return {'count': count,
+            'p50': _get_percentile(buckets, count, 50),
+            'p95': _get_percentile(buckets, count, 95),
+            'p99': _get_percentile(buckets, count, 99),
+            'max': max_time}
+
+def get_module_latency_obj_types(name):
+    return r_queues.smembers(f'module:latency:types:{name}')
+
+def get_module_slowest_objs(name):
+    return r_queues.zrange(f'module:slowest:{name}', 0, -1, desc=True, withscores=True)
+
+def get_module_processing_stats(name):
+    stats = get_module_latency_stats(name)
+    stats['obj_types'] = {}
+    for obj_type in get_module_latency_obj_types(name):
+        stats['obj_types'][obj_type] = get_module_latency_stats(name, obj_type=obj_type)
+    stats['slowest'] = get_module_slowest_objs(name)
+    return stats
+
 def get_modules_queues_stats():  # TODO ADD OPTION TO PURGE QUEUES
     stats = {}
     modules_names = sorted(get_modules_names())
     nb_queues_modules = get_nb_queues_modules()
+    nb_prefiltered = get_modules_prefiltered_stats()
     for name in modules_names:
         modules = {}
         for pid in get_module_pids(name):
             modules[pid] = {'start': get_module_start_time(name, pid), 'last': get_module_last_time(name, pid)}
-        stats[name] = {'in': nb_queues_modules[name], 'modules': modules}
+            modules[pid].update(get_module_worker_stats(name, pid))
+        stats[name] = {'in': nb_queues_modules.get(name, 0), 'modules': modules,
+                       'prefiltered': int(nb_prefiltered.get(name, 0)),
+                       'processing': get_module_processing_stats(name)}
 
     # Check if module not started
     for name in nb_queues_modules:
         if name not in stats:
-            stats[name] = {'in': nb_queues_modules[name], 'modules': None}
+            stats[name] = {'in': nb_queues_modules[name], 'modules': None,
+                           'prefiltered': int(nb_prefiltered.get(name, 0)), 'processing': None}
     return stats
 
 def clear_modules_queues_stats():
     for name in get_modules_names():
+        for pid in get_module_pids(name):
+            r_queues.delete(f'module:stats:{name}:{pid}')
         r_queues.delete(f'module:{name}')
+        r_queues.delete(f'module:start:{name}')
+        r_queues.delete(f'module:slowest:{name}')
+        r_queues.delete(f'module:latency:types:{name}')
     r_queues.delete('modules')
+    r_queues.delete('queues:prefiltered')
 
 
 # # # # # # # # #
@@ -204,8 +858,71 @@ def clear_modules_queues_stats():
 # # # # # # # # #
 
 
+# In-flight objects, reference counted:
+#   objs:process:refs                   hash: obj global id: number of messages queued or in process
+#   objs:process:queues:<module>        hash: obj global id: number of messages queued for the module
+#   objs:process:modules:<module>       hash: obj global id: number of messages processed by the module
+#   objs:process:<obj type>             zset: obj global id: first process timestamp
+#   objs:processed                      set: objects whose messages are all processed, used by Sync_module
+#   objs:process:version                str: format version, the legacy keys are cleaned once
+
+OBJS_PROCESS_VERSION = '2'
+
+# Decrement a reference count, the field is deleted once it reaches 0
+# KEYS[1]: hash, ARGV[1]: obj global id
+_LUA_DECR_REF = """
+local refs = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if refs <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return refs
+"""
+
+# Message dequeued by a module
+# KEYS[1]: module queue hash, KEYS[2]: module hash, KEYS[3]: refs hash, KEYS[4]: obj type zset
+# ARGV[1]: obj global id, ARGV[2]: timestamp
+_LUA_START_REF = """
+local queued = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if queued <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+if queued < 0 then
+    -- message not counted when queued
+    redis.call('HINCRBY', KEYS[3], ARGV[1], 1)
+    redis.call('ZADD', KEYS[4], 'NX', ARGV[2], ARGV[1])
+end
+return redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+"""
+
+# Message processed by a module, the object is processed once all its messages are processed
+# KEYS[1]: module hash, KEYS[2]: refs hash, KEYS[3]: obj type zset, KEYS[4]: processed set
+# ARGV[1]: obj global id
+_LUA_END_REF = """
+local processing = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if processing <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+local refs = redis.call('HINCRBY', KEYS[2], ARGV[1], -1)
+if refs <= 0 then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    redis.call('SADD', KEYS[4], ARGV[1])
+end
+return refs
+"""
+
+_decr_ref = r_obj_process.register_script(_LUA_DECR_REF)
+_start_ref = r_obj_process.register_script(_LUA_START_REF)
+_end_ref = r_obj_process.register_script(_LUA_END_REF)
+
+def _get_obj_type(obj_global_id):
+    return obj_global_id.split(':', 1)[0]
+
+def _get_processed_modules():
+    return get_queues_modules()
+
 def get_processed_objs():
-    return r_obj_process.smembers(f'objs:process')
+    return set(r_obj_process.hkeys('objs:process:refs'))
 
 def get_processed_end_objs():
     return r_obj_process.smembers(f'objs:processed')
@@ -214,66 +931,111 @@ def get_processed_end_obj():
     return r_obj_process.spop(f'objs:processed')
 
 def is_obj_in_process(obj_gid):
-    return r_obj_process.sismember(f'objs:process', obj_gid)
+    return r_obj_process.hexists('objs:process:refs', obj_gid)
 
 def get_processed_objs_by_type(obj_type):
     return r_obj_process.zrange(f'objs:process:{obj_type}', 0, -1)
 
+def get_processed_obj_modules(obj_global_id):
+    """
+    :return: list of the modules processing the object
+    """
+    modules = _get_processed_modules()
+    pipe = r_obj_process.pipeline(transaction=False)
+    for module in modules:
+        pipe.hexists(f'objs:process:modules:{module}', obj_global_id)
+    return [module for module, exists in zip(modules, pipe.execute()) if exists]
+
+def get_processed_obj_queues(obj_global_id):
+    """
+    :return: list of the modules queues containing the object
+    """
+    modules = _get_processed_modules()
+    pipe = r_obj_process.pipeline(transaction=False)
+    for module in modules:
+        pipe.hexists(f'objs:process:queues:{module}', obj_global_id)
+    return [module for module, exists in zip(modules, pipe.execute()) if exists]
+
 def is_processed_obj_queued(obj_global_id):
-    return r_obj_process.exists(f'obj:queues:{obj_global_id}')
+    return bool(get_processed_obj_queues(obj_global_id))
 
 def is_processed_obj_moduled(obj_global_id):
-    return r_obj_process.exists(f'obj:modules:{obj_global_id}')
+    return bool(get_processed_obj_modules(obj_global_id))
 
 def is_processed_obj(obj_global_id):
-    return is_processed_obj_queued(obj_global_id) or is_processed_obj_moduled(obj_global_id)
-
-def get_processed_obj_modules(obj_global_id):
-    return r_obj_process.zrange(f'obj:modules:{obj_global_id}', 0, -1)
-
-def get_processed_obj_queues(obj_global_id):
-    return r_obj_process.zrange(f'obj:queues:{obj_global_id}', 0, -1)
+    return is_obj_in_process(obj_global_id)
 
 def get_processed_obj(obj_global_id):
     return {'modules': get_processed_obj_modules(obj_global_id), 'queues': get_processed_obj_queues(obj_global_id)}
 
-def add_processed_obj(obj_global_id, m_hash, module=None, queue=None):
-    obj_type = obj_global_id.split(':', 1)[0]
-    new_obj = r_obj_process.sadd(f'objs:process', obj_global_id)
-    # first process:
-    if new_obj:
-        r_obj_process.zadd(f'objs:process:{obj_type}', {obj_global_id: int(time.time())})
+def add_processed_obj(obj_global_id, module=None, queue=None):
+    """
+    :param module: message dequeued by this module
+    :param queue: message queued for this module
+    """
+    obj_type = _get_obj_type(obj_global_id)
     if queue:
-        r_obj_process.zadd(f'obj:queues:{obj_global_id}', {f'{queue}:{m_hash}': int(time.time())})
+        add_processed_objs_queues([(obj_global_id, queue)])
     if module:
-        r_obj_process.zadd(f'obj:modules:{obj_global_id}', {f'{module}:{m_hash}': int(time.time())})
-        r_obj_process.zrem(f'obj:queues:{obj_global_id}', f'{module}:{m_hash}')
-
-def end_processed_obj(obj_global_id, m_hash, module=None, queue=None):
+        _start_ref(keys=[f'objs:process:queues:{module}', f'objs:process:modules:{module}', 'objs:process:refs',
+                         f'objs:process:{obj_type}'], args=[obj_global_id, int(time.time())])
+
+def add_processed_objs_queues(processed):
+    """
+    Pipelined add_processed_obj of a batch of queued messages
+
+    :param processed: list of (obj_global_id, queue)
+    """
+    if not processed:
+        return None
+    now = int(time.time())
+    pipe = r_obj_process.pipeline(transaction=False)
+    for obj_global_id, queue in processed:
+        obj_type = _get_obj_type(obj_global_id)
+        pipe.hincrby('objs:process:refs', obj_global_id, 1)
+        pipe.hincrby(f'objs:process:queues:{queue}', obj_global_id, 1)
+        # first process
+        pipe.zadd(f'objs:process:{obj_type}', {obj_global_id: now}, nx=True)
+    pipe.execute()
+
+def end_processed_obj(obj_global_id, module=None, queue=None):
     if queue:
-        r_obj_process.zrem(f'obj:queues:{obj_global_id}', f'{queue}:{m_hash}')
+        _decr_ref(keys=[f'objs:process:queues:{queue}'], args=[obj_global_id])
     if module:
-        r_obj_process.zrem(f'obj:modules:{obj_global_id}', f'{module}:{m_hash}')
-
         # TODO HANDLE QUEUE DELETE
-        # process completed
-        if not is_processed_obj(obj_global_id):
-            obj_type = obj_global_id.split(':', 1)[0]
-            r_obj_process.zrem(f'objs:process:{obj_type}', obj_global_id)
-            r_obj_process.srem(f'objs:process', obj_global_id)
-
-            r_obj_process.sadd(f'objs:processed', obj_global_id)   # TODO use list ??????
+        # process completed: added to objs:processed
+        obj_type = _get_obj_type(obj_global_id)
+        _end_ref(keys=[f'objs:process:modules:{module}', 'objs:process:refs', f'objs:process:{obj_type}',
+                       'objs:processed'], args=[obj_global_id])
+
+def requeue_processed_obj(obj_global_id, module):
+    """
+    Message of a module sent back in its queue: counted as queued before the message is moved
+    """
+    r_obj_process.hincrby(f'objs:process:queues:{module}', obj_global_id, 1)
+
+def end_requeue_processed_obj(obj_global_id, module, moved=True):
+    """
+    :param moved: the message was moved back in the queue, else it was acknowledged in the meantime
+    """
+    if moved:
+        _decr_ref(keys=[f'objs:process:modules:{module}'], args=[obj_global_id])
+    else:
+        _decr_ref(keys=[f'objs:process:queues:{module}'], args=[obj_global_id])
 
 def rename_processed_obj(new_id, old_id):
-    module = get_processed_obj_modules(old_id)
+    modules = get_processed_obj_modules(old_id)
     # currently in a module
-    if len(module) == 1:
-        module, x_hash = module[0].split(':', 1)
-        obj_type = old_id.split(':', 1)[0]
-        r_obj_process.zrem(f'obj:modules:{old_id}', f'{module}:{x_hash}')
-        r_obj_process.zrem(f'objs:process:{obj_type}', old_id)
-        r_obj_process.srem(f'objs:process', old_id)
-        add_processed_obj(new_id, x_hash, module=module)
+    if len(modules) == 1:
+        module = modules[0]
+        obj_type = _get_obj_type(old_id)
+        pipe = r_obj_process.pipeline(transaction=False)
+        pipe.hdel(f'objs:process:modules:{module}', old_id)
+        pipe.hdel('objs:process:refs', old_id)
+        pipe.zrem(f'objs:process:{obj_type}', old_id)
+        pipe.execute()
+        add_processed_objs_queues([(new_id, module)])
+        add_processed_obj(new_id, module=module)
 
 def get_last_queue_timeout():
     epoch_update = r_obj_process.get('queue:obj:timeout:last')
@@ -281,40 +1043,67 @@ def get_last_queue_timeout():
         epoch_update = 0
     return float(epoch_update)
 
-def timeout_process_obj(obj_global_id):
-    for q in get_processed_obj_queues(obj_global_id):
-        queue, x_hash = q.split(':', 1)
-        r_obj_process.zrem(f'obj:queues:{obj_global_id}', f'{queue}:{x_hash}')
-    for m in get_processed_obj_modules(obj_global_id):
-        module, x_hash = m.split(':', 1)
-        r_obj_process.zrem(f'obj:modules:{obj_global_id}', f'{module}:{x_hash}')
+def _delete_processed_objs(objs_global_ids, processed=False):
+    """
+    Delete the references of a batch of objects
 
-    obj_type = obj_global_id.split(':', 1)[0]
-    r_obj_process.zrem(f'objs:process:{obj_type}', obj_global_id)
-    r_obj_process.srem(f'objs:process', obj_global_id)
+    :param processed: add the objects to objs:processed
+    """
+    if not objs_global_ids:
+        return None
+    modules = _get_processed_modules()
+    pipe = r_obj_process.pipeline(transaction=False)
+    for module in modules:
+        pipe.hdel(f'objs:process:queues:{module}', *objs_global_ids)
+        pipe.hdel(f'objs:process:modules:{module}', *objs_global_ids)
+    pipe.hdel('objs:process:refs', *objs_global_ids)
+    for obj_global_id in objs_global_ids:
+        pipe.zrem(f'objs:process:{_get_obj_type(obj_global_id)}', obj_global_id)
+    if processed:
+        pipe.sadd('objs:processed', *objs_global_ids)
+    pipe.execute()
 
-    r_obj_process.sadd(f'objs:processed', obj_global_id)
+def timeout_process_obj(obj_global_id):
+    _delete_processed_objs([obj_global_id], processed=True)
     print(f'timeout: {obj_global_id}')
 
-
-def timeout_processed_objs():
+def _clean_legacy_processed_objs():
+    """
+    Objects in process tracked with the previous format: one set and two sorted sets by object.
+    Only the legacy keys are deleted, the references of the current format are kept.
+    Run once, the format version is saved in objs:process:version
+    """
+    if r_obj_process.get('objs:process:version') == OBJS_PROCESS_VERSION:
+        return None
+    legacy_objs = r_obj_process.smembers('objs:process')
+    if legacy_objs:
+        legacy_objs = list(legacy_objs)
+        pipe = r_obj_process.pipeline(transaction=False)
+        for obj_global_id in legacy_objs:
+            pipe.delete(f'obj:queues:{obj_global_id}', f'obj:modules:{obj_global_id}')
+            pipe.hexists('objs:process:refs', obj_global_id)
+        res = pipe.execute()
+        # objects still referenced by the current format are processed by the modules
+        processed = [obj_global_id for obj_global_id, referenced in zip(legacy_objs, res[1::2]) if not referenced]
+        if processed:
+            r_obj_process.sadd('objs:processed', *processed)
+        r_obj_process.delete('objs:process')
+    r_obj_process.set('objs:process:version', OBJS_PROCESS_VERSION)
+
+def timeout_processed_objs(batch_size=1000):
+    _clean_legacy_processed_objs()
     curr_time = int(time.time())
     time_limit = curr_time - timeout_queue_obj
     for obj_type in ail_core.get_obj_queued():
-        for obj_global_id in r_obj_process.zrangebyscore(f'objs:process:{obj_type}', 0, time_limit):
-            timeout_process_obj(obj_global_id)
+        objs_global_ids = r_obj_process.zrangebyscore(f'objs:process:{obj_type}', 0, time_limit)
+        for i in range(0, len(objs_global_ids), batch_size):
+            _delete_processed_objs(objs_global_ids[i:i + batch_size], processed=True)
+            for obj_global_id in objs_global_ids[i:i + batch_size]:
+                print(f'timeout: {obj_global_id}')
     r_obj_process.set('queue:obj:timeout:last', time.time())
 
 def delete_processed_obj(obj_global_id):
-    for q in get_processed_obj_queues(obj_global_id):
-        queue, x_hash = q.split(':', 1)
-        r_obj_process.zrem(f'obj:queues:{obj_global_id}', f'{queue}:{x_hash}')
-    for m in get_processed_obj_modules(obj_global_id):
-        module, x_hash = m.split(':', 1)
-        r_obj_process.zrem(f'obj:modules:{obj_global_id}', f'{module}:{x_hash}')
-    obj_type = obj_global_id.split(':', 1)[0]
-    r_obj_process.zrem(f'objs:process:{obj_type}', obj_global_id)
-    r_obj_process.srem(f'objs:process', obj_global_id)
+    _delete_processed_objs([obj_global_id])
 
 ###################################################################################
 
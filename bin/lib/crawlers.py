@@ -15,6 +15,7 @@ import os
 import pickle
 import re
 import sys
+import threading
 import time
 import uuid
 
@@ -23,6 +24,7 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from urllib.parse import urlparse, urljoin
 from bs4 import BeautifulSoup
+from lxml import etree
 
 from pylacus import PyLacus
 
@@ -43,6 +45,7 @@ from lib.exceptions import OnionFilteringError
 from lib.ConfigLoader import ConfigLoader
 from lib.regex_helper import regex_findall
 from lib.objects.Domains import Domain
+from lib.objects import DomHashs
 from lib.objects.Titles import Title
 from lib.objects import HHHashs
 from lib.objects.Items import Item
@@ -58,9 +61,22 @@ HAR_DIR = config_loader.get_files_directory('har')
 activate_crawler = config_loader.get_config_str("Crawler", "activate_crawler")
 D_HAR = config_loader.get_config_boolean('Crawler', 'default_har')
 D_SCREENSHOT = config_loader.get_config_boolean('Crawler', 'default_screenshot')
+
+# Onion Lookup
+if config_loader.has_option('Crawler', 'onion_lookup_url'):
+    ONION_LOOKUP_URL = config_loader.get_config_str('Crawler', 'onion_lookup_url')
+else:
+    ONION_LOOKUP_URL = 'https://onion.ail-project.org/api/lookup/'
+ONION_LOOKUP_TIMEOUT = 10
+# verdicts cache, TTL in seconds
+ONION_LOOKUP_TTLS = {'safe': 604800, 'unsafe': 2592000, 'unknown': 86400, 'error': 300}
+for _verdict in ONION_LOOKUP_TTLS:
+    if config_loader.has_option('Crawler', f'onion_lookup_ttl_{_verdict}'):
+        ONION_LOOKUP_TTLS[_verdict] = config_loader.get_config_int('Crawler', f'onion_lookup_ttl_{_verdict}')
 config_loader = None
 
-faup = Faup()
+# Faup is not thread safe: one instance per thread (Crawler ingestion workers)
+_faup = threading.local()
 
 # logger_crawler = logging.getLogger('crawlers.log')
 
@@ -159,12 +175,17 @@ def is_valid_onion_domain(domain):
     # return False
 
 def is_valid_domain(domain):
-    faup.decode(domain)
-    url_unpack = faup.get()
+    f = get_faup()
+    f.decode(domain)
+    url_unpack = f.get()
     unpack_domain = url_unpack['domain'].lower()
     return domain == unpack_domain
 
 def get_faup():
+    faup = getattr(_faup, 'faup', None)
+    if faup is None:
+        faup = Faup()
+        _faup.faup = faup
     return faup
 
 def unpack_url(url):
@@ -347,6 +368,140 @@ def extract_author_from_html(html):
 
 # # # - - # # #
 
+# # # # # # # # # # # #
+#                     #
+#    HTML METADATA    #
+#                     #
+# # # # # # # # # # # #
+
+HTML_MAX_SIZE = 20 * 1024 * 1024
+# seconds
+HTML_MAX_TIME = 30
+HTML_CHUNK_SIZE = 64 * 1024
+
+HTML_META_NAMES = {'description', 'keywords', 'author'}
+HTML_ICONS_RELS = {'icon', 'mask-icon', 'apple-touch-icon'}
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+def _get_html_element_string(element):
+    """
+    The string of an element if it has a single string child, BeautifulSoup Tag.string
+    """
+    children = list(element)
+    if element.text:
+        if children:
+            return None
+        text = element.text
+        # whitespace-only strings are collapsed
+        if not text.strip(ASCII_SPACES):
+            if '\n' in text:
+                text = '\n'
+            else:
+                text = ' '
+        return text
+    if len(children) == 1 and not children[0].tail:
+        # comment
+        if not isinstance(children[0].tag, str):
+            return children[0].text
+        return _get_html_element_string(children[0])
+    return None
+
+class HtmlMetadataExtractor:
+    """
+    Extract the metadata of an HTML page from the lxml parser events, in one pass
+    """
+
+    def __init__(self, url=None):
+        self.url = url
+        self.meta = {'title': '', 'description': '', 'keywords': '', 'author': '',
+                     'favicons_urls': set(), 'favicons': set(), 'dom_hash': None, 'truncated': False}
+        self.tags = []
+        self.title = None
+        self.metas_names = set()
+        if url:
+            # Root Favicon
+            f = get_faup()
+            f.decode(url)
+            url_decoded = f.get()
+            self.meta['favicons_urls'].add(f"{url_decoded['scheme']}://{url_decoded['domain']}/favicon.ico")
+
+    def _add_favicon(self, icon_url):
+        if icon_url.startswith('data:'):
+            data = icon_url.split(',', 1)
+            if len(data) > 1:
+                data = ''.join(data[1].split())
+                try:
+                    favicon = base64.b64decode(data)
+                except ValueError:
+                    favicon = None
+                if favicon:
+                    self.meta['favicons'].add(favicon)
+        else:
+            self.meta['favicons_urls'].add(urljoin(self.url, icon_url))
+
+    def read_events(self, parser):
+        for event, element in parser.read_events():
+            tag = element.tag
+            # comments, processing instructions
+            if not isinstance(tag, str):
+                continue
+            if event == 'start':
+                self.tags.append(tag)
+                if tag == 'meta':
+                    name = element.get('name')
+                    if name in HTML_META_NAMES and name not in self.metas_names:
+                        self.metas_names.add(name)
+                        self.meta[name] = element.get('content', '')
+                    elif name == 'msapplication-TileImage' and self.url:
+                        icon_url = element.get('content')
+                        if icon_url:
+                            self._add_favicon(icon_url)
+                elif tag == 'link' and self.url:
+                    rel = element.get('rel')
+                    if rel and not HTML_ICONS_RELS.isdisjoint(rel.split()):
+                        icon_url = element.get('href')
+                        if icon_url:
+                            self._add_favicon(icon_url)
+                elif tag == 'title' and self.title is None:
+                    self.title = element
+            elif element is self.title:
+                self.meta['title'] = _get_html_element_string(element) or ''
+
+    def extract(self, html, max_size=HTML_MAX_SIZE, max_time=HTML_MAX_TIME):
+        if len(html) > max_size:
+            html = html[:max_size]
+            self.meta['truncated'] = True
+        start = time.monotonic()
+        parser = etree.HTMLPullParser(events=('start', 'end'))
+        try:
+            for i in range(0, len(html), HTML_CHUNK_SIZE):
+                parser.feed(html[i:i + HTML_CHUNK_SIZE])
+                self.read_events(parser)
+                if time.monotonic() - start > max_time:
+                    self.meta['truncated'] = True
+                    break
+            else:
+                parser.close()
+                self.read_events(parser)
+        except etree.LxmlError:
+            pass
+        # the DOM-hash of a partially parsed page isn't the page DOM-hash
+        if not self.meta['truncated']:
+            self.meta['dom_hash'] = DomHashs.get_dom_hash(self.tags)
+        return self.meta
+
+def extract_html_metadata(html, url=None, max_size=HTML_MAX_SIZE, max_time=HTML_MAX_TIME):
+    """
+    Extract the metadata of an HTML page in one streaming pass:
+    title, description, keywords, author, favicons and DOM-hash.
+    Stop if the size or time budget is exceeded, no signal is used.
+
+    :param url: page URL, extract the favicons
+    :return: dict: title, description, keywords, author, favicons_urls, favicons, dom_hash,
+                   truncated: True if the budget was exceeded, the metadata of the parsed part, no DOM-hash
+    """
+    return HtmlMetadataExtractor(url=url).extract(html, max_size=max_size, max_time=max_time)
+
 
 # # # # # # # #
 #             #
@@ -354,6 +509,10 @@ def extract_author_from_html(html):
 #             #
 # # # # # # # #
 
+HAR_READ_SIZE = 1024 * 1024
+REGEX_HAR_ENTRIES = re.compile(r'"entries"\s*:\s*\[')
+REGEX_HAR_ENTRIES_SEPARATOR = re.compile(r'[\s,]*')
+
 def create_har_id(date, item_id):
     item_id = item_id.split('/')[-1]
     return os.path.join(date, f'{item_id}.json.gz')
@@ -416,102 +575,147 @@ def get_har_content(har_id):
         print(e) # TODO LOGS
         return {}
 
-def extract_cookies_names_from_har(har):
-    cookies = set()
-    for entrie in har.get('log', {}).get('entries', []):
-        for cookie in entrie.get('request', {}).get('cookies', []):
+def get_har_domain_date(har_id):
+    """
+    :param har_id: <year>/<month>/<day>/<domain><uuid>.json.gz
+    :return: (domain, date)
+    """
+    har_path = har_id.split('/')
+    domain = har_path[-1][:-44]
+    date = f'{har_path[-4]}{har_path[-3]}{har_path[-2]}'
+    return domain, date
+
+def iter_har_entries(har_id, read_size=HAR_READ_SIZE):
+    """
+    Stream the entries of a HAR file, the HAR is never fully loaded in memory.
+    A truncated HAR yields the entries decoded before the error.
+
+    :return: generator of HAR entries
+    """
+    har_path = os.path.join(HAR_DIR, har_id)
+    decoder = json.JSONDecoder()
+    if har_id.endswith('.gz'):
+        f = gzip.open(har_path, 'rt', encoding='utf-8', errors='replace')
+    else:
+        f = open(har_path, 'r', encoding='utf-8', errors='replace')
+    with f:
+        # Search the log entries list
+        buffer = ''
+        while True:
+            chunk = f.read(read_size)
+            if not chunk:
+                return None
+            buffer += chunk
+            match = REGEX_HAR_ENTRIES.search(buffer)
+            if match:
+                buffer = buffer[match.end():]
+                break
+            # the key can be split between two chunks
+            buffer = buffer[-32:]
+
+        # position of the next entry in the buffer, the buffer is only compacted when refilled
+        pos = 0
+        eof = False
+        while True:
+            pos = REGEX_HAR_ENTRIES_SEPARATOR.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                return None
+            try:
+                entry, pos = decoder.raw_decode(buffer, pos)
+            except json.decoder.JSONDecodeError:
+                if eof:
+                    return None
+                # incomplete entry, compact and grow the buffer
+                buffer = buffer[pos:]
+                pos = 0
+                chunk = f.read(max(read_size, len(buffer)))
+                if not chunk:
+                    eof = True
+                buffer += chunk
+                continue
+            yield entry
+
+class HarObjectsExtractor:
+    """
+    Extract the objects of a HAR in one pass over its entries:
+        - cookies names: requests and responses cookies
+        - etags: responses etag header
+        - HHHashs: headers of the 200 responses of the domain, one per URL
+    """
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.cookies_names = set()
+        self.etags = set()
+        # hhhash: hhhash header
+        self.hhhashs = {}
+        self.urls = set()
+
+    def add_entry(self, entry):
+        request = entry.get('request') or {}
+        response = entry.get('response') or {}
+        for cookie in request.get('cookies', []):
             name = cookie.get('name')
             if name:
-                cookies.add(name)
-        for cookie in entrie.get('response', {}).get('cookies', []):
+                self.cookies_names.add(name)
+        for cookie in response.get('cookies', []):
             name = cookie.get('name')
             if name:
-                cookies.add(name)
-    return cookies
-
-def _reprocess_all_hars_cookie_name():
-    from lib.objects import CookiesNames
-    for har_id in get_all_har_ids():
-        domain = har_id.split('/')[-1]
-        domain = domain[:-44]
-        date = har_id.split('/')
-        date = f'{date[-4]}{date[-3]}{date[-2]}'
-        for cookie_name in extract_cookies_names_from_har(get_har_content(har_id)):
-            print(domain, date, cookie_name)
-            cookie = CookiesNames.create(cookie_name)
-            cookie.add(date, Domain(domain))
-
-def extract_etag_from_har(har):  # TODO check response url
-    etags = set()
-    for entrie in har.get('log', {}).get('entries', []):
-        for header in entrie.get('response', {}).get('headers', []):
-            if header.get('name') == 'etag':
-                # print(header)
+                self.cookies_names.add(name)
+        headers = response.get('headers', [])
+        for header in headers:
+            if header.get('name') == 'etag':  # TODO check response url
                 etag = header.get('value')
                 if etag:
-                    etags.add(etag)
-    return etags
-
-def _reprocess_all_hars_etag():
-    from lib.objects import Etags
-    for har_id in get_all_har_ids():
-        domain = har_id.split('/')[-1]
-        domain = domain[:-44]
-        date = har_id.split('/')
-        date = f'{date[-4]}{date[-3]}{date[-2]}'
-        for etag_content in extract_etag_from_har(get_har_content(har_id)):
-            print(domain, date, etag_content)
+                    self.etags.add(etag)
+
+        # HHHash, filter redirect
+        url = request.get('url')
+        if url and url not in self.urls and response.get('status') == 200:
+            f = get_faup()
+            f.decode(url)
+            if f.get().get('domain') == self.domain:
+                hhhash_header = HHHashs.build_hhhash_headers(headers)
+                hhhash = HHHashs.hhhash_headers(hhhash_header)
+                if hhhash not in self.hhhashs:
+                    self.hhhashs[hhhash] = hhhash_header
+                self.urls.add(url)
+
+    def extract(self, entries):
+        for entry in entries:
+            self.add_entry(entry)
+        return self
+
+    def save(self, date):
+        """
+        Create the objects and their correlations with the domain
+        """
+        from lib.objects import CookiesNames
+        from lib.objects import Etags
+        domain = Domain(self.domain)
+        for cookie_name in self.cookies_names:
+            cookie = CookiesNames.create(cookie_name)
+            cookie.add(date, domain)
+        for etag_content in self.etags:
             etag = Etags.create(etag_content)
-            etag.add(date, Domain(domain))
-
-def extract_hhhash_by_id(har_id, domain, date):
-    return extract_hhhash(get_har_content(har_id), domain, date)
-
-def extract_hhhash(har, domain, date):
-    hhhashs = set()
-    urls = set()
-    for entrie in har.get('log', {}).get('entries', []):
-        url = entrie.get('request').get('url')
-        if url not in urls:
-            # filter redirect
-            if entrie.get('response').get('status') == 200:  # != 301:
-                # print(url, entrie.get('response').get('status'))
-
-                f = get_faup()
-                f.decode(url)
-                domain_url = f.get().get('domain')
-                if domain_url == domain:
-
-                    headers = entrie.get('response').get('headers')
-
-                    hhhash_header = HHHashs.build_hhhash_headers(headers)
-                    hhhash = HHHashs.hhhash_headers(hhhash_header)
-
-                    if hhhash not in hhhashs:
-                        print('', url, hhhash)
-
-                        # -----
-                        obj = HHHashs.create(hhhash_header, hhhash)
-                        obj.add(date, Domain(domain))
-
-                    hhhashs.add(hhhash)
-                    urls.add(url)
-    print()
-    print()
-    print('HHHASH:')
-    for hhhash in hhhashs:
-        print(hhhash)
-    return hhhashs
-
-def _reprocess_all_hars_hhhashs():
-    for har_id in get_all_har_ids():
-        print()
-        print(har_id)
-        domain = har_id.split('/')[-1]
-        domain = domain[:-44]
-        date = har_id.split('/')
-        date = f'{date[-4]}{date[-3]}{date[-2]}'
-        extract_hhhash_by_id(har_id, domain, date)
+            etag.add(date, domain)
+        for hhhash, hhhash_header in self.hhhashs.items():
+            obj = HHHashs.create(hhhash_header, hhhash)
+            obj.add(date, domain)
+
+def extract_har_objects(har_id, domain=None, date=None):
+    """
+    Extract and save the cookies names, etags and HHHashs of a HAR file
+    """
+    if not domain or not date:
+        har_domain, har_date = get_har_domain_date(har_id)
+        if not domain:
+            domain = har_domain
+        if not date:
+            date = har_date
+    extractor = HarObjectsExtractor(domain).extract(iter_har_entries(har_id))
+    extractor.save(date)
+    return extractor
 
 
 def _gzip_har(har_id):
@@ -1171,6 +1375,8 @@ class ScheduleStatus(IntEnum):
     SCHEDULED = 1
     ONGOING = 2
 
+SCHEDULE_MIN_FREQUENCY = 60  # TODO ADD IN CONFIG
+
 def get_schedulers_uuid():
     return r_crawler.smembers('scheduler:schedules')
 
@@ -1181,74 +1387,121 @@ def get_schedulers_metas():
         schedulers.append(schedule.get_meta_status())
     return schedulers
 
+def get_schedule_next_run(frequency, min_frequency=SCHEDULE_MIN_FREQUENCY):
+    """
+    :param frequency: hourly, daily, weekly, monthly or <months>:<weeks>:<days>:<hours>:<minutes>
+    :return: timestamp of the next run
+    """
+    if frequency == 'hourly':
+        time_next_run = (datetime.now() + timedelta(hours=1)).timestamp()
+    elif frequency == 'daily':
+        time_next_run = (datetime.now() + timedelta(days=1)).timestamp()
+    elif frequency == 'weekly':
+        time_next_run = (datetime.now() + timedelta(weeks=1)).timestamp()
+    elif frequency == 'monthly':
+        time_next_run = (datetime.now() + relativedelta(months=1)).timestamp()
+    else:
+        months, weeks, days, hours, minutes = frequency.split(':')
+        if not months:
+            months = 0
+        if not weeks:
+            weeks = 0
+        if not days:
+            days = 0
+        if not hours:
+            hours = 0
+        if not minutes:
+            minutes = 0
+        current_time = datetime.now().timestamp()
+        time_next_run = (datetime.now() + relativedelta(months=int(months), weeks=int(weeks),
+                                                        days=int(days), hours=int(hours),
+                                                        minutes=int(minutes))).timestamp()
+        # Make sure the next capture is not scheduled for in a too short interval
+        interval_next_capture = time_next_run - current_time
+        if interval_next_capture < min_frequency:
+            print(f'The next capture is scheduled too soon: {interval_next_capture}s. Minimal interval: {min_frequency}s.')
+            time_next_run = (datetime.now() + timedelta(seconds=min_frequency)).timestamp()
+    return time_next_run
+
 class CrawlerScheduler:
+    """
+    Schedules lifecycle:
+        - armed at creation: added in scheduler:queue with the time of their next run
+        - process_queue: a task is created for each due schedule, the schedule is removed from the queue
+        - re-armed when their task ends (CrawlerTask.remove)
+    """
 
     def __init__(self):
-        self.min_frequency = 60  # TODO ADD IN CONFIG
+        self.min_frequency = SCHEDULE_MIN_FREQUENCY
 
     def update_queue(self):
-        for schedule_uuid in get_schedulers_uuid():
-            schedule = CrawlerSchedule(schedule_uuid)
-            # check if already in scheduler queue
-            if schedule.is_scheduled():
-                continue
-            if schedule.is_tasked():
-                continue
-
-            # EXPIRE ????
-
-            time_next_run = 0.0
-            frequency = schedule.get_frequency()  # optional or later -> cron
-            if frequency == 'hourly':
-                time_next_run = (datetime.now() + timedelta(hours=1)).timestamp()
-            elif frequency == 'daily':
-                time_next_run = (datetime.now() + timedelta(days=1)).timestamp()
-            elif frequency == 'weekly':
-                time_next_run = (datetime.now() + timedelta(weeks=1)).timestamp()
-            elif frequency == 'monthly':
-                time_next_run = (datetime.now() + relativedelta(months=1)).timestamp()
-            else:
-                months, weeks, days, hours, minutes = frequency.split(':')
-                if not months:
-                    months = 0
-                if not weeks:
-                    weeks = 0
-                if not days:
-                    days = 0
-                if not hours:
-                    hours = 0
-                if not minutes:
-                    minutes = 0
-                current_time = datetime.now().timestamp()
-                time_next_run = (datetime.now() + relativedelta(months=int(months), weeks=int(weeks),
-                                                                days=int(days), hours=int(hours),
-                                                                minutes=int(minutes))).timestamp()
-                # Make sure the next capture is not scheduled for in a too short interval
-                interval_next_capture = time_next_run - current_time
-                if interval_next_capture < self.min_frequency:
-                    # self.logger.warning(f'The next capture is scheduled too soon: {interval_next_capture}s. Minimal interval: {self.min_frequency}s.')
-                    print(f'The next capture is scheduled too soon: {interval_next_capture}s. Minimal interval: {self.min_frequency}s.')
-                    time_next_run = (datetime.now() + timedelta(seconds=self.min_frequency)).timestamp()
-
-            schedule.set_next_run(time_next_run)
+        """
+        Arm the schedules that are neither in the queue nor tasked, ex: schedules created by a previous version.
+        Scan all the schedules, called once at the Crawler start.
+        """
+        schedules_uuids = list(get_schedulers_uuid())
+        if not schedules_uuids:
+            return None
+        pipe = r_crawler.pipeline(transaction=False)
+        for schedule_uuid in schedules_uuids:
+            pipe.zscore('scheduler:queue', schedule_uuid)
+            pipe.hmget(f'schedule:{schedule_uuid}', 'frequency', 'task')
+        res = pipe.execute()
+        schedules = {}
+        for i, schedule_uuid in enumerate(schedules_uuids):
+            next_run = res[i * 2]
+            frequency, task_uuid = res[i * 2 + 1]
+            if next_run is None and frequency:
+                schedules[schedule_uuid] = (frequency, task_uuid)
+
+        # Tasked schedules
+        tasked = [schedule_uuid for schedule_uuid in schedules if schedules[schedule_uuid][1]]
+        pipe = r_crawler.pipeline(transaction=False)
+        for schedule_uuid in tasked:
+            pipe.exists(f'crawler:task:{schedules[schedule_uuid][1]}')
+        for schedule_uuid, task_exists in zip(tasked, pipe.execute()):
+            if task_exists:
+                schedules.pop(schedule_uuid)
+
+        pipe = r_crawler.pipeline(transaction=False)
+        for schedule_uuid, (frequency, task_uuid) in schedules.items():
+            if task_uuid:
+                pipe.hdel(f'schedule:{schedule_uuid}', 'task')
+            pipe.zadd('scheduler:queue', mapping={schedule_uuid: get_schedule_next_run(frequency, self.min_frequency)})
             print('scheduled:', schedule_uuid)
+        pipe.execute()
 
     def process_queue(self):
+        """
+        Create the tasks of the due schedules
+        """
         now = datetime.now().timestamp()
-        for raw_schedule in r_crawler.zrangebyscore('scheduler:queue', '-inf', int(now), withscores=True):
-            schedule_uuid, next_run = raw_schedule
-            schedule = CrawlerSchedule(schedule_uuid)
-            if not schedule.exists():
-                return None
-            meta = schedule.get_meta()
-            task_uuid = create_task(meta['url'], depth=meta['depth'], har=meta['har'], screenshot=meta['screenshot'],
-                                    header=meta['header'],
-                                    cookiejar=meta['cookiejar'], proxy=meta['proxy'],
-                                    tags=meta['tags'],
-                                    user_agent=meta['user_agent'], parent='scheduler', priority=40)
+        schedules_uuids = r_crawler.zrangebyscore('scheduler:queue', '-inf', int(now))
+        if not schedules_uuids:
+            return None
+        pipe = r_crawler.pipeline(transaction=False)
+        for schedule_uuid in schedules_uuids:
+            pipe.hgetall(f'schedule:{schedule_uuid}')
+            pipe.smembers(f'schedule:tags:{schedule_uuid}')
+        res = pipe.execute()
+
+        pipe = r_crawler.pipeline(transaction=False)
+        for i, schedule_uuid in enumerate(schedules_uuids):
+            meta = res[i * 2]
+            tags = res[i * 2 + 1]
+            # Deleted schedule
+            if not meta:
+                pipe.zrem('scheduler:queue', schedule_uuid)
+                continue
+            task_uuid = create_task(meta['url'], depth=meta.get('depth', 1), har=meta.get('har') == 'True',
+                                    screenshot=meta.get('screenshot') == 'True', header=meta.get('header'),
+                                    cookiejar=meta.get('cookiejar'), proxy=meta.get('proxy'), tags=tags,
+                                    user_agent=meta.get('user_agent'), parent='scheduler', priority=40)
             if task_uuid:
-                schedule.set_task(task_uuid)
-                r_crawler.zrem('scheduler:queue', schedule_uuid)
+                pipe.hset(f'schedule:{schedule_uuid}', 'task', task_uuid)
+                pipe.hset(f'crawler:task:{task_uuid}', 'schedule', schedule_uuid)
+                pipe.zrem('scheduler:queue', schedule_uuid)
+        pipe.execute()
 
 
 # TODO Expire -> stuck in crawler queue or reached delta
@@ -1317,6 +1570,19 @@ class CrawlerSchedule:
     def set_next_run(self, time_next_run):
         r_crawler.zadd('scheduler:queue', mapping={self.uuid: time_next_run})
 
+    def arm(self):
+        """
+        Schedule the next run
+        """
+        frequency = self.get_frequency()
+        if frequency:
+            self.set_next_run(get_schedule_next_run(frequency))
+
+    # Crawler: the schedule task ended
+    def end_task(self):
+        r_crawler.hdel(f'schedule:{self.uuid}', 'task')
+        self.arm()
+
     def is_scheduled(self):
         return bool(r_crawler.zscore('scheduler:queue', self.uuid))
 
@@ -1427,16 +1693,17 @@ class CrawlerSchedule:
             self.set_tags(tags)
 
         r_crawler.sadd('scheduler:schedules', self.uuid)
+        self.arm()
 
     def delete(self):
-        # remove from schedule queue
-        r_crawler.zrem('scheduler:queue', self.uuid)
-
-        # delete task
+        # delete task, before the schedule queue: the end of the task re-arms the schedule
         task = self.get_task()
         if task:
             task.delete()
 
+        # remove from schedule queue
+        r_crawler.zrem('scheduler:queue', self.uuid)
+
         # delete meta
         r_crawler.delete(f'schedule:{self.uuid}')
         r_crawler.delete(f'schedule:tags:{self.uuid}')
@@ -1553,6 +1820,10 @@ class CrawlerCapture:
         r_cache.delete(f'crawler:capture:{self.uuid}')
         r_crawler.hdel('crawler:captures:tasks', self.uuid)
 
+    # Crawler: capture done, remove it from the status checks
+    def pop(self):
+        r_cache.zrem('crawler:captures', self.uuid)
+
     # Manual
     def delete(self):
         # remove Capture from crawler queue
@@ -1572,6 +1843,30 @@ def get_crawler_capture():
         capture = None
     return capture
 
+def get_crawler_captures_to_check():
+    """
+    :return: list of in-flight captures uuids, least recently checked first
+    """
+    return r_cache.zrange('crawler:captures', 0, -1)
+
+def get_captures_lacus_status(lacus, captures_uuids, executor):
+    """
+    Get the Lacus status of the captures in one concurrent sweep.
+    A failed request doesn't stop the sweep, its exception is returned.
+
+    :param lacus: PyLacus
+    :param captures_uuids: list of captures uuids
+    :param executor: concurrent.futures.Executor
+    :return: dict: capture uuid: CaptureStatus value or Exception
+    """
+    def _get_capture_status(capture_uuid):
+        try:
+            return lacus.get_capture_status(capture_uuid)
+        except Exception as e:
+            return e
+
+    return dict(zip(captures_uuids, executor.map(_get_capture_status, captures_uuids)))
+
 # TODO add capture times
 def get_captures_status():
     status = []
@@ -1677,6 +1972,9 @@ class CrawlerTask:
     def get_hash(self):
         return r_crawler.hget(f'crawler:task:{self.uuid}', 'hash')
 
+    def get_schedule(self):
+        return r_crawler.hget(f'crawler:task:{self.uuid}', 'schedule')
+
     def get_start_time(self):
         return r_crawler.hget(f'crawler:task:{self.uuid}', 'start_time')
 
@@ -1814,8 +2112,14 @@ class CrawlerTask:
         task_hash = self.get_hash()
         if task_hash:
             r_crawler.hdel('crawler:queue:hash', task_hash)
+        schedule_uuid = self.get_schedule()
         # meta
         r_crawler.delete(f'crawler:task:{self.uuid}')
+        # Re-arm the schedule
+        if schedule_uuid:
+            schedule = CrawlerSchedule(schedule_uuid)
+            if schedule.get_task_uuid() == self.uuid:
+                schedule.end_task()
 
     # Manual
     def delete(self):
@@ -1833,6 +2137,18 @@ def get_task_hash(url, domain, depth, har, screenshot, priority, proxy, cookieja
         to_enqueue['url'] = url
     return hashlib.sha512(pickle.dumps(to_enqueue)).hexdigest()
 
+def get_crawler_queue_next_domains(nb_tasks):
+    """
+    :return: domains of the next tasks of the crawler queue
+    """
+    tasks_uuids = r_crawler.zrevrange('crawler:queue', 0, nb_tasks - 1)
+    if not tasks_uuids:
+        return []
+    pipe = r_crawler.pipeline(transaction=False)
+    for task_uuid in tasks_uuids:
+        pipe.hget(f'crawler:task:{task_uuid}', 'domain')
+    return [domain for domain in pipe.execute() if domain]
+
 def add_task_to_lacus_queue():
     task_uuid = r_crawler.zpopmax('crawler:queue')
     if not task_uuid or not task_uuid[0]:
@@ -2278,12 +2594,29 @@ def test_ail_crawlers():
 #                       #
 # # # # # # # # # # # # #
 
+# Service unreachable: skip all the lookups for ONION_LOOKUP_BACKOFF seconds
+ONION_LOOKUP_BACKOFF = 60
+
+_onion_lookup_session = threading.local()
+_onion_lookup_user_agent = None
+
+def _get_onion_lookup_headers():
+    global _onion_lookup_user_agent
+    if _onion_lookup_user_agent is None:
+        _onion_lookup_user_agent = f'AIL-{git_status.get_last_commit_id_from_local()}'
+    return {'User-Agent': _onion_lookup_user_agent}
+
+def _get_onion_lookup_session():
+    session = getattr(_onion_lookup_session, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(_get_onion_lookup_headers())
+        _onion_lookup_session.session = session
+    return session
+
 def _onion_lookup(onion_url):
     try:
-        commit_id = git_status.get_last_commit_id_from_local()
-        user_agent = f'AIL-{commit_id}'
-        headers = {'User-Agent': user_agent}
-        response = requests.get(f'https://onion.ail-project.org/api/lookup/{onion_url}', timeout=10, headers=headers)
+        response = _get_onion_lookup_session().get(f'{ONION_LOOKUP_URL}{onion_url}', timeout=ONION_LOOKUP_TIMEOUT)
         if response.status_code == 200:
             json_response = response.json()
             return json_response
@@ -2291,25 +2624,105 @@ def _onion_lookup(onion_url):
             print(response)
             return {'error': f'{response.status_code}'}
     except requests.exceptions.ConnectionError:
-        return {'error': f'Connection Error'}
-    except requests.exceptions.ReadTimeout:
-        return {'error': f'Timeout Error'}
-
+        return {'error': f'Connection Error', 'unreachable': True}
+    except requests.exceptions.Timeout:
+        return {'error': f'Timeout Error', 'unreachable': True}
+    except ValueError:
+        return {'error': f'Invalid JSON response'}
+
+def get_onion_verdict(onion_url):
+    """
+    :return: cached verdict: safe, unsafe, unknown or None
+    """
+    return r_crawler.get(f'crawler:onion_filter:verdict:{onion_url}')
+
+def get_onions_verdicts(onions_urls):
+    """
+    :return: list of cached verdicts
+    """
+    if not onions_urls:
+        return []
+    return r_crawler.mget([f'crawler:onion_filter:verdict:{onion_url}' for onion_url in onions_urls])
+
+def is_onion_lookup_unreachable():
+    """
+    :return: True if the lookup service is unreachable, all the lookups are skipped
+    """
+    return r_cache.exists('crawler:onion_filter:error') == 1
+
+def get_onion_lookup_error(onion_url):
+    error = r_cache.get('crawler:onion_filter:error')
+    if not error:
+        error = r_cache.get(f'crawler:onion_filter:error:{onion_url}')
+    return error
+
+def clear_onion_lookup_cache(onion_url):
+    r_crawler.delete(f'crawler:onion_filter:verdict:{onion_url}')
+    r_cache.delete(f'crawler:onion_filter:error:{onion_url}')
+
+def lookup_onion(onion_url):
+    """
+    Lookup an onion and cache its verdict. The errors are cached for a shorter time.
+
+    :return: verdict: safe, unsafe, unknown or None
+    :raise OnionFilteringError: lookup error
+    """
+    error = get_onion_lookup_error(onion_url)
+    if error:
+        raise OnionFilteringError(error)
+    resp = _onion_lookup(onion_url)
+    verdict = None
+    if isinstance(resp, dict):
+        if 'tags' in resp:
+            if Tag.is_tags_safe(resp['tags']):
+                verdict = 'safe'
+            else:
+                verdict = 'unsafe'
+        elif resp.get('error'):
+            if resp.get('unreachable'):
+                r_cache.set('crawler:onion_filter:error', resp['error'], ex=ONION_LOOKUP_BACKOFF)
+            else:
+                r_cache.set(f'crawler:onion_filter:error:{onion_url}', resp['error'], ex=ONION_LOOKUP_TTLS['error'])
+            raise OnionFilteringError(resp['error'])
+    elif isinstance(resp, list):
+        if len(resp) > 1:
+            if resp[1] == 404:
+                verdict = 'unknown'
+    if verdict:
+        r_crawler.set(f'crawler:onion_filter:verdict:{onion_url}', verdict, ex=ONION_LOOKUP_TTLS[verdict])
+    else:
+        # unexpected response, not looked up again before the error TTL
+        r_cache.set(f'crawler:onion_filter:error:{onion_url}', 'Invalid response', ex=ONION_LOOKUP_TTLS['error'])
+    return verdict
+
+def prefetch_onion_lookup(onion_url):
+    """
+    Lookup an onion if its verdict isn't cached, errors are ignored
+    """
+    if not get_onion_verdict(onion_url):
+        try:
+            return lookup_onion(onion_url)
+        except OnionFilteringError:
+            pass
 
 def check_if_onion_is_safe(onion_url, unknown):
-    resp = _onion_lookup(onion_url)
-    if resp:
-        if isinstance(resp, dict):
-            if 'tags' in resp:
-                return Tag.is_tags_safe(resp['tags'])
-            elif 'error' in resp:
-                if resp['error']:
-                    raise OnionFilteringError(resp['error'])
-        elif not unknown:
-            if isinstance(resp, list):
-                if len(resp) > 1:
-                    if resp[1] == 404:
-                        return True
+    """
+    :param unknown: filter the onions unknown by the lookup service
+    :raise OnionFilteringError: lookup error
+    """
+    verdict = get_onion_verdict(onion_url)
+    if not verdict:
+        verdict = lookup_onion(onion_url)
+    return is_onion_verdict_safe(verdict, unknown)
+
+def is_onion_verdict_safe(verdict, unknown):
+    """
+    :param unknown: filter the onions unknown by the lookup service
+    """
+    if verdict == 'safe':
+        return True
+    elif verdict == 'unknown':
+        return not unknown
     return False
 
 
@@ -2405,7 +2818,4 @@ load_blacklist()
 #     temp_url = ''
 #     r = extract_favicon_from_html(content, temp_url)
 #     print(r)
-#     _reprocess_all_hars_cookie_name()
-#     _reprocess_all_hars_etag()
 #     _gzip_all_hars()
-#     _reprocess_all_hars_hhhashs()
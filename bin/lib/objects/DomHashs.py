@@ -93,14 +93,25 @@ class DomHash(AbstractDaterangeObject):
         self._create()
 
 
+def get_dom_hash(tags_names):
+    """
+    :param tags_names: names of all the HTML tags, in document order
+    """
+    to_hash = "|".join(tags_names).encode()
+    return sha256(to_hash).hexdigest()[:32]
+
 def _compute_dom_hash(html_content):
     soup = BeautifulSoup(html_content, "lxml")
-    to_hash = "|".join(t.name for t in soup.findAll()).encode()
-    return sha256(to_hash).hexdigest()[:32]
+    return get_dom_hash(t.name for t in soup.findAll())
 
 
-def create(content):
-    obj_id = _compute_dom_hash(content)
+def create(content, obj_id=None):
+    """
+    :param content: HTML content
+    :param obj_id: DOM hash already computed, ex: crawlers.extract_html_metadata
+    """
+    if not obj_id:
+        obj_id = _compute_dom_hash(content)
     obj = DomHash(obj_id)
     if not obj.exists():
         obj.create()
@@ -10,7 +10,6 @@ import zipfile
 
 from datetime import datetime
 from flask import url_for
-from io import BytesIO
 from pymisp import MISPObject
 
 sys.path.append(os.environ['AIL_BIN'])
@@ -30,8 +29,15 @@ config_loader = ConfigLoader.ConfigLoader()
 r_crawler = config_loader.get_db_conn("Kvrocks_Crawler")
 
 baseurl = config_loader.get_config_str("Notifications", "ail_domain")
+# Max size of the files added in a domain zip, in MB
+if config_loader.has_option('Crawler', 'domain_download_max_size'):
+    DOWNLOAD_MAX_SIZE = config_loader.get_config_int('Crawler', 'domain_download_max_size') * 1024 * 1024
+else:
+    DOWNLOAD_MAX_SIZE = 2048 * 1024 * 1024
 config_loader = None
 
+ZIP_CHUNK_SIZE = 1024 * 1024
+
 
 ################################################################################
 ################################################################################
@@ -369,41 +375,70 @@ class Domain(AbstractObject):
 
     # TODO ADD MISP Event Export
     # TODO DOWN DOMAIN
-    def get_download_zip(self, epoch=None):
-        hars_dir = ConfigLoader.get_hars_dir()
-        items_dir = ConfigLoader.get_items_dir()
-        screenshots_dir = ConfigLoader.get_screenshots_dir()
+    def get_download_zip(self, epoch=None, max_size=None):
+        """
+        Stream a zip of the domain crawled items, HARs and screenshots
+
+        :param epoch: crawl epoch, default: last crawl
+        :param max_size: max size in bytes of the files added in the zip, capped by DOWNLOAD_MAX_SIZE
+        :return: generator of zip chunks, None if no crawled items
+        """
         items = self.get_crawled_items_by_epoch(epoch=epoch)
         if not items:
             return None
+        if not max_size or max_size > DOWNLOAD_MAX_SIZE:
+            max_size = DOWNLOAD_MAX_SIZE
+        return self._stream_download_zip(items, max_size)
+
+    def _get_download_zip_files(self, item_id, hars_dir, items_dir, screenshots_dir):
+        basename = os.path.basename(item_id)
+        # Item
+        files = [(os.path.join(items_dir, item_id), f'{basename}.gz')]
+        # HAR
+        har = get_item_har(item_id)
+        if har:
+            files.append((os.path.join(hars_dir, har), f'{basename}.json.gz'))
+        # Screenshot
+        screenshot = self.get_obj_correlations('item', '', item_id, ['screenshot'])
+        if screenshot and screenshot['screenshot']:
+            screenshot = screenshot['screenshot'].pop()[1:]
+            screenshot = os.path.join(screenshot[0:2], screenshot[2:4], screenshot[4:6], screenshot[6:8],
+                                      screenshot[8:10], screenshot[10:12], screenshot[12:])
+            files.append((os.path.join(screenshots_dir, f'{screenshot}.png'), f'{basename}.png'))
+        return files
+
+    def _stream_download_zip(self, items, max_size):
+        hars_dir = ConfigLoader.get_hars_dir()
+        items_dir = ConfigLoader.get_items_dir()
+        screenshots_dir = ConfigLoader.get_screenshots_dir()
         map_file = 'ITEM ID    :    URL'
-        # zip buffer
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "a") as zf:
+        size = 0
+        truncated = False
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, 'w') as zf:
             for item_id in items:
-                url = get_item_url(item_id)
-                basename = os.path.basename(item_id)
-                # Item
-                _write_in_zip_buffer(zf, os.path.join(items_dir, item_id), f'{basename}.gz')
-                map_file = map_file + f'\n{item_id}    :    {url}'
-                # HAR
-                har = get_item_har(item_id)
-                if har:
-                    print(har)
-                    _write_in_zip_buffer(zf, os.path.join(hars_dir, har), f'{basename}.json.gz')
-                # Screenshot
-                screenshot = self.get_obj_correlations('item', '', item_id, ['screenshot'])
-                if screenshot and screenshot['screenshot']:
-                    screenshot = screenshot['screenshot'].pop()[1:]
-                    screenshot = os.path.join(screenshot[0:2], screenshot[2:4], screenshot[4:6], screenshot[6:8],
-                                              screenshot[8:10], screenshot[10:12], screenshot[12:])
-                    _write_in_zip_buffer(zf, os.path.join(screenshots_dir, f'{screenshot}.png'), f'{basename}.png')
-
-            zf.writestr('_URL_MAP_', BytesIO(map_file.encode()).getvalue())
+                files = self._get_download_zip_files(item_id, hars_dir, items_dir, screenshots_dir)
+                files_size = 0
+                for path, _ in files:
+                    if os.path.isfile(path):
+                        files_size += os.path.getsize(path)
+                if size + files_size > max_size:
+                    truncated = True
+                    break
+                size += files_size
+                for path, filename in files:
+                    if os.path.isfile(path):
+                        yield from _write_in_zip_stream(zf, stream, path, filename)
+                map_file = map_file + f'\n{item_id}    :    {get_item_url(item_id)}'
+
+            zf.writestr('_URL_MAP_', map_file.encode())
+            if truncated:
+                zf.writestr('_TRUNCATED_', f'Max size reached: {max_size} bytes, {len(items)} crawled items'.encode())
             misp_object = self.get_misp_object().to_json().encode()
-            zf.writestr('misp.json', BytesIO(misp_object).getvalue())
-        zip_buffer.seek(0)
-        return zip_buffer
+            zf.writestr('misp.json', misp_object)
+            yield stream.pop()
+        # central directory
+        yield stream.pop()
 
     def add_language(self, language):
         r_crawler.sadd('all_domains_languages', language)
@@ -467,11 +502,39 @@ class Domain(AbstractObject):
                 r_crawler.sadd(f'full_{self.domain_type}_down', self.id)
 
 ############################################################################
-# In memory zipfile
-def _write_in_zip_buffer(zf, path, filename):
-    with open(path, "rb") as f:
-        content = f.read()
-        zf.writestr( filename, BytesIO(content).getvalue())
+# Streamed zipfile
+
+class _ZipStream:
+    """
+    Unseekable zipfile output, the written data is popped by chunks
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _write_in_zip_stream(zf, stream, path, filename):
+    with open(path, 'rb') as f:
+        with zf.open(filename, 'w', force_zip64=True) as zip_f:
+            while True:
+                chunk = f.read(ZIP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                zip_f.write(chunk)
+                data = stream.pop()
+                if data:
+                    yield data
+    yield stream.pop()
 
 ############################################################################
 
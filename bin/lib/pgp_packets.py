@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*-coding:UTF-8 -*
+"""
+OpenPGP armor and packets parser (RFC 4880 / RFC 9580)
+
+Extract the key IDs and user IDs of a PGP block, the IDs printed by pgpdump:
+    - Public-Key Encrypted Session Key packets: recipient key ID
+    - Signature packets: v3 key ID, issuer key ID subpacket, signer's user ID subpacket
+    - One-Pass Signature packets: key ID
+    - User ID packets
+    - Compressed Data packets are decompressed and parsed
+
+"""
+import base64
+import bz2
+import re
+import zlib
+
+# Packet Tags
+TAG_PKESK = 1
+TAG_SIGNATURE = 2
+TAG_ONE_PASS_SIGNATURE = 4
+TAG_SECRET_KEY = 5
+TAG_COMPRESSED_DATA = 8
+TAG_USER_ID = 13
+
+# Signature Subpackets
+SUBPACKET_ISSUER = 16
+SUBPACKET_SIGNER_USER_ID = 28
+
+MAX_COMPRESSION_DEPTH = 4
+MAX_DECOMPRESSED_SIZE = 32 * 1024 * 1024
+
+REGEX_ARMOR_HEADER = re.compile(r'^[A-Za-z][A-Za-z0-9-]*:')
+
+
+class PgpParserError(Exception):
+    pass
+
+
+def dearmor(pgp_block):
+    """
+    Decode an ASCII armored PGP block
+
+    :param pgp_block: str, -----BEGIN PGP ...----- block
+    :return: bytes
+    """
+    lines = []
+    in_block = False
+    for line in pgp_block.splitlines():
+        line = line.strip()
+        if line.startswith('-----BEGIN PGP'):
+            in_block = True
+            continue
+        elif line.startswith('-----END PGP'):
+            break
+        if not in_block or not line:
+            continue
+        # Armor Headers: Version, Comment, Hash, Charset, ...
+        if REGEX_ARMOR_HEADER.match(line):
+            continue
+        # Checksum
+        if line.startswith('='):
+            break
+        lines.append(line)
+    data = ''.join(lines)
+    data = re.sub(r'[^A-Za-z0-9+/]', '', data)
+    # missing padding
+    data = data + '=' * (-len(data) % 4)
+    try:
+        return base64.b64decode(data)
+    except ValueError as e:
+        raise PgpParserError(f'Invalid base64: {e}')
+
+
+def _get_new_format_length(data, offset):
+    """
+    :return: (length, new offset, partial)
+    """
+    first = data[offset]
+    if first < 192:
+        return first, offset + 1, False
+    elif first < 224:
+        if offset + 1 >= len(data):
+            raise PgpParserError('Truncated packet length')
+        return ((first - 192) << 8) + data[offset + 1] + 192, offset + 2, False
+    elif first == 255:
+        if offset + 4 >= len(data):
+            raise PgpParserError('Truncated packet length')
+        return int.from_bytes(data[offset + 1:offset + 5], 'big'), offset + 5, False
+    else:
+        return 1 << (first & 0x1F), offset + 1, True
+
+
+def parse_packets(data):
+    """
+    Parse a sequence of OpenPGP packets
+
+    :param data: bytes
+    :return: generator of (tag, body)
+    """
+    offset = 0
+    size = len(data)
+    while offset < size:
+        header = data[offset]
+        if not header & 0x80:
+            raise PgpParserError(f'Invalid packet header: {header}')
+        offset += 1
+        # New format
+        if header & 0x40:
+            tag = header & 0x3F
+            if offset >= size:
+                raise PgpParserError('Truncated packet header')
+            length, offset, partial = _get_new_format_length(data, offset)
+            body = data[offset:offset + length]
+            offset += length
+            while partial:
+                if offset >= size:
+                    break
+                length, offset, partial = _get_new_format_length(data, offset)
+                body += data[offset:offset + length]
+                offset += length
+        # Old format
+        else:
+            tag = (header >> 2) & 0x0F
+            length_type = header & 0x03
+            if length_type == 3:
+                length = size - offset
+            else:
+                nb_bytes = 1 << length_type
+                if offset + nb_bytes > size:
+                    raise PgpParserError('Truncated packet length')
+                length = int.from_bytes(data[offset:offset + nb_bytes], 'big')
+                offset += nb_bytes
+            body = data[offset:offset + length]
+            offset += length
+        yield tag, body
+
+
+def _get_key_id(key_id):
+    return '0x' + key_id.hex().upper()
+
+
+def _parse_subpackets(data, pgp_ids):
+    offset = 0
+    size = len(data)
+    while offset < size:
+        first = data[offset]
+        if first < 192:
+            length = first
+            offset += 1
+        elif first < 255:
+            if offset + 1 >= size:
+                return None
+            length = ((first - 192) << 8) + data[offset + 1] + 192
+            offset += 2
+        else:
+            length = int.from_bytes(data[offset + 1:offset + 5], 'big')
+            offset += 5
+        if length == 0 or offset + length > size:
+            return None
+        subpacket_type = data[offset] & 0x7F
+        subpacket = data[offset + 1:offset + length]
+        offset += length
+
+        if subpacket_type == SUBPACKET_ISSUER and len(subpacket) == 8:
+            pgp_ids['keys'].append(_get_key_id(subpacket))
+        elif subpacket_type == SUBPACKET_SIGNER_USER_ID:
+            pgp_ids['users'].append(subpacket.decode('utf-8', errors='replace'))
+
+
+def _parse_signature(body, pgp_ids):
+    if not body:
+        return None
+    version = body[0]
+    if version in (2, 3):
+        # version, hashed length (5), signature type, creation time, key ID
+        if len(body) >= 15:
+            pgp_ids['keys'].append(_get_key_id(body[7:15]))
+    elif version in (4, 5, 6):
+        # version, signature type, public key algorithm, hash algorithm
+        offset = 4
+        nb_bytes = 4 if version == 6 else 2
+        for _ in range(2):  # hashed and unhashed subpackets
+            if offset + nb_bytes > len(body):
+                return None
+            length = int.from_bytes(body[offset:offset + nb_bytes], 'big')
+            offset += nb_bytes
+            _parse_subpackets(body[offset:offset + length], pgp_ids)
+            offset += length
+
+
+def _decompress(body):
+    if not body:
+        return b''
+    algo = body[0]
+    data = body[1:]
+    if algo == 0:
+        return data
+    elif algo == 1:
+        decompressor = zlib.decompressobj(-15)
+    elif algo == 2:
+        decompressor = zlib.decompressobj()
+    elif algo == 3:
+        decompressor = bz2.BZ2Decompressor()
+        return decompressor.decompress(data, max_length=MAX_DECOMPRESSED_SIZE)
+    else:
+        raise PgpParserError(f'Unknown compression algorithm: {algo}')
+    return decompressor.decompress(data, MAX_DECOMPRESSED_SIZE)
+
+
+def _extract_ids(data, pgp_ids, depth=0):
+    for tag, body in parse_packets(data):
+        if tag == TAG_PKESK:
+            # version 3: version, key ID
+            if len(body) >= 9 and body[0] == 3:
+                pgp_ids['keys'].append(_get_key_id(body[1:9]))
+        elif tag == TAG_SIGNATURE:
+            _parse_signature(body, pgp_ids)
+        elif tag == TAG_ONE_PASS_SIGNATURE:
+            # version 3: version, signature type, hash algorithm, public key algorithm, key ID
+            if len(body) >= 12 and body[0] == 3:
+                pgp_ids['keys'].append(_get_key_id(body[4:12]))
+        elif tag == TAG_SECRET_KEY:
+            pgp_ids['private'] = True
+        elif tag == TAG_USER_ID:
+            pgp_ids['users'].append(body.decode('utf-8', errors='replace'))
+        elif tag == TAG_COMPRESSED_DATA:
+            if depth < MAX_COMPRESSION_DEPTH:
+                try:
+                    _extract_ids(_decompress(body), pgp_ids, depth=depth + 1)
+                except (zlib.error, OSError, EOFError):
+                    pass
+
+
+def extract_pgp_ids(pgp_block):
+    """
+    Extract the key IDs and users IDs of an ASCII armored PGP block.
+    A malformed block returns the IDs parsed before the error.
+
+    :param pgp_block: str
+    :return: dict: keys: list of key IDs (0x<16 hex uppercase>), users: list of user IDs,
+                   private: True if the block contains a secret key packet
+    """
+    pgp_ids = {'keys': [], 'users': [], 'private': False}
+    try:
+        _extract_ids(dearmor(pgp_block), pgp_ids)
+    except (PgpParserError, IndexError):
+        pass
+    return pgp_ids
@@ -34,6 +34,7 @@ def generate_redis_cache_key(module_name):
     return f'{module_name}_extracted:{new_uuid}'
 
 def _regex_findall(redis_key, regex, item_content, r_set):
+    ConfigLoader.reset_connection_pools()
     all_items = re.findall(regex, item_content)
     if r_set:
         if len(all_items) > 1:
@@ -78,6 +79,7 @@ def regex_findall(module_name, redis_key, regex, item_id, item_content, max_time
         sys.exit(0)
 
 def _regex_finditer(r_key, regex, content):
+    ConfigLoader.reset_connection_pools()
     iterator = re.finditer(regex, content)
     for match in iterator:
         value = match.group()
@@ -112,6 +114,7 @@ def regex_finditer(r_key, regex, item_id, content, max_time=30):
         sys.exit(0)
 
 def _regex_match(r_key, regex, content):
+    ConfigLoader.reset_connection_pools()
     if re.match(regex, content):
         r_serv_cache.set(r_key, 1)
         r_serv_cache.expire(r_key, 360)
@@ -140,6 +143,7 @@ def regex_match(r_key, regex, item_id, content, max_time=30):
         sys.exit(0)
 
 def _regex_search(r_key, regex, content):
+    ConfigLoader.reset_connection_pools()
     if re.search(regex, content):
         r_serv_cache.set(r_key, 1)
         r_serv_cache.expire(r_key, 360)
@@ -169,6 +173,7 @@ def regex_search(r_key, regex, item_id, content, max_time=30):
 
 ## Phone Regexs ##
 def _regex_phone_iter(r_key, country_code, content):
+    ConfigLoader.reset_connection_pools()
     import phonenumbers
     iterator = phonenumbers.PhoneNumberMatcher(content, country_code)
     for match in iterator:
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*-coding:UTF-8 -*
+"""
+URLs helper: cached faup parsing and batched URLs messages
+
+The Urls module sends the URLs of an object in batches, a JSON list of parsed URLs:
+    [{'url': ..., 'host': ..., 'resource_path': ..., 'query_string': ..., ...}, ...]
+"""
+import json
+
+from functools import lru_cache
+
+from pyfaup.faup import Faup
+
+URLS_BATCH_SIZE = 1000
+URLS_CACHE_SIZE = 10000
+
+FAUP_FIELDS = ('url', 'scheme', 'credential', 'subdomain', 'domain', 'domain_without_tld', 'host', 'tld', 'port',
+               'resource_path', 'query_string', 'fragment')
+
+faup = Faup()
+
+
+def _to_str(value):
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+@lru_cache(maxsize=URLS_CACHE_SIZE)
+def _parse_url(url):
+    faup.decode(url)
+    url_decoded = faup.get()
+    return tuple((field, _to_str(url_decoded.get(field))) for field in FAUP_FIELDS)
+
+
+def parse_url(url):
+    """
+    Parse an URL with faup, cached
+
+    :return: dict of the faup fields, str or None
+    """
+    return dict(_parse_url(url))
+
+
+def create_urls_messages(urls, batch_size=URLS_BATCH_SIZE):
+    """
+    :param urls: list of parsed URLs
+    :return: list of messages
+    """
+    messages = []
+    for i in range(0, len(urls), batch_size):
+        messages.append(json.dumps(urls[i:i + batch_size]))
+    return messages
+
+
+def get_urls_from_message(message):
+    """
+    :param message: batch of parsed URLs or one URL
+    :return: list of parsed URLs
+    """
+    if message.startswith('['):
+        try:
+            return json.loads(message)
+        except json.JSONDecodeError:
+            pass
+    return [parse_url(message)]
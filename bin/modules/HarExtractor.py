@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*-coding:UTF-8 -*
+"""
+The HarExtractor Module
+============================
+
+Extract the cookies names, etags and HHHashs of the HARs saved by the crawler,
+in one streaming pass over the HAR entries.
+
+Input message: domain object, <har id>
+
+"""
+import os
+import sys
+
+sys.path.append(os.environ['AIL_BIN'])
+##################################
+# Import Project packages
+##################################
+from modules.abstract_module import AbstractModule
+from lib import crawlers
+
+
+class HarExtractor(AbstractModule):
+    """
+    HarExtractor module for AIL framework
+    """
+
+    def __init__(self):
+        super(HarExtractor, self).__init__()
+
+        # Send module state to logs
+        self.logger.info(f'Module {self.module_name} initialized')
+
+    def compute(self, message):
+        domain = self.get_obj()
+        har_id = message
+        if not har_id or not os.path.isfile(os.path.join(crawlers.get_har_dir(), har_id)):
+            self.logger.warning(f'{domain.id}: HAR not found: {har_id}')
+            return None
+        _, date = crawlers.get_har_domain_date(har_id)
+        extractor = crawlers.extract_har_objects(har_id, domain=domain.id, date=date)
+        self.logger.debug(f'{har_id}: {len(extractor.cookies_names)} cookies names, {len(extractor.etags)} etags, '
+                          f'{len(extractor.hhhashs)} hhhashs')
+
+
+if __name__ == '__main__':
+    module = HarExtractor()
+    module.run()
@@ -16,7 +16,6 @@ import sys
 import pylibinjection
 
 from datetime import datetime
-from pyfaup.faup import Faup
 from urllib.parse import unquote
 
 
@@ -25,6 +24,7 @@ sys.path.append(os.environ['AIL_BIN'])
 # Import Project packages
 ##################################
 from modules.abstract_module import AbstractModule
+from lib import urls_helper
 
 class LibInjection(AbstractModule):
     """docstring for LibInjection module."""
@@ -32,43 +32,17 @@ class LibInjection(AbstractModule):
     def __init__(self):
         super(LibInjection, self).__init__()
 
-        self.faup = Faup()
-
         self.logger.info(f"Module: {self.module_name} Launched")
 
     def compute(self, message):
-        url = message
-
-        self.faup.decode(url)
-        url_parsed = self.faup.get()
-        # # TODO: # FIXME: remove me
-        try:
-            resource_path = url_parsed['resource_path'].encode()
-        except:
-            resource_path = url_parsed['resource_path']
-
-        # # TODO: # FIXME: remove me
-        try:
-            query_string = url_parsed['query_string'].encode()
-        except:
-            query_string = url_parsed['query_string']
-
-        result_path = {'sqli': False}
-        result_query = {'sqli': False}
-
-        if resource_path is not None:
-            result_path = pylibinjection.detect_sqli(resource_path)
-            # print(f'path is sqli : {result_path}')
-
-        if query_string is not None:
-            result_query = pylibinjection.detect_sqli(query_string)
-            # print(f'query is sqli : {result_query}')
-
-        if result_path['sqli'] is True or result_query['sqli'] is True:
-
-            self.logger.info(f'Detected SQL in URL;{self.obj.get_global_id()}')
-            print(unquote(url))
-
+        detected = False
+        for url_parsed in urls_helper.get_urls_from_message(message):
+            if self.is_sql_injection(url_parsed):
+                self.logger.info(f'Detected SQL in URL;{self.obj.get_global_id()}')
+                print(unquote(url_parsed['url']))
+                detected = True
+
+        if detected:
             # Add tag
             tag = 'infoleak:automatic-detection="sql-injection"'
             self.add_message_to_queue(message=tag, queue='Tags')
@@ -83,6 +57,27 @@ class LibInjection(AbstractModule):
             #     date = datetime.now().strftime("%Y%m")
             #     Statistics.add_module_tld_stats_by_date(self.module_name, date, tld, 1)
 
+    def is_sql_injection(self, url_parsed):
+        resource_path = url_parsed['resource_path']
+        if resource_path is not None:
+            resource_path = resource_path.encode()
+        query_string = url_parsed['query_string']
+        if query_string is not None:
+            query_string = query_string.encode()
+
+        result_path = {'sqli': False}
+        result_query = {'sqli': False}
+
+        if resource_path is not None:
+            result_path = pylibinjection.detect_sqli(resource_path)
+            # print(f'path is sqli : {result_path}')
+
+        if query_string is not None:
+            result_query = pylibinjection.detect_sqli(query_string)
+            # print(f'query is sqli : {result_query}')
+
+        return result_path['sqli'] is True or result_query['sqli'] is True
+
 
 if __name__ == "__main__":
     module = LibInjection()
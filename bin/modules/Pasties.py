@@ -22,6 +22,7 @@ sys.path.append(os.environ['AIL_BIN'])
 from modules.abstract_module import AbstractModule
 from lib.ConfigLoader import ConfigLoader
 from lib import crawlers
+from lib import urls_helper
 
 # TODO add url validator
 
@@ -102,15 +103,15 @@ class Pasties(AbstractModule):
             crawlers.create_task(url, depth=0, har=False, screenshot=False, proxy='force_tor', priority=60, parent=obj_id)
 
     def compute(self, message):
-        url = message.split()
+        for url_decoded in urls_helper.get_urls_from_message(message):
+            self.compute_url(url_decoded)
 
-        self.faup.decode(url)
-        url_decoded = self.faup.get()
-        # print(url_decoded)
+    def compute_url(self, url_decoded):
+        url = url_decoded['url']
         url_host = url_decoded['host']
         # if url_decoded.get('port', ''):
         #     url_host = f'{url_host}:{url_decoded["port"]}'
-        path = url_decoded.get('resource_path', '')
+        path = url_decoded.get('resource_path') or ''
         if url_host in self.pasties:
             if url.startswith('http://'):
                 if url[7:] in self.urls_blocklist:
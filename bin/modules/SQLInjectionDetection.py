@@ -24,6 +24,7 @@ sys.path.append(os.environ['AIL_BIN'])
 # Import Project packages
 ##################################
 from modules.abstract_module import AbstractModule
+from lib import urls_helper
 # from lib.ConfigLoader import ConfigLoader
 # from lib import Statistics
 
@@ -42,15 +43,15 @@ class SQLInjectionDetection(AbstractModule):
         self.logger.info(f"Module: {self.module_name} Launched")
 
     def compute(self, message):
-        url = message
-
-        if self.is_sql_injection(url):
-            # self.faup.decode(url)
-            # url_parsed = self.faup.get()
-
-            print(f"Detected SQL in URL: {self.obj.get_global_id()}")
-            print(urllib.request.unquote(url))
-
+        detected = False
+        for url_parsed in urls_helper.get_urls_from_message(message):
+            url = url_parsed['url']
+            if self.is_sql_injection(url):
+                print(f"Detected SQL in URL: {self.obj.get_global_id()}")
+                print(urllib.request.unquote(url))
+                detected = True
+
+        if detected:
             # Tag
             tag = f'infoleak:automatic-detection="sql-injection"'
             self.add_message_to_queue(message=tag, queue='Tags')
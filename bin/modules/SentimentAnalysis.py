@@ -23,9 +23,7 @@ import sys
 import time
 import datetime
 import calendar
-import redis
 import json
-import signal
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from nltk import tokenize, download
 
@@ -34,19 +32,9 @@ sys.path.append(os.environ['AIL_BIN'])
 # Import Project packages
 ##################################
 from modules.abstract_module import AbstractModule
-from lib.objects.Items import Item
 from lib import ConfigLoader
 
 
-class TimeoutException(Exception):
-    pass
-
-def timeout_handler(signum, frame):
-    raise TimeoutException
-
-signal.signal(signal.SIGALRM, timeout_handler)
-
-## TODO: REFACTOR MODULE + CLEAN HISTORY
 class SentimentAnalysis(AbstractModule):
     """
     SentimentAnalysis module for AIL framework
@@ -55,16 +43,23 @@ class SentimentAnalysis(AbstractModule):
     # Config Variables
     accepted_Mime_type = ['text/plain']
     line_max_length_threshold = 1000
+    # Sentences scored between two checks of the processing time
+    sentences_chunk_size = 500
+    max_sentences = 20000
 
     def __init__(self):
         super(SentimentAnalysis, self).__init__()
 
-        self.sentiment_lexicon_file = ConfigLoader.ConfigLoader().get_config_str("Directories", "sentiment_lexicon_file")
+        config_loader = ConfigLoader.ConfigLoader()
+        self.sentiment_lexicon_file = config_loader.get_config_str("Directories", "sentiment_lexicon_file")
+        self.db = config_loader.get_db_conn("Kvrocks_Stats")
+        config_loader = None
 
-        # REDIS_LEVEL_DB #
-        self.db = ConfigLoader.ConfigLoader().get_redis_conn("_Sentiment")
+        # Load the lexicon once
+        self.analyzer = SentimentIntensityAnalyzer(self.sentiment_lexicon_file)
 
-        self.time1 = time.time()
+        # Max time to compute one entry
+        self.max_execution_time = 60
 
         # Waiting time in secondes between to message proccessed
         self.pending_seconds = 1
@@ -73,34 +68,65 @@ class SentimentAnalysis(AbstractModule):
         self.logger.info(f"Module {self.module_name} initialized")
 
     def compute(self, message):
-        # Max time to compute one entry
-        signal.alarm(60)
-        try:
-            self.analyse(message)
-        except TimeoutException:
-            self.logger.debug(f"{message} processing timeout")
-        else:
-            signal.alarm(0)
+        self.analyse(self.get_obj())
 
     def get_p_content_with_removed_lines(self, threshold, item_content):
         num_line_removed = 0
-        line_length_threshold = threshold
-        string_content = ""
-        f = item_content
-        for line_id, line in enumerate(f):
-            length = len(line)
-
-            if length < line_length_threshold:
-                string_content += line
+        lines = []
+        for line in item_content.splitlines(keepends=True):
+            if len(line) < threshold:
+                lines.append(line)
             else:
                 num_line_removed += 1
+        return num_line_removed, ''.join(lines)
 
-        return num_line_removed, string_content
-
-    def analyse(self, message):
-
-        item = Item(message)
+    def get_sentences(self, content):
+        try:
+            return tokenize.sent_tokenize(content)
+        except LookupError:
+            # use the NLTK Downloader to obtain the resource
+            download('punkt')
+            return tokenize.sent_tokenize(content)
+
+    def score_sentences(self, sentences):
+        """
+        Score the sentences by chunks, stop once max_execution_time is reached
+
+        :return: average scores, number of scored sentences
+        """
+        avg_score = {'neg': 0.0, 'neu': 0.0, 'pos': 0.0, 'compoundPos': 0.0, 'compoundNeg': 0.0}
+        neg_line = 0
+        pos_line = 0
+        nb_sentences = 0
+        start = time.time()
+        sentences = sentences[:self.max_sentences]
+        for i in range(0, len(sentences), self.sentences_chunk_size):
+            for sentence in sentences[i:i + self.sentences_chunk_size]:
+                ss = self.analyzer.polarity_scores(sentence)
+                avg_score['neg'] += ss['neg']
+                avg_score['neu'] += ss['neu']
+                avg_score['pos'] += ss['pos']
+                if ss['neg'] > ss['pos']:
+                    avg_score['compoundNeg'] += ss['compound']
+                    neg_line += 1
+                else:
+                    avg_score['compoundPos'] += ss['compound']
+                    pos_line += 1
+            nb_sentences = min(i + self.sentences_chunk_size, len(sentences))
+            if time.time() - start > self.max_execution_time:
+                self.logger.debug(f'{self.obj.get_global_id()} processing timeout, {nb_sentences} sentences scored')
+                break
+
+        for k in avg_score:
+            if k == 'compoundPos':
+                avg_score[k] = avg_score[k] / (pos_line if pos_line > 0 else 1)
+            elif k == 'compoundNeg':
+                avg_score[k] = avg_score[k] / (neg_line if neg_line > 0 else 1)
+            else:
+                avg_score[k] = avg_score[k] / nb_sentences
+        return avg_score, nb_sentences
 
+    def analyse(self, item):
         # get content with removed line + number of them
         num_line_removed, p_content = self.get_p_content_with_removed_lines(SentimentAnalysis.line_max_length_threshold,
                                                                             item.get_content())
@@ -122,58 +148,25 @@ class SentimentAnalysis(AbstractModule):
             combined_datetime = datetime.datetime.combine(the_date, the_time)
             timestamp = calendar.timegm(combined_datetime.timetuple())
 
-            try:
-                sentences = tokenize.sent_tokenize(p_content)
-            except:
-                # use the NLTK Downloader to obtain the resource
-                download('punkt')
-                sentences = tokenize.sent_tokenize(p_content)
-
+            sentences = self.get_sentences(p_content)
             if len(sentences) > 0:
-                avg_score = {'neg': 0.0, 'neu': 0.0, 'pos': 0.0, 'compoundPos': 0.0, 'compoundNeg': 0.0}
-                neg_line = 0
-                pos_line = 0
-                sid = SentimentIntensityAnalyzer(self.sentiment_lexicon_file)
-                for sentence in sentences:
-                    ss = sid.polarity_scores(sentence)
-                    for k in sorted(ss):
-                        if k == 'compound':
-                            if ss['neg'] > ss['pos']:
-                                avg_score['compoundNeg'] += ss[k]
-                                neg_line += 1
-                            else:
-                                avg_score['compoundPos'] += ss[k]
-                                pos_line += 1
-                        else:
-                            avg_score[k] += ss[k]
-
-
+                avg_score, nb_sentences = self.score_sentences(sentences)
+
+                # sentiment:providers -> {provider}
+                # sentiment:{provider}:{hour timestamp} -> {item_id: scores}
+                # sentiment:stats:{provider}:{hour timestamp} -> sum of the items scores + nb items
+                provider_timestamp = f'{provider}:{timestamp}'
+                self.logger.debug(f'{provider_timestamp}->{item.id} dropped {num_line_removed} lines')
+                pipe = self.db.pipeline(transaction=False)
+                pipe.sadd('sentiment:providers', provider)
+                pipe.hset(f'sentiment:{provider_timestamp}', item.id, json.dumps(avg_score))
                 for k in avg_score:
-                    if k == 'compoundPos':
-                        avg_score[k] = avg_score[k] / (pos_line if pos_line > 0 else 1)
-                    elif k == 'compoundNeg':
-                        avg_score[k] = avg_score[k] / (neg_line if neg_line > 0 else 1)
-                    else:
-                        avg_score[k] = avg_score[k] / len(sentences)
-
-
-                # In redis-levelDB: {} = set, () = K-V
-                # {Provider_set -> provider_i}
-                # {Provider_TimestampInHour_i -> UniqID_i}_j
-                # (UniqID_i -> PasteValue_i)
-
-                self.db.sadd('Provider_set', provider)
-
-                provider_timestamp = provider + '_' + str(timestamp)
-                self.db.incr('UniqID')
-                UniqID = self.db.get('UniqID')
-                self.logger.debug(f'{provider_timestamp}->{UniqID}dropped{num_line_removed}lines')
-                self.db.sadd(provider_timestamp, UniqID)
-                self.db.set(UniqID, avg_score)
+                    pipe.hincrbyfloat(f'sentiment:stats:{provider_timestamp}', k, avg_score[k])
+                pipe.hincrby(f'sentiment:stats:{provider_timestamp}', 'nb', 1)
+                pipe.execute()
         else:
             self.logger.debug(f'Dropped:{p_MimeType}')
 
-
     def isJSON(self, content):
         try:
             json.loads(content)
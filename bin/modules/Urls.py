@@ -15,15 +15,13 @@ This module extract URLs from an item and send them to others modules.
 import os
 import sys
 
-from pyfaup.faup import Faup
-
 sys.path.append(os.environ['AIL_BIN'])
 ##################################
 # Import Project packages
 ##################################
 from modules.abstract_module import AbstractModule
 from lib.ConfigLoader import ConfigLoader
-from lib.objects.Items import Item
+from lib import urls_helper
 
 # # TODO: Faup packages: Add new binding: Check TLD
 
@@ -40,8 +38,6 @@ class Urls(AbstractModule):
 
         config_loader = ConfigLoader()
 
-        self.faup = Faup()
-
         # Protocol file path
         protocolsfile_path = os.path.join(os.environ['AIL_HOME'],
                                           config_loader.get_config_str("Directories", "protocolsfile"))
@@ -69,24 +65,23 @@ class Urls(AbstractModule):
 
         # TODO Handle invalid URL
         l_urls = self.regex_findall(self.url_regex, item.get_id(), item_content)
-        for url in l_urls:
-            self.faup.decode(url)
-            url_decoded = self.faup.get()
-            # decode URL
-            try:
-                url = url_decoded['url'].decode()
-            except AttributeError:
-                url = url_decoded['url']
-
-            print(url, self.obj.get_global_id())
-            self.add_message_to_queue(message=str(url), queue='Url')
-            self.logger.debug(f"url_parsed: {url}")
+        urls = []
+        urls_parsed = set()
+        for url in dict.fromkeys(l_urls):  # dedup, keep order
+            url_decoded = urls_helper.parse_url(url)
+            if url_decoded['url'] not in urls_parsed:
+                urls_parsed.add(url_decoded['url'])
+                urls.append(url_decoded)
+                self.logger.debug(f"url_parsed: {url_decoded['url']}")
+
+        # Send the parsed URLs by batch
+        for message in urls_helper.create_urls_messages(urls):
+            self.add_message_to_queue(message=message, queue='Url')
 
         if len(l_urls) > 0:
-            to_print = f'Urls;{item.get_source()};{item.get_date()};{item.get_basename()};'
+            to_print = f'Urls;{item.get_source()};{item.get_date()};{item.get_basename()};{len(urls)}'
             print(to_print)
 
-
 if __name__ == '__main__':
     module = Urls()
     module.run()
@@ -10,6 +10,7 @@ from abc import ABC, abstractmethod
 import os
 import logging
 import logging.config
+import signal
 import sys
 import time
 import traceback
@@ -19,7 +20,7 @@ sys.path.append(os.environ['AIL_BIN'])
 # Import Project packages
 ##################################
 from lib import ail_logger
-from lib.ail_queues import AILQueue
+from lib.ail_queues import AILQueue, is_hosted_module
 from lib import regex_helper
 from lib.exceptions import ModuleQueueError, TimeoutException
 from lib.objects.ail_objects import get_obj_from_global_id
@@ -107,13 +108,31 @@ class AbstractModule(ABC):
 
         ex: add_message_to_queue(item_id, 'Mail')
         """
+        if not obj:
+            obj = self.obj
         if obj:
             obj_global_id = obj.get_global_id()
-        elif self.obj:
-            obj_global_id = self.obj.get_global_id()
         else:
             obj_global_id = '::'
-        self.queue.send_message(obj_global_id, message, queue)
+        # Fetch the content once for all the prefiltered subscribers
+        content = None
+        if obj and self.queue.has_prefilters(queue) and hasattr(obj, 'get_content'):
+            try:
+                content = obj.get_content()
+            except Exception as e:
+                self.logger.warning(f'{obj_global_id}: Prefilter, failed to get content: {e}')
+            if not isinstance(content, str):
+                content = None
+        self.queue.send_message(obj_global_id, message, queue, content=content)
+
+    def add_messages_to_queue(self, objs_messages, queue=None):
+        """
+        Add a batch of messages to a queue, pipelined. The subscribers prefilters are not applied.
+        :param objs_messages: list of (AILObject, message)
+        :param queue: queue name or module name
+        """
+        messages = [(obj.get_global_id(), message) for obj, message in objs_messages]
+        self.queue.send_messages(messages, queue)
 
     def get_available_queues(self):
         return self.queue.get_out_queues()
@@ -149,47 +168,75 @@ class AbstractModule(ABC):
         return regex_helper.regex_phone_iter(self.r_cache_key, country_code, obj_id, content,
                                              max_time=self.max_execution_time)
 
+    def _sigterm_handler(self, signum, frame):
+        # Children forked by the module (regex timeouts, YARA compilation) inherit the handler: terminate them
+        if os.getpid() != self._sigterm_pid:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+            return None
+        # Graceful stop: finish the current message
+        self.logger.info(f'Module {self.module_name} {self.pid} stopping')
+        self.proceed = False
+
+    def process_message(self):
+        """
+        Get and process one message from the input queue
+
+        :return: True if a message was processed, False if the queue is empty
+        """
+        # Get one message (ex:item id) from the Redis Queue (QueueIn)
+        message = self.get_message()
+
+        if message or self.obj:
+            try:
+                # Module processing with the message from the queue
+                self.compute(message)
+            except Exception as err:
+                if self.debug:
+                    self.queue.error()
+                    raise err
+
+                # LOG ERROR
+                trace = traceback.format_tb(err.__traceback__)
+                trace = ''.join(trace)
+                self.logger.critical(f"Error in module {self.module_name}: {__name__} : {err}")
+                if message:
+                    self.logger.critical(f"Module {self.module_name} input message: {message}")
+                if self.obj:
+                    self.logger.critical(f"{self.module_name} Obj: {self.obj.get_global_id()}")
+                self.logger.critical(trace)
+
+                if isinstance(err, ModuleQueueError):
+                    self.queue.error()
+                    raise err
+            # remove from set_module
+            ## check if item process == completed
+
+            if self.obj:
+                self.queue.end_message(self.obj.get_global_id(), self.sha256_mess)
+                self.obj = None
+                self.sha256_mess = None
+            else:
+                self.queue.ack()
+            return True
+        else:
+            return False
+
     def run(self):
         """
         Run Module endless process
         """
+        if is_hosted_module(self.module_name):
+            self.logger.warning(f'Module {self.module_name} is run by a modules host, exiting')
+            self.queue.stop()
+            return None
+
+        self._sigterm_pid = os.getpid()
+        signal.signal(signal.SIGTERM, self._sigterm_handler)
 
         # Endless loop processing messages from the input queue
         while self.proceed:
-            # Get one message (ex:item id) from the Redis Queue (QueueIn)
-            message = self.get_message()
-
-            if message or self.obj:
-                try:
-                    # Module processing with the message from the queue
-                    self.compute(message)
-                except Exception as err:
-                    if self.debug:
-                        self.queue.error()
-                        raise err
-
-                    # LOG ERROR
-                    trace = traceback.format_tb(err.__traceback__)
-                    trace = ''.join(trace)
-                    self.logger.critical(f"Error in module {self.module_name}: {__name__} : {err}")
-                    if message:
-                        self.logger.critical(f"Module {self.module_name} input message: {message}")
-                    if self.obj:
-                        self.logger.critical(f"{self.module_name} Obj: {self.obj.get_global_id()}")
-                    self.logger.critical(trace)
-
-                    if isinstance(err, ModuleQueueError):
-                        self.queue.error()
-                        raise err
-                # remove from set_module
-                ## check if item process == completed
-
-                if self.obj:
-                    self.queue.end_message(self.obj.get_global_id(), self.sha256_mess)
-                    self.obj = None
-                    self.sha256_mess = None
-
-            else:
+            if not self.process_message():
                 self.computeNone()
                 # Wait before next process
                 self.logger.debug(f"{self.module_name}, waiting for new message, Idling {self.pending_seconds}s")
@@ -198,6 +245,10 @@ class AbstractModule(ABC):
                 except TimeoutException:
                     pass
 
+        # Module stopped
+        if getattr(self, 'queue', None):
+            self.queue.stop()
+
     def _module_name(self):
         """
         Returns the instance class name (ie the Module Name)
@@ -35,6 +35,10 @@ class Tracker_Typo_Squatting(AbstractModule):
 
         self.pending_seconds = 5
 
+        # Build the typo host index of the trackers created before the index
+        if not Tracker.is_typosquatting_host_index_built():
+            Tracker.build_typosquatting_host_index()
+
         # Refresh typo squatting
         self.tracked_typosquattings = Tracker.get_tracked_typosquatting()
         self.last_refresh_typosquatting = time.time()
@@ -57,12 +61,12 @@ class Tracker_Typo_Squatting(AbstractModule):
         obj_type = obj.get_type()
 
         # Object Filter
-        if obj_type not in self.tracked_typosquattings:
+        if not self.tracked_typosquattings.get(obj_type):
             return None
 
-        for typo in self.tracked_typosquattings[obj_type]:
-            if host in typo['domains']:
-                self.new_tracker_found(typo['tracked'], 'typosquatting', obj)
+        for tracked in Tracker.get_typosquatting_tracked_by_host(host):
+            if tracked in self.tracked_typosquattings[obj_type]:
+                self.new_tracker_found(tracked, 'typosquatting', obj)
 
     def new_tracker_found(self, tracked, tracker_type, obj):
         obj_id = obj.get_id()
@@ -14,6 +14,8 @@ import sys
 import time
 import yara
 
+from multiprocessing import Process
+
 sys.path.append(os.environ['AIL_BIN'])
 ##################################
 # Import Project packages
@@ -37,6 +39,8 @@ class Tracker_Yara(AbstractModule):
         # Load Yara rules
         self.rules = Tracker.get_tracked_yara_rules()
         self.last_refresh = time.time()
+        # Background rules compilation
+        self.compiler = None
 
         self.obj = None
 
@@ -46,12 +50,33 @@ class Tracker_Yara(AbstractModule):
 
         self.logger.info(f"Module: {self.module_name} Launched")
 
-    def compute(self, message):
-        # refresh YARA list
+    def refresh_rules(self):
+        """
+        Compile the updated rules in a background process, keep matching with the active rules until it's done
+        """
+        if self.compiler:
+            if self.compiler.is_alive():
+                return None
+            exitcode = self.compiler.exitcode
+            self.compiler = None
+            if exitcode != 0:
+                self.logger.error(f'Yara rules compilation failed, exit code: {exitcode}')
+            else:
+                # swap active rules, loaded from the compiled rules cache
+                self.rules = Tracker.get_tracked_yara_rules()
+                print('Tracked set refreshed')
+
         if self.last_refresh < Tracker.get_tracker_last_updated_by_type('yara'):
-            self.rules = Tracker.get_tracked_yara_rules()
             self.last_refresh = time.time()
-            print('Tracked set refreshed')
+            self.compiler = Process(target=Tracker.compile_tracked_yara_rules)
+            self.compiler.start()
+
+    def computeNone(self):
+        self.refresh_rules()
+
+    def compute(self, message):
+        # refresh YARA list
+        self.refresh_rules()
 
         self.obj = self.get_obj()
         obj_type = self.obj.get_type()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+import asyncio
+import websockets
+
+sys.path.append(os.environ['AIL_BIN'])
+##################################
+# Import Project packages
+##################################
+from core import ail_2_ail
+
+
+def _ail_stream(i):
+    return {'format': 'ail', 'version': 1, 'type': 'item',
+            'meta': {'ail:id': f'tests/sync/{i}.gz', 'compress': 'gzip', 'encoding': 'base64'},
+            'payload': {'raw': 'H4sIAAAAAAAAA0vLz9dLSizSTcvPBwAR8BC5BwAAAA=='}}
+
+
+class TestAIL2AILBatchFraming(unittest.TestCase):
+
+    def test_batch_frame(self):
+        ail_streams = [_ail_stream(i) for i in range(10)]
+        for compression in ['deflate', 'none']:
+            frame = ail_2_ail.create_ail_stream_batch_frame(ail_streams, compression=compression)
+            self.assertEqual(ail_2_ail.unpack_ail_stream_batch_frame(frame), ail_streams)
+        self.assertEqual(ail_2_ail.unpack_ail_stream_batch_frame(ail_2_ail.create_ail_stream_batch_frame([])), [])
+
+    def test_sync_framing_headers(self):
+        self.assertEqual(ail_2_ail.get_sync_framing_from_headers({}), 'json')
+        self.assertEqual(ail_2_ail.get_sync_framing_from_headers({'AIL-Sync-Framing': 'batch'}), 'batch')
+        self.assertEqual(ail_2_ail.get_sync_framing_from_headers({'AIL-Sync-Framing': 'xml'}), 'json')
+
+    def test_loopback_sync(self):
+        """
+        Push batches between two sync endpoints over loopback
+        """
+        nb_objs = 1000
+        batch_size = 50
+        queue = [_ail_stream(i) for i in range(nb_objs)]
+        received = []
+
+        def get_batch():
+            batch = queue[:batch_size]
+            del queue[:batch_size]
+            return batch
+
+        async def receiver(websocket, path=None):
+            try:
+                await ail_2_ail.receive_batch_frames(websocket, received.extend, nb_credits=2)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+        async def sender():
+            async with websockets.serve(receiver, '127.0.0.1', 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                async with websockets.connect(f'ws://127.0.0.1:{port}') as websocket:
+                    await ail_2_ail.send_batch_frames(websocket, get_batch, idle_time=0, max_idle=1)
+                # wait for the last frames
+                for _ in range(100):
+                    if len(received) == nb_objs:
+                        break
+                    await asyncio.sleep(0.01)
+
+        asyncio.run(sender())
+        self.assertEqual(len(received), nb_objs)
+        self.assertEqual(received[0]['meta']['ail:id'], 'tests/sync/0.gz')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+import uuid
+
+sys.path.append(os.environ['AIL_BIN'])
+##################################
+# Import Project packages
+##################################
+from lib import ail_queues
+from lib.ail_queues import r_obj_process, r_queues
+
+MODULE = 'TestQueuesModule'
+MODULE_2 = 'TestQueuesModule2'
+PID = 2 ** 22 + 1
+
+
+class TestProcessedObjs(unittest.TestCase):
+
+    def setUp(self):
+        self.obj_global_id = f'item::tests/ail_queues/{uuid.uuid4()}'
+        self.message = f'{self.obj_global_id};test'
+
+    def tearDown(self):
+        pipe = r_obj_process.pipeline(transaction=False)
+        for module in (MODULE, MODULE_2):
+            pipe.hdel(f'objs:process:queues:{module}', self.obj_global_id)
+            pipe.hdel(f'objs:process:modules:{module}', self.obj_global_id)
+        pipe.hdel('objs:process:refs', self.obj_global_id)
+        pipe.zrem('objs:process:item', self.obj_global_id)
+        pipe.srem('objs:processed', self.obj_global_id)
+        pipe.execute()
+        r_queues.delete(f'queue:{MODULE}:in', f'queue:{MODULE}:processing:{PID}', f'queue:{MODULE}:retries',
+                        f'queue:{MODULE}:dead')
+        r_queues.hdel(f'queue:{MODULE}:processing', PID)
+
+    def _queue(self, module=MODULE):
+        ail_queues.add_processed_objs_queues([(self.obj_global_id, module)])
+        r_queues.rpush(f'queue:{module}:in', self.message)
+
+    def _dequeue(self, module=MODULE):
+        message = r_queues.lmove(f'queue:{module}:in', f'queue:{module}:processing:{PID}', 'LEFT', 'RIGHT')
+        ail_queues.add_processed_obj(self.obj_global_id, module=module)
+        return message
+
+    def _ack(self, module=MODULE):
+        r_queues.lrem(f'queue:{module}:processing:{PID}', 1, self.message)
+        ail_queues.end_processed_obj(self.obj_global_id, module=module)
+
+    def _is_processed(self):
+        return r_obj_process.sismember('objs:processed', self.obj_global_id)
+
+    def test_queue_start_end(self):
+        self._queue(MODULE)
+        ail_queues.add_processed_objs_queues([(self.obj_global_id, MODULE_2)])
+        self.assertEqual(r_obj_process.hget('objs:process:refs', self.obj_global_id), '2')
+        self._dequeue(MODULE)
+        self.assertFalse(r_obj_process.hexists(f'objs:process:queues:{MODULE}', self.obj_global_id))
+        self.assertEqual(r_obj_process.hget(f'objs:process:modules:{MODULE}', self.obj_global_id), '1')
+        self._ack(MODULE)
+        self.assertFalse(self._is_processed())
+        ail_queues.add_processed_obj(self.obj_global_id, module=MODULE_2)
+        ail_queues.end_processed_obj(self.obj_global_id, module=MODULE_2)
+        self.assertTrue(self._is_processed())
+        self.assertFalse(ail_queues.is_obj_in_process(self.obj_global_id))
+        self.assertIsNone(r_obj_process.zscore('objs:process:item', self.obj_global_id))
+
+    def test_requeue(self):
+        self._queue()
+        self._dequeue()
+        ail_queues.requeue_worker_messages(MODULE, PID)
+        self.assertEqual(r_queues.lrange(f'queue:{MODULE}:in', 0, -1), [self.message])
+        self.assertEqual(r_queues.llen(f'queue:{MODULE}:processing:{PID}'), 0)
+        self.assertEqual(r_obj_process.hget(f'objs:process:queues:{MODULE}', self.obj_global_id), '1')
+        self.assertFalse(r_obj_process.hexists(f'objs:process:modules:{MODULE}', self.obj_global_id))
+        self.assertEqual(r_obj_process.hget('objs:process:refs', self.obj_global_id), '1')
+        self._dequeue()
+        self._ack()
+        self.assertTrue(self._is_processed())
+
+    def test_requeue_acknowledged(self):
+        self._queue()
+        self._dequeue()
+        self._ack()
+        # acknowledged before the move: the message is not redelivered, the counts are unchanged
+        self.assertFalse(ail_queues._requeue_worker_message(MODULE, PID, self.message))
+        self.assertEqual(r_queues.llen(f'queue:{MODULE}:in'), 0)
+        self.assertFalse(r_obj_process.hexists(f'objs:process:queues:{MODULE}', self.obj_global_id))
+        self.assertTrue(self._is_processed())
+
+    def test_dead_letter(self):
+        self._queue()
+        self._dequeue()
+        for _ in range(ail_queues.MAX_RETRIES):
+            ail_queues._redeliver_worker_messages(MODULE, PID)
+            self._dequeue()
+        self.assertFalse(self._is_processed())
+        ail_queues._redeliver_worker_messages(MODULE, PID)
+        self.assertEqual(ail_queues.get_nb_dead_letter_messages(MODULE), 1)
+        self.assertEqual(r_queues.llen(f'queue:{MODULE}:processing:{PID}'), 0)
+        self.assertTrue(self._is_processed())
+
+    def test_legacy_message(self):
+        # message queued before the reference counts, not counted when queued
+        r_queues.rpush(f'queue:{MODULE}:in', self.message)
+        self._dequeue()
+        self.assertEqual(r_obj_process.hget('objs:process:refs', self.obj_global_id), '1')
+        self._ack()
+        self.assertTrue(self._is_processed())
+
+    def test_legacy_keys(self):
+        legacy_obj = f'item::tests/ail_queues/{uuid.uuid4()}'
+        version = r_obj_process.get('objs:process:version')
+        r_obj_process.delete('objs:process:version')
+        try:
+            self._queue()
+            r_obj_process.sadd('objs:process', legacy_obj, self.obj_global_id)
+            r_obj_process.zadd(f'obj:queues:{legacy_obj}', {MODULE: 1})
+            ail_queues._clean_legacy_processed_objs()
+            self.assertEqual(r_obj_process.scard('objs:process'), 0)
+            self.assertFalse(r_obj_process.exists(f'obj:queues:{legacy_obj}'))
+            self.assertTrue(r_obj_process.sismember('objs:processed', legacy_obj))
+            # the references of the current format are kept
+            self.assertFalse(self._is_processed())
+            self.assertEqual(r_obj_process.hget('objs:process:refs', self.obj_global_id), '1')
+            self.assertEqual(r_obj_process.get('objs:process:version'), ail_queues.OBJS_PROCESS_VERSION)
+        finally:
+            r_obj_process.srem('objs:processed', legacy_obj)
+            if version:
+                r_obj_process.set('objs:process:version', version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pylacus import PyLacus
+
+sys.path.append(os.environ['AIL_BIN'])
+##################################
+# Import Project packages
+##################################
+from lib import crawlers
+from lib.exceptions import OnionFilteringError
+from lib.objects import DomHashs
+
+
+class FakeLacusHandler(BaseHTTPRequestHandler):
+    # capture uuid: status
+    captures = {'done': 1, 'queued': 0, 'ongoing': 2}
+
+    def do_GET(self):
+        capture_uuid = self.path.rsplit('/', 1)[-1]
+        if self.path.startswith('/capture_status/') and capture_uuid in self.captures:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(self.captures[capture_uuid]).encode())
+        else:
+            self.send_response(500)
+            self.end_headers()
+            self.wfile.write(b'Internal Server Error')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestCrawlerCapturesStatus(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeLacusHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.lacus = PyLacus(f'http://127.0.0.1:{cls.server.server_address[1]}')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_captures_status_sweep(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            statuses = crawlers.get_captures_lacus_status(self.lacus, ['done', 'queued', 'error', 'ongoing'], executor)
+        self.assertEqual(list(statuses), ['done', 'queued', 'error', 'ongoing'])
+        self.assertEqual(statuses['done'], crawlers.CaptureStatus.DONE)
+        self.assertEqual(statuses['queued'], crawlers.CaptureStatus.QUEUED)
+        self.assertEqual(statuses['ongoing'], crawlers.CaptureStatus.ONGOING)
+        # a failed request doesn't stop the sweep
+        self.assertIsInstance(statuses['error'], Exception)
+
+
+class FakeOnionLookupHandler(BaseHTTPRequestHandler):
+    # onion: response
+    onions = {'safe.onion': {'tags': []},
+              'unsafe.onion': {'tags': ['dark-web:topic="pornography-child-exploitation"']},
+              'unknown.onion': [{'error': 'domain not found'}, 404]}
+    nb_requests = {}
+
+    def do_GET(self):
+        onion = self.path.rsplit('/', 1)[-1]
+        self.nb_requests[onion] = self.nb_requests.get(onion, 0) + 1
+        if onion in self.onions:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(self.onions[onion]).encode())
+        else:
+            self.send_response(500)
+            self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestCrawlerOnionLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOnionLookupHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.lookup_url = crawlers.ONION_LOOKUP_URL
+        crawlers.ONION_LOOKUP_URL = f'http://127.0.0.1:{self.server.server_address[1]}/api/lookup/'
+        FakeOnionLookupHandler.nb_requests.clear()
+        for onion in ('safe.onion', 'unsafe.onion', 'unknown.onion', 'error.onion'):
+            crawlers.clear_onion_lookup_cache(onion)
+
+    def tearDown(self):
+        crawlers.ONION_LOOKUP_URL = self.lookup_url
+        for onion in ('safe.onion', 'unsafe.onion', 'unknown.onion', 'error.onion'):
+            crawlers.clear_onion_lookup_cache(onion)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_verdicts_cache(self):
+        for _ in range(2):
+            self.assertTrue(crawlers.check_if_onion_is_safe('safe.onion', unknown=False))
+            self.assertFalse(crawlers.check_if_onion_is_safe('unsafe.onion', unknown=False))
+            self.assertTrue(crawlers.check_if_onion_is_safe('unknown.onion', unknown=False))
+            self.assertFalse(crawlers.check_if_onion_is_safe('unknown.onion', unknown=True))
+        self.assertEqual(FakeOnionLookupHandler.nb_requests, {'safe.onion': 1, 'unsafe.onion': 1, 'unknown.onion': 1})
+        self.assertEqual(crawlers.get_onion_verdict('unsafe.onion'), 'unsafe')
+
+    def test_errors_cache(self):
+        for _ in range(2):
+            with self.assertRaises(OnionFilteringError):
+                crawlers.check_if_onion_is_safe('error.onion', unknown=False)
+        self.assertEqual(FakeOnionLookupHandler.nb_requests, {'error.onion': 1})
+        self.assertIsNone(crawlers.get_onion_verdict('error.onion'))
+        # per onion error, the other onions are still looked up
+        self.assertEqual(crawlers.get_onion_lookup_error('error.onion'), '500')
+        self.assertFalse(crawlers.is_onion_lookup_unreachable())
+
+    def test_prefetch(self):
+        self.assertEqual(crawlers.prefetch_onion_lookup('safe.onion'), 'safe')
+        self.assertIsNone(crawlers.prefetch_onion_lookup('error.onion'))
+        self.assertTrue(crawlers.check_if_onion_is_safe('safe.onion', unknown=True))
+        self.assertEqual(FakeOnionLookupHandler.nb_requests, {'safe.onion': 1, 'error.onion': 1})
+
+
+class TestHarEntries(unittest.TestCase):
+
+    def setUp(self):
+        self.har_dir = os.path.join(crawlers.HAR_DIR, 'tests')
+        os.makedirs(self.har_dir, exist_ok=True)
+        self.entries = [{'request': {'url': f'http://test.onion/{i}', 'cookies': [{'name': f'c{i}'}]},
+                         'response': {'status': 200, 'headers': [{'name': 'ETag', 'value': f'"{i}"'}]}}
+                        for i in range(200)]
+
+    def tearDown(self):
+        shutil.rmtree(self.har_dir, ignore_errors=True)
+
+    def _save_har(self, name, content):
+        with open(os.path.join(self.har_dir, name), 'w') as f:
+            f.write(content)
+        return f'tests/{name}'
+
+    def test_entries_split_across_chunks(self):
+        har_id = self._save_har('entries.har', json.dumps({'log': {'version': '1.2', 'entries': self.entries}}, indent=1))
+        for read_size in [1, 7, 100, 1024 * 1024]:
+            self.assertEqual(list(crawlers.iter_har_entries(har_id, read_size=read_size)), self.entries)
+
+    def test_empty_entries(self):
+        har_id = self._save_har('empty.har', '{"log": {"version": "1.2", "entries": [ ]}}')
+        self.assertEqual(list(crawlers.iter_har_entries(har_id, read_size=5)), [])
+
+    def test_truncated_har(self):
+        content = json.dumps({'log': {'entries': self.entries}})
+        har_id = self._save_har('truncated.har', content[:len(content) // 2])
+        entries = list(crawlers.iter_har_entries(har_id, read_size=64))
+        self.assertTrue(0 < len(entries) < len(self.entries))
+        self.assertEqual(entries, self.entries[:len(entries)])
+
+
+HTML_PAGES = [
+    '<html><head><title>Hello World</title><meta name="description" content="desc"><meta name="keywords" content="a,b">'
+    '<meta name="author" content="me"></head><body><p>x</p></body></html>',
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><title>  </title><link rel="icon" href="/favicon.png">'
+    '<link rel="shortcut icon" href="fav.ico"><link rel="apple-touch-icon" href="https://cdn.example.com/t.png">'
+    '</head><body><div><span>t</span></div></body></html>',
+    '<title>Tom &amp; Jerry</title><div>no html tag</div>',
+    '<html><body><h1>No title</h1><img src="a.png"><br><p>para<p>second</body></html>',
+    '<html><head><title>first</title><title>second</title><meta name="description" content="one">'
+    '<meta name="description" content="two"></head><body><svg><title>svg</title><circle/></svg></body></html>',
+    '<html><head><meta name="Description" content="case"><script>var a = "<title>x</title>";</script></head>'
+    '<body><!-- comment --><ul><li>a<li>b</ul><form><input><select><option>1</select></form></body></html>',
+]
+
+
+class TestHtmlMetadata(unittest.TestCase):
+
+    def test_extract_html_metadata(self):
+        url = 'http://example.onion/dir/page.html'
+        for html in HTML_PAGES:
+            html_meta = crawlers.extract_html_metadata(html, url=url)
+            self.assertEqual(html_meta['title'], crawlers.extract_title_from_html(html))
+            self.assertEqual(html_meta['description'], crawlers.extract_description_from_html(html))
+            self.assertEqual(html_meta['keywords'], crawlers.extract_keywords_from_html(html))
+            self.assertEqual(html_meta['author'], crawlers.extract_author_from_html(html))
+            self.assertEqual((html_meta['favicons_urls'], html_meta['favicons']),
+                             crawlers.extract_favicon_from_html(html, url))
+            self.assertEqual(html_meta['dom_hash'], DomHashs._compute_dom_hash(html))
+            self.assertFalse(html_meta['truncated'])
+
+    def test_budget(self):
+        html = '<html><head><title>title</title></head><body>' + '<p>paragraph</p>' * 10000 + '</body></html>'
+        html_meta = crawlers.extract_html_metadata(html, max_size=1024)
+        self.assertTrue(html_meta['truncated'])
+        self.assertIsNone(html_meta['dom_hash'])
+        self.assertEqual(html_meta['title'], 'title')
+        html_meta = crawlers.extract_html_metadata(html, max_time=0)
+        self.assertTrue(html_meta['truncated'])
+
+
+if __name__ == '__main__':
+    unittest.main()
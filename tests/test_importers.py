@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+import gzip
+import time
+from base64 import b64encode
+
+import zmq
+
+sys.path.append(os.environ['AIL_BIN'])
+##################################
+# Import Project packages
+##################################
+from importer.FeederImporter import api_add_ndjson_feeder_to_queue, get_json_group
+from importer.ZMQImporter import ZMQImporters, is_valid_gzip64
+
+
+class TestFeederImporterBulk(unittest.TestCase):
+
+    def test_ndjson_validation(self):
+        self.assertEqual(api_add_ndjson_feeder_to_queue(b'{"source": "a"}\n{"source": ')[1], 400)
+        self.assertEqual(api_add_ndjson_feeder_to_queue('{"source": "a"}\n[1, 2]')[1], 400)
+        self.assertEqual(api_add_ndjson_feeder_to_queue('\n  \n')[1], 400)
+
+    def test_json_group(self):
+        self.assertEqual(get_json_group({'source': 'telegram', 'meta': {'chat': {'id': 1234}}}), ('telegram', '1234'))
+        self.assertEqual(get_json_group({'source': 'ail_feeder_urlextract', 'meta': {}}), ('ail_feeder_urlextract', 'None'))
+        self.assertEqual(get_json_group({'meta': 'invalid'}), ('None', 'None'))
+
+
+class TestZMQImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.context = zmq.Context()
+        self.publisher = self.context.socket(zmq.PUB)
+        port = self.publisher.bind_to_random_port('tcp://127.0.0.1')
+        self.zmq_importer = ZMQImporters(rcvhwm=100)
+        self.zmq_importer.add(f'tcp://127.0.0.1:{port}', '102')
+        # wait for the subscription
+        time.sleep(0.5)
+
+    def tearDown(self):
+        self.zmq_importer.close()
+        self.publisher.close(linger=0)
+        self.context.term()
+
+    def receive_all(self):
+        messages = []
+        while True:
+            received = self.zmq_importer.importer(timeout=500)
+            if not received:
+                return messages
+            messages.extend(received)
+
+    def test_drain(self):
+        gzip64encoded = b64encode(gzip.compress(b'content')).decode()
+        for i in range(50):
+            self.publisher.send(f'102 feeder>>item_{i} {gzip64encoded}'.encode())
+        self.assertEqual(len(self.receive_all()), 50)
+        self.assertEqual(self.zmq_importer.nb_hwm_reached, 0)
+
+    def test_hwm_reached(self):
+        for i in range(1000):
+            self.publisher.send(f'102 item_{i} content'.encode())
+        time.sleep(0.5)
+        self.receive_all()
+        self.assertGreater(self.zmq_importer.nb_hwm_reached, 0)
+
+    def test_payload_validation(self):
+        self.assertTrue(is_valid_gzip64(b64encode(gzip.compress(b'content')).decode()))
+        self.assertFalse(is_valid_gzip64(b64encode(gzip.compress(b'')).decode()))
+        self.assertFalse(is_valid_gzip64(b64encode(b'content').decode()))
+        self.assertFalse(is_valid_gzip64('invalid base64'))
+
+
+if __name__ == '__main__':
+    unittest.main()
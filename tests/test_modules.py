@@ -6,6 +6,8 @@ import sys
 import unittest
 
 import gzip
+import shutil
+import subprocess
 from base64 import b64encode
 from distutils.dir_util import copy_tree
 
@@ -14,6 +16,10 @@ sys.path.append(os.environ['AIL_BIN'])
 # Import Project packages
 ##################################
 from lib.ConfigLoader import ConfigLoader
+from lib import ail_queues
+from lib import pgp_packets
+from lib.exceptions import ModuleQueueError
+
 # Modules Classes
 from modules.ApiKey import ApiKey
 from modules.Categ import Categ
@@ -184,5 +190,70 @@ class TestModuleTelegram(unittest.TestCase):
         self.module.compute(None)
 
 
+class TestModulesPrefilters(unittest.TestCase):
+
+    def test_prefilters(self):
+        prefilters = {'Keys': ail_queues.parse_prefilter('literal:-----BEGIN,literal:---- BEGIN'),
+                      'Phone': ail_queues.parse_prefilter('run:digits:2'),
+                      'Decoder': ail_queues.parse_prefilter('run:base64:38')}
+        modules = {'Keys', 'Phone', 'Decoder', 'Categ'}
+        content = Items.Item('tests/2021/01/01/keys.gz').get_content()
+        self.assertIn('Keys', ail_queues.filter_modules_by_prefilters(modules, prefilters, content))
+        self.assertEqual(ail_queues.filter_modules_by_prefilters(modules, prefilters, 'no match'), {'Categ'})
+        self.assertEqual(ail_queues.filter_modules_by_prefilters(modules, prefilters, 'call 0612'), {'Categ', 'Phone'})
+        with self.assertRaises(ModuleQueueError):
+            ail_queues.parse_prefilter('run:unknown:2')
+
+
+PGP_PUBLIC_KEY_BLOCK = """-----BEGIN PGP PUBLIC KEY BLOCK-----
+
+mDMEatYZDBYJKwYBBAHaRw8BAQdAFkNP82Vlkg3AShr8pJetIQEJgC9UNqTezWZz
+BHXL54S0FUJvYiA8Ym9iQGV4YW1wbGUub3JnPoiQBBMWCAA4FiEEm+HoK7jOlmXn
+I1S/MjpjjvMy4G8FAmrWGQwCGwMFCwkIBwIGFQoJCAsCBBYCAwECHgECF4AACgkQ
+MjpjjvMy4G9wGQEAyfuMagV/im7jepJQYfSRU7wnVrrYXE9u9ShUWd+pp9UBAMQc
+nGPLZ+iLJVC88hSPfQCpT6j3H6gx+mqnsBqZIH0GuDgEatYZExIKKwYBBAGXVQEF
+AQEHQN4l87XGmalgQLwfS1+Xk8wRFzCEXKGuAD5ZDRJvmVwpAwEIB4h4BBgWCAAg
+FiEEm+HoK7jOlmXnI1S/MjpjjvMy4G8FAmrWGRMCGwwACgkQMjpjjvMy4G/guQD8
+CvNMRXGtxEJutZ6pa50TodJYV9LvHnWM38Esq8NvXO4A/2KZ62YXmqt9VoO5AAEj
+kEHT462tNFrR197ExAoJZBEJ
+=Wlw9
+-----END PGP PUBLIC KEY BLOCK-----"""
+
+PGP_MESSAGE = """-----BEGIN PGP MESSAGE-----
+
+hF4DrZllPRruhL4SAQdAWiXJGRhpauUBX/tRE15JOUiRKtdIk0V2RbB6Jwl0+Esw
+GraBm8O297ynzw/MsNzbPgQhTQQpgtlgOyRb0jjngyBX55jS/csaC1MABSyWTABy
+0kYBCUU+PiKGfenfsJ0ZOrrZCLFlVYxWQjruqoBrWe+E59Li+b+Kv8sudL/kTRfx
+/qnEWAIyxmtfEacTcctU5Vl4P0nU5eLp
+=4k8U
+-----END PGP MESSAGE-----"""
+
+
+class TestPgpPackets(unittest.TestCase):
+
+    def test_public_key_block(self):
+        pgp_ids = pgp_packets.extract_pgp_ids(PGP_PUBLIC_KEY_BLOCK)
+        self.assertEqual(set(pgp_ids['keys']), {'0x323A638EF332E06F'})
+        self.assertEqual(pgp_ids['users'], ['Bob <bob@example.org>'])
+        self.assertFalse(pgp_ids['private'])
+
+    def test_message(self):
+        pgp_ids = pgp_packets.extract_pgp_ids(PGP_MESSAGE)
+        self.assertEqual(pgp_ids['keys'], ['0xAD99653D1AEE84BE'])
+        # invalid block
+        self.assertEqual(pgp_packets.extract_pgp_ids('-----BEGIN PGP MESSAGE-----\naaaa\n-----END PGP MESSAGE-----'),
+                         {'keys': [], 'users': [], 'private': False})
+
+    @unittest.skipUnless(shutil.which('pgpdump'), 'pgpdump not installed')
+    def test_pgpdump(self):
+        for pgp_block in (PGP_PUBLIC_KEY_BLOCK, PGP_MESSAGE):
+            output = subprocess.run(['pgpdump'], input=pgp_block.encode(), stdout=subprocess.PIPE).stdout.decode()
+            keys = {line.split('Key ID - ', 1)[1] for line in output.splitlines() if 'Key ID - ' in line}
+            users = {line.split('User ID - ', 1)[1] for line in output.splitlines() if 'User ID - ' in line}
+            pgp_ids = pgp_packets.extract_pgp_ids(pgp_block)
+            self.assertEqual(set(pgp_ids['keys']), keys)
+            self.assertEqual(set(pgp_ids['users']), users)
+
+
 if __name__ == '__main__':
     unittest.main()
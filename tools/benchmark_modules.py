@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AIL Modules Benchmark
+================
+
+Generate a synthetic items corpus and run it through the AIL modules.
+Report, per module: throughput, p50/p99 latency, Redis round trips and peak RSS.
+
+The benchmark never runs against the instance DBs: the modules create objects, tags and correlations.
+Throwaway Redis and Kvrocks servers are launched on free ports, with a temporary config and data directories,
+and deleted at the end of the benchmark.
+
+"""
+
+import argparse
+import base64
+import configparser
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+import redis
+
+sys.path.append(os.environ['AIL_BIN'])
+##################################
+# Import Project packages
+##################################
+from lib import ConfigLoader
+from lib import ail_queues
+from lib.objects.Items import Item, ITEMS_FOLDER
+
+DEFAULT_MODULES = ['Categ', 'ApiKey', 'Credential', 'CreditCards', 'Cryptocurrencies', 'Decoder', 'Hosts', 'Iban',
+                   'IPAddress', 'Keys', 'Mail', 'Onion', 'Phone', 'Tools', 'Urls']
+
+BENCHMARK_SOURCE = 'benchmark'
+
+# Set to the temporary configs directory in the benchmark process
+BENCHMARK_INSTANCE_ENV = 'AIL_BENCHMARK_INSTANCE'
+
+# Directories written by the modules, moved to the temporary directory
+BENCHMARK_DATA_DIRS = ['bloomfilters', 'dicofilters', 'pastes', 'hash', 'crawled', 'har', 'screenshot', 'images',
+                       'favicons', 'yara_compiled']
+
+# # # # # # # # # # # #
+#                     #
+#   SYNTHETIC CORPUS  #
+#                     #
+# # # # # # # # # # # #
+
+def _random_word(rand, min_size=3, max_size=10):
+    return ''.join(rand.choices(string.ascii_lowercase, k=rand.randint(min_size, max_size)))
+
+def _random_text(rand, nb_words):
+    return ' '.join(_random_word(rand) for _ in range(nb_words))
+
+def _random_bytes(rand, size):
+    return rand.getrandbits(size * 8).to_bytes(size, 'little')
+
+def gen_credentials(rand):
+    lines = []
+    for _ in range(rand.randint(10, 500)):
+        lines.append(f'{_random_word(rand)}.{_random_word(rand)}@{_random_word(rand)}.com:{_random_word(rand, 6, 16)}')
+    return '\n'.join(lines)
+
+def gen_base64(rand):
+    blobs = []
+    for _ in range(rand.randint(1, 5)):
+        blobs.append(base64.b64encode(_random_bytes(rand, rand.randint(100, 20000))).decode())
+    return f'{_random_text(rand, 50)}\n' + '\n'.join(blobs)
+
+def gen_onions(rand):
+    lines = []
+    for _ in range(rand.randint(1, 50)):
+        onion = ''.join(rand.choices('abcdefghijklmnopqrstuvwxyz234567', k=56))
+        lines.append(f'{_random_text(rand, 10)} http://{onion}.onion/{_random_word(rand)}')
+    return '\n'.join(lines)
+
+def gen_crypto_addresses(rand):
+    lines = []
+    base58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+    for _ in range(rand.randint(1, 50)):
+        lines.append(f'{_random_text(rand, 8)} 1{"".join(rand.choices(base58, k=33))}')
+        lines.append(f'{_random_text(rand, 8)} 0x{"".join(rand.choices("0123456789abcdef", k=40))}')
+    return '\n'.join(lines)
+
+def gen_html(rand):
+    body = []
+    for _ in range(rand.randint(500, 5000)):
+        body.append(f'<div class="{_random_word(rand)}"><a href="https://{_random_word(rand)}.com/{_random_word(rand)}">'
+                    f'{_random_text(rand, 8)}</a><p>{_random_text(rand, 30)}</p></div>')
+    return f'<html><head><title>{_random_text(rand, 5)}</title></head><body>{"".join(body)}</body></html>'
+
+def gen_binary(rand):
+    return _random_bytes(rand, rand.randint(1000, 200000))
+
+def gen_text(rand):
+    return _random_text(rand, rand.randint(50, 5000))
+
+CORPUS_GENERATORS = {
+    'credentials': gen_credentials,
+    'base64': gen_base64,
+    'onions': gen_onions,
+    'crypto': gen_crypto_addresses,
+    'html': gen_html,
+    'binary': gen_binary,
+    'text': gen_text,
+}
+
+def generate_corpus(nb_items, seed=0, kinds=None):
+    """
+    Generate a synthetic corpus and save it as AIL items
+
+    :return: list of items ids
+    """
+    if not kinds:
+        kinds = list(CORPUS_GENERATORS)
+    rand = random.Random(seed)
+    date = datetime.date.today().strftime('%Y/%m/%d')
+    items_ids = []
+    for i in range(nb_items):
+        kind = kinds[i % len(kinds)]
+        content = CORPUS_GENERATORS[kind](rand)
+        item_id = f'{BENCHMARK_SOURCE}/{date}/{kind}_{seed}_{i}.gz'
+        filename = os.path.join(ITEMS_FOLDER, item_id)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        if isinstance(content, str):
+            content = content.encode()
+        with gzip.open(filename, 'wb') as f:
+            f.write(content)
+        items_ids.append(item_id)
+    return items_ids
+
+# # # # # # # # # # # #
+#                     #
+#   INSTRUMENTATION   #
+#                     #
+# # # # # # # # # # # #
+
+ROUND_TRIPS = {'nb': 0}
+
+def _count_round_trips():
+    execute_command = redis.Redis.execute_command
+    pipeline_execute = redis.client.Pipeline.execute
+
+    def _execute_command(self, *args, **kwargs):
+        ROUND_TRIPS['nb'] += 1
+        return execute_command(self, *args, **kwargs)
+
+    def _pipeline_execute(self, *args, **kwargs):
+        ROUND_TRIPS['nb'] += 1
+        return pipeline_execute(self, *args, **kwargs)
+
+    redis.Redis.execute_command = _execute_command
+    redis.client.Pipeline.execute = _pipeline_execute
+
+def _percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(int(round(percent / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+def _get_module_message(module_name):
+    # Item subscribers don't use the message, categories subscribers receive the number of matches
+    module_config_loader = ConfigLoader.ConfigLoader(config_file=ail_queues.MODULES_FILE)
+    if module_config_loader.has_option(module_name, 'subscribe'):
+        if module_config_loader.get_config_str(module_name, 'subscribe') != 'Item':
+            return '1'
+    return None
+
+def _benchmark_module(module_name, items_ids, send_messages, results):
+    from core.Modules_Host import get_module_class
+
+    ConfigLoader.reset_connection_pools()
+    _count_round_trips()
+    module = get_module_class(module_name)()
+    nb_messages = {'nb': 0}
+    if not send_messages:
+        def _add_message_to_queue(obj=None, message='', queue=None):
+            nb_messages['nb'] += 1
+        module.add_message_to_queue = _add_message_to_queue
+    message = _get_module_message(module_name)
+
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ROUND_TRIPS['nb'] = 0
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for item_id in items_ids:
+        t = time.perf_counter()
+        try:
+            module.compute_manual(Item(item_id), message=message)
+        except Exception as e:
+            errors += 1
+            print(f'{module_name}: {item_id}: {e}', file=sys.stderr)
+        latencies.append(time.perf_counter() - t)
+    duration = time.perf_counter() - start
+    module.queue.stop()
+
+    results[module_name] = {'items': len(items_ids),
+                            'duration': duration,
+                            'items/s': len(items_ids) / duration if duration else 0,
+                            'p50': _percentile(latencies, 50),
+                            'p99': _percentile(latencies, 99),
+                            'max': max(latencies, default=0),
+                            'redis_round_trips': ROUND_TRIPS['nb'],
+                            'messages': nb_messages['nb'],
+                            'errors': errors,
+                            'rss_start_kb': rss_start,
+                            'rss_peak_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def benchmark_modules(modules_names, items_ids, send_messages=False):
+    """
+    Run each module in its own process, to measure its own peak RSS
+    """
+    manager = multiprocessing.Manager()
+    results = manager.dict()
+    for module_name in modules_names:
+        proc = multiprocessing.Process(target=_benchmark_module, args=(module_name, items_ids, send_messages, results))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            print(f'ERROR: {module_name} benchmark failed', file=sys.stderr)
+    return dict(results)
+
+def print_results(results):
+    print(f'{"Module":<20} {"items/s":>10} {"p50 ms":>10} {"p99 ms":>10} {"max ms":>10} {"RTT/item":>10} {"RSS MB":>8} {"errors":>7}')
+    for module_name, res in results.items():
+        rtt = res['redis_round_trips'] / res['items'] if res['items'] else 0
+        print(f'{module_name:<20} {res["items/s"]:>10.1f} {res["p50"] * 1000:>10.2f} {res["p99"] * 1000:>10.2f} '
+              f'{res["max"] * 1000:>10.2f} {rtt:>10.1f} {res["rss_peak_kb"] / 1024:>8.1f} {res["errors"]:>7}')
+
+def check_regressions(results, baseline, max_regression):
+    regressions = []
+    for module_name, res in results.items():
+        if module_name in baseline:
+            base = baseline[module_name]
+            if base['items/s'] and res['items/s'] < base['items/s'] * (1 - max_regression):
+                regressions.append(f'{module_name}: throughput {base["items/s"]:.1f} -> {res["items/s"]:.1f} items/s')
+            if base['p99'] and res['p99'] > base['p99'] * (1 + max_regression):
+                regressions.append(f'{module_name}: p99 {base["p99"] * 1000:.2f} -> {res["p99"] * 1000:.2f} ms')
+    return regressions
+
+# # # # # # # # # # # #
+#                     #
+#  THROWAWAY INSTANCE #
+#                     #
+# # # # # # # # # # # #
+
+def _get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _wait_db(port, password=None, timeout=30):
+    r = redis.Redis(host='127.0.0.1', port=port, password=password)
+    end = time.time() + timeout
+    while True:
+        try:
+            return r.ping()
+        except redis.exceptions.ConnectionError:
+            if time.time() > end:
+                raise
+            time.sleep(0.2)
+
+class BenchmarkInstance:
+    """
+    Throwaway Redis and Kvrocks servers with a temporary AIL config
+    """
+
+    def __init__(self, redis_server='redis-server', kvrocks_server=None):
+        self.redis_server = redis_server
+        if not kvrocks_server:
+            kvrocks_server = os.path.join(os.environ['AIL_HOME'], 'kvrocks', 'build', 'kvrocks')
+        self.kvrocks_server = kvrocks_server
+        self.dir = None
+        self.config_dir = None
+        self.processes = []
+
+    def _launch_redis(self, port):
+        data_dir = os.path.join(self.dir, f'redis_{port}')
+        os.makedirs(data_dir)
+        self.processes.append(subprocess.Popen([self.redis_server, '--port', str(port), '--bind', '127.0.0.1',
+                                                '--dir', data_dir, '--save', '', '--appendonly', 'no'],
+                                               stdout=subprocess.DEVNULL))
+        _wait_db(port)
+
+    def _launch_kvrocks(self, port, password):
+        data_dir = os.path.join(self.dir, f'kvrocks_{port}')
+        os.makedirs(data_dir)
+        with open(os.path.join(os.environ['AIL_HOME'], 'configs', '6383.conf'), 'r') as f:
+            conf = f.read()
+        conf = re.sub(r'^port .*$', f'port {port}', conf, flags=re.MULTILINE)
+        conf = re.sub(r'^(dir|log-dir) .*$', rf'\1 {data_dir}', conf, flags=re.MULTILINE)
+        conf = re.sub(r'^pidfile .*$', f'pidfile {data_dir}/kvrocks.pid', conf, flags=re.MULTILINE)
+        conf = re.sub(r'^backup-dir .*$', f'backup-dir {data_dir}/backup', conf, flags=re.MULTILINE)
+        conf_file = os.path.join(data_dir, 'kvrocks.conf')
+        with open(conf_file, 'w') as f:
+            f.write(conf)
+        self.processes.append(subprocess.Popen([self.kvrocks_server, '-c', conf_file], stdout=subprocess.DEVNULL))
+        _wait_db(port, password=password)
+
+    def start(self):
+        self.dir = tempfile.mkdtemp(prefix='ail_benchmark_')
+        self.config_dir = os.path.join(self.dir, 'configs')
+        shutil.copytree(os.path.join(os.environ['AIL_HOME'], 'configs'), self.config_dir)
+        cfg = configparser.ConfigParser()
+        cfg.read(os.path.join(self.config_dir, 'core.cfg'))
+
+        # one throwaway server by instance server
+        ports = {}
+        for section in cfg.sections():
+            if section.startswith('Redis_') or section.startswith('Kvrocks_'):
+                port = cfg.get(section, 'port')
+                if port not in ports:
+                    ports[port] = _get_free_port()
+                    if section.startswith('Redis_'):
+                        self._launch_redis(ports[port])
+                    else:
+                        self._launch_kvrocks(ports[port], cfg.get(section, 'password'))
+                cfg.set(section, 'host', '127.0.0.1')
+                cfg.set(section, 'port', str(ports[port]))
+        for directory in BENCHMARK_DATA_DIRS:
+            if cfg.has_option('Directories', directory):
+                cfg.set('Directories', directory, os.path.join(self.dir, 'data', cfg.get('Directories', directory)))
+        with open(os.path.join(self.config_dir, 'core.cfg'), 'w') as f:
+            cfg.write(f)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        self.processes = []
+        if self.dir:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+
+    def run(self, args):
+        """
+        Run a command using the throwaway instance
+
+        :return: exit code
+        """
+        env = dict(os.environ)
+        env['AIL_CONFIG_DIR'] = self.config_dir
+        env[BENCHMARK_INSTANCE_ENV] = self.config_dir
+        return subprocess.run(args, env=env).returncode
+
+    def __enter__(self):
+        try:
+            self.start()
+        except Exception:
+            self.stop()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+def is_benchmark_instance():
+    config_dir = os.environ.get(BENCHMARK_INSTANCE_ENV)
+    return bool(config_dir) and config_dir == ConfigLoader.config_dir
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark AIL Modules on a synthetic corpus')
+    parser.add_argument('-m', '--modules', type=str, nargs='+', help='Modules to benchmark', default=DEFAULT_MODULES)
+    parser.add_argument('-n', '--nb_items', type=int, help='Number of items in the corpus', default=200)
+    parser.add_argument('-s', '--seed', type=int, help='Corpus random seed', default=0)
+    parser.add_argument('-k', '--kinds', type=str, nargs='+', help=f'Corpus items kinds: {", ".join(CORPUS_GENERATORS)}')
+    parser.add_argument('-o', '--output', type=str, help='Save results in a JSON file')
+    parser.add_argument('-b', '--baseline', type=str, help='Compare with a previous JSON results file')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed regression ratio, default 0.2')
+    parser.add_argument('--send-messages', action='store_true', help='Push the modules output messages in the queues')
+    parser.add_argument('--redis-server', type=str, help='redis-server binary', default='redis-server')
+    parser.add_argument('--kvrocks-server', type=str, help='kvrocks binary, default: $AIL_HOME/kvrocks/build/kvrocks')
+    args = parser.parse_args()
+
+    if args.kinds:
+        for kind in args.kinds:
+            if kind not in CORPUS_GENERATORS:
+                parser.print_help()
+                sys.exit(1)
+
+    # Run the benchmark in a new process using the throwaway instance, never against the instance DBs
+    if not is_benchmark_instance():
+        print('Launching the throwaway Redis and Kvrocks servers ...')
+        with BenchmarkInstance(redis_server=args.redis_server, kvrocks_server=args.kvrocks_server) as instance:
+            exit_code = instance.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:])
+        sys.exit(exit_code)
+
+    print(f'Generating {args.nb_items} items ...')
+    items = generate_corpus(args.nb_items, seed=args.seed, kinds=args.kinds)
+    benchmark_results = benchmark_modules(args.modules, items, send_messages=args.send_messages)
+
+    print_results(benchmark_results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(benchmark_results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline_results = json.load(f)
+        all_regressions = check_regressions(benchmark_results, baseline_results, args.max_regression)
+        if all_regressions:
+            print('\nREGRESSIONS:')
+            for regression in all_regressions:
+                print(f'    {regression}')
+            sys.exit(1)
@@ -6,6 +6,9 @@ DIR/File Importer Helper
 
 Import Content
 
+A directory is imported by a pool of processes. The processed files are saved in a checkpoint file:
+an interrupted import restarts where it stopped. The files already imported (same content hash) are skipped.
+
 """
 
 import argparse
@@ -23,6 +26,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Directory or file importer')
     parser.add_argument('-d', '--directory', type=str, help='Root directory to import')
     parser.add_argument('-f', '--file', type=str, help='File to import')
+    parser.add_argument('-p', '--processes', type=int, help='Number of processes, default: number of CPUs')
+    parser.add_argument('-c', '--checkpoint', type=str, help='Resume checkpoint file, default: ./dir_import_<hash>.checkpoint')
+    parser.add_argument('--import-duplicates', action='store_true',
+                        help="Don't skip the files already imported (same content hash)")
     args = parser.parse_args()
 
     if not args.directory and not args.file:
@@ -31,8 +38,10 @@ if __name__ == "__main__":
 
     if args.directory:
         dir_path = args.directory
-        dir_importer = FileImporter.DirImporter()
-        dir_importer.importer(dir_path)
+        dir_importer = FileImporter.DirImporter(nb_processes=args.processes, checkpoint=args.checkpoint,
+                                                skip_imported=not args.import_duplicates)
+        nb_imported, nb_errors = dir_importer.importer(dir_path)
+        print(f'{nb_imported} files imported, {nb_errors} errors')
 
     if args.file:
         file_path = args.file
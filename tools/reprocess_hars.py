@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reprocess the crawled HARs
+================
+
+Extract the cookies names, etags and HHHashs of all the saved HARs.
+The HARs are processed in parallel by a pool of processes, each HAR is streamed entry by entry.
+
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.append(os.environ['AIL_BIN'])
+##################################
+# Import Project packages
+##################################
+from lib import ConfigLoader
+from lib import crawlers
+
+
+def _init_worker():
+    ConfigLoader.reset_connection_pools()
+
+def _reprocess_har(har_id):
+    try:
+        extractor = crawlers.extract_har_objects(har_id)
+    except Exception as e:
+        return har_id, str(e)
+    return har_id, (len(extractor.cookies_names), len(extractor.etags), len(extractor.hhhashs))
+
+def reprocess_hars(har_ids, nb_processes=None, chunksize=16):
+    """
+    :return: number of HARs processed, number of errors
+    """
+    nb_hars = 0
+    errors = 0
+    start = time.time()
+    with multiprocessing.Pool(processes=nb_processes, initializer=_init_worker) as pool:
+        for har_id, res in pool.imap_unordered(_reprocess_har, har_ids, chunksize=chunksize):
+            nb_hars += 1
+            if isinstance(res, str):
+                errors += 1
+                print(f'ERROR: {har_id}: {res}', file=sys.stderr)
+            if nb_hars % 1000 == 0:
+                print(f'{nb_hars}/{len(har_ids)} HARs processed, {nb_hars / (time.time() - start):.1f} HARs/s')
+    return nb_hars, errors
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Extract the cookies names, etags and HHHashs of the crawled HARs')
+    parser.add_argument('-p', '--processes', type=int, help='Number of processes, default: number of CPUs')
+    parser.add_argument('-m', '--month', type=str, help='Only reprocess a month: YYYY/MM')
+    args = parser.parse_args()
+
+    if args.month:
+        try:
+            year, month = args.month.split('/')
+        except ValueError:
+            parser.print_help()
+            sys.exit(1)
+        all_har_ids = crawlers.get_month_har_ids(year, month)
+    else:
+        all_har_ids = crawlers.get_all_har_ids()
+
+    print(f'{len(all_har_ids)} HARs to reprocess')
+    nb_processed, nb_errors = reprocess_hars(all_har_ids, nb_processes=args.processes)
+    print(f'{nb_processed} HARs processed, {nb_errors} errors')
@@ -4,13 +4,28 @@
 Reprocess AIL Objects by Object Type
 ================
 
-Send ALL objects by type in queues
+Send ALL objects by type in queues, or process them with a module.
+
+The objects are split in shards processed by a pool of processes:
+    - items: one shard by day of the date range, iterated by the workers
+    - other objects: iterated once, batches of objects IDs are sent to the workers
+The completed shards are saved in a checkpoint file, a restarted reprocessing skips them.
+
+Queues: the messages are pushed in pipelined batches, the workers pause while the target queue is saturated.
+Module: the module compute_manual is run in the workers, the queues are bypassed.
 
 """
 
 import argparse
+import collections
+import datetime
+import json
+import multiprocessing
 import os
 import sys
+import time
+
+import xxhash
 
 sys.path.append(os.environ['AIL_BIN'])
 ##################################
@@ -18,7 +33,10 @@ sys.path.append(os.environ['AIL_BIN'])
 ##################################
 from lib.ail_core import is_object_type
 from lib import ail_queues
+from lib import ConfigLoader
+from lib.data_retention_engine import get_obj_date_first
 from lib.objects import ail_objects
+from packages import Date
 
 # from modules.ApiKey import ApiKey
 # from modules.Categ import Categ
@@ -41,27 +59,246 @@ MODULES = {
     'OcrExtractor': OcrExtractor
 }
 
-def reprocess_message_objects(object_type, module_name=None):
+OBJECTS_TYPES = ['image', 'item', 'message', 'screenshot', 'title']
+
+BATCH_SIZE = 500
+# Seconds between two progress reports
+REPORT_INTERVAL = 10
+
+# # # # # # # # # # # #
+#                     #
+#       SHARDS        #
+#                     #
+# # # # # # # # # # # #
+
+def get_shards(obj_type, date_from=None, date_to=None):
+    """
+    :return: generator of shards: ('date', date) or ('batch', list of objects global IDs)
+    """
+    if obj_type == 'item':
+        if not date_from:
+            date_from = get_obj_date_first('item')
+            if not date_from:
+                return None
+        if not date_to:
+            date_to = Date.get_today_date_str()
+        for date in Date.get_daterange(date_from, date_to):
+            yield 'date', date
+    else:
+        batch = []
+        for obj in ail_objects.obj_iterator(obj_type, filters={}):
+            batch.append(obj.get_global_id())
+            if len(batch) >= BATCH_SIZE:
+                yield 'batch', batch
+                batch = []
+        if batch:
+            yield 'batch', batch
+
+def get_shard_key(shard):
+    shard_type, value = shard
+    if shard_type == 'date':
+        return json.dumps(value)
+    # a restarted reprocessing iterates the objects in the same order, the unchanged batches are skipped
+    batch_hash = xxhash.xxh3_64_hexdigest('\n'.join(value).encode())
+    return f'batch:{batch_hash}'
+
+def shard_iterator(obj_type, shard):
+    shard_type, value = shard
+    if shard_type == 'date':
+        yield from ail_objects.obj_iterator(obj_type, filters={'date_from': value, 'date_to': value})
+    else:
+        for global_id in value:
+            yield ail_objects.get_obj_from_global_id(global_id)
+
+def get_nb_shards(obj_type, date_from=None, date_to=None):
+    """
+    :return: estimated number of shards, None if unknown
+    """
+    if obj_type == 'item':
+        return None
+    nb_objs = ail_objects.card_obj_iterator(obj_type, {})
+    if nb_objs is None:
+        return None
+    return -(-int(nb_objs) // BATCH_SIZE)
+
+def get_checkpoint_shards(checkpoint):
+    shards = set()
+    if os.path.isfile(checkpoint):
+        with open(checkpoint, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    shards.add(line)
+    return shards
+
+def get_default_checkpoint(obj_type, target, date_from, date_to):
+    name = '_'.join(str(v) for v in (obj_type, target, date_from, date_to) if v)
+    return os.path.join(os.getcwd(), f'reprocess_{name}.checkpoint')
+
+# # # # # # # # # # # #
+#                     #
+#       WORKERS       #
+#                     #
+# # # # # # # # # # # #
+
+_worker = {}
+
+def _init_worker(obj_type, module_name, queue_name, watermarks):
+    ConfigLoader.reset_connection_pools()
+    _worker['obj_type'] = obj_type
+    _worker['queue_name'] = queue_name
+    _worker['watermarks'] = watermarks
+    if module_name:
+        _worker['module'] = MODULES[module_name]()
+    elif not queue_name:
+        _worker['queue'] = ail_queues.AILQueue('FeederModuleImporter', -1)
+
+def _send_batch(messages):
+    queue_name = _worker['queue_name']
+    if queue_name:
+        high, low = _worker['watermarks']
+        if high:
+            ail_queues.wait_module_queue(queue_name, high, low)
+        ail_queues.send_module_messages(queue_name, messages)
+    else:
+        # global watermarks of the Importers queue subscribers
+        ail_queues.wait_backpressure('reprocess')
+        _worker['queue'].send_messages(messages)
+
+def _reprocess_shard(shard):
+    """
+    :return: shard, number of objects, number of errors
+    """
+    nb_objs = 0
+    nb_errors = 0
+    module = _worker.get('module')
+    messages = []
+    try:
+        if shard[0] == 'batch' and not module:
+            # the objects IDs are sent as is
+            messages = [(global_id, 'reprocess') for global_id in shard[1]]
+            nb_objs = len(messages)
+        else:
+            for obj in shard_iterator(_worker['obj_type'], shard):
+                nb_objs += 1
+                if module:
+                    if not obj.exists():
+                        print(f'ERROR: object does not exist, {obj.id}')
+                        nb_errors += 1
+                        continue
+                    try:
+                        module.compute_manual(obj)
+                    except Exception as e:
+                        print(f'ERROR: {obj.get_global_id()}: {e}', file=sys.stderr)
+                        nb_errors += 1
+                else:
+                    messages.append((obj.get_global_id(), 'reprocess'))
+                    if len(messages) >= BATCH_SIZE:
+                        _send_batch(messages)
+                        messages = []
+        if messages:
+            _send_batch(messages)
+    except Exception as e:
+        # the shard is not checkpointed, retried at the next run
+        print(f'ERROR: shard {get_shard_key(shard)}: {e}', file=sys.stderr)
+        return shard, nb_objs, None
+    return shard, nb_objs, nb_errors
+
+def _clear_workers(module_name, queue_name):
+    """
+    Remove the queue workers registered by the pool processes, once the pool is terminated
+    """
     if module_name:
-        module = MODULES[module_name]()
-        for obj in ail_objects.obj_iterator(object_type, filters={}):
-            if not obj.exists():
-                print(f'ERROR: object does not exist, {obj.id}')
-                continue
-            module.obj = obj
-            module.compute(None)
+        ail_queues.clear_module_dead_workers(module_name)
+    elif not queue_name:
+        ail_queues.clear_module_worker('FeederModuleImporter', -1)
+
+def reprocess_objects(obj_type, module_name=None, queue_name=None, date_from=None, date_to=None,
+                      nb_processes=None, checkpoint=None, max_queue=None):
+    """
+    :param module_name: run this module compute_manual on the objects
+    :param queue_name: push the objects in this module queue, default: Importers queue
+    :param max_queue: high watermark of the target queue, default: Modules_Backpressure config
+    :return: number of objects, number of errors
+    """
+    if not nb_processes:
+        nb_processes = os.cpu_count()
+    if not checkpoint:
+        checkpoint = get_default_checkpoint(obj_type, module_name or queue_name, date_from, date_to)
+    watermarks = ail_queues.get_queue_watermarks(queue_name, high=max_queue) if queue_name else (None, None)
+
+    done = get_checkpoint_shards(checkpoint)
+    if done:
+        print(f'Resuming: {len(done)} shards already processed, checkpoint: {checkpoint}')
     else:
-        queue = ail_queues.AILQueue('FeederModuleImporter', -1)
-        for obj in ail_objects.obj_iterator(object_type, filters={}):
-            queue.send_message(obj.get_global_id(), message='reprocess')
-        queue.end()
+        print(f'Checkpoint: {checkpoint}')
+    if obj_type == 'item':
+        shards = [shard for shard in get_shards(obj_type, date_from=date_from, date_to=date_to)
+                  if get_shard_key(shard) not in done]
+        nb_shards = len(shards)
+    else:
+        shards = get_shards(obj_type)
+        nb_shards = get_nb_shards(obj_type)
+
+    stats = {'done': 0, 'objs': 0, 'errors': 0}
+    start = time.time()
+    next_report = start + REPORT_INTERVAL
 
+    def _add_result(result):
+        nonlocal next_report
+        shard, nb_shard_objs, nb_shard_errors = result
+        stats['done'] += 1
+        stats['objs'] += nb_shard_objs
+        if nb_shard_errors is None:
+            stats['errors'] += 1
+        else:
+            stats['errors'] += nb_shard_errors
+            f_checkpoint.write(f'{get_shard_key(shard)}\n')
+            f_checkpoint.flush()
+        if time.time() > next_report:
+            _report_progress(stats, nb_shards, start)
+            next_report = time.time() + REPORT_INTERVAL
+
+    try:
+        with open(checkpoint, 'a') as f_checkpoint:
+            with multiprocessing.Pool(processes=nb_processes, initializer=_init_worker,
+                                      initargs=(obj_type, module_name, queue_name, watermarks)) as pool:
+                # bounded number of pending shards, the objects IDs batches are not all kept in memory
+                pending = collections.deque()
+                for shard in shards:
+                    if get_shard_key(shard) in done:
+                        stats['done'] += 1
+                        continue
+                    pending.append(pool.apply_async(_reprocess_shard, (shard,)))
+                    if len(pending) >= nb_processes * 2:
+                        _add_result(pending.popleft().get())
+                while pending:
+                    _add_result(pending.popleft().get())
+    finally:
+        _clear_workers(module_name, queue_name)
+    _report_progress(stats, nb_shards, start)
+    return stats['objs'], stats['errors']
+
+def _report_progress(stats, nb_shards, start):
+    duration = max(time.time() - start, 0.001)
+    progress = f'{stats["done"]}/{nb_shards}' if nb_shards else f'{stats["done"]}'
+    eta = ''
+    if nb_shards and stats['done']:
+        eta = f', ETA {datetime.timedelta(seconds=int(max(nb_shards - stats["done"], 0) * duration / stats["done"]))}'
+    print(f'{progress} shards, {stats["objs"]} objects, {stats["objs"] / duration:.1f} objects/s, '
+          f'{stats["errors"]} errors{eta}')
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Reprocess AIL Objects')
     parser.add_argument('-t', '--type', type=str, help='AIL Object Type', required=True)
-    parser.add_argument('-m', '--module', type=str, help='AIL Module Name')
+    parser.add_argument('-m', '--module', type=str, help='AIL Module Name, run the module in the workers')
+    parser.add_argument('-q', '--queue', type=str, help='Push the objects in this module queue, default: Importers')
+    parser.add_argument('-s', '--date_from', type=str, help='Items first date: YYYYMMDD')
+    parser.add_argument('-e', '--date_to', type=str, help='Items last date: YYYYMMDD')
+    parser.add_argument('-p', '--processes', type=int, help='Number of processes, default: number of CPUs')
+    parser.add_argument('-c', '--checkpoint', type=str, help='Resume checkpoint file')
+    parser.add_argument('--max-queue', type=int, help='Pause while the target queue is longer, default: Modules_Backpressure')
 
     args = parser.parse_args()
     if not args.type:
@@ -71,10 +308,21 @@ if __name__ == "__main__":
     obj_type = args.type
     if not is_object_type(obj_type):
         raise Exception(f'Invalid Object Type: {obj_type}')
-    if obj_type not in ['image', 'item', 'message', 'screenshot', 'title']:
+    if obj_type not in OBJECTS_TYPES:
         raise Exception(f'Currently not supported Object Type: {obj_type}')
+    if (args.date_from or args.date_to) and obj_type != 'item':
+        raise Exception(f'Date range not supported by Object Type: {obj_type}')
 
     modulename = args.module
-    if modulename not in MODULES:
+    if modulename and modulename not in MODULES:
         raise Exception(f'Currently not supported Module: {modulename}')
-    reprocess_message_objects(obj_type, module_name=modulename)
+    if modulename and args.queue:
+        raise Exception('Select a module or a queue')
+    if args.queue:
+        if not ConfigLoader.ConfigLoader(config_file=ail_queues.MODULES_FILE).has_section(args.queue):
+            raise Exception(f'Unknown Module Queue: {args.queue}')
+
+    nb, errors = reprocess_objects(obj_type, module_name=modulename, queue_name=args.queue,
+                                   date_from=args.date_from, date_to=args.date_to, nb_processes=args.processes,
+                                   checkpoint=args.checkpoint, max_queue=args.max_queue)
+    print(f'{nb} objects reprocessed, {errors} errors')
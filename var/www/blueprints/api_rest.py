@@ -30,7 +30,7 @@ from lib.objects import ail_objects
 from lib.objects import Domains
 from lib.objects import Titles
 
-from importer.FeederImporter import api_add_json_feeder_to_queue
+from importer.FeederImporter import api_add_json_feeder_to_queue, api_add_ndjson_feeder_to_queue, NDJSON_MIMETYPES
 
 
 # LOGS
@@ -152,8 +152,12 @@ def add_crawler_capture():
 @api_rest.route("api/v1/import/json/item", methods=['POST'])  # TODO V2 Migration
 @token_required('user')
 def import_json_item():
-    data_json = request.get_json()
-    res = api_add_json_feeder_to_queue(data_json)
+    # Bulk import: one JSON object per line
+    if request.mimetype in NDJSON_MIMETYPES:
+        res = api_add_ndjson_feeder_to_queue(request.get_data())
+    else:
+        data_json = request.get_json()
+        res = api_add_json_feeder_to_queue(data_json)
     return Response(json.dumps(res[0]), mimetype='application/json'), res[1]
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -12,7 +12,7 @@ import sys
 import time
 from datetime import datetime
 
-from flask import render_template, jsonify, request, Blueprint, redirect, url_for, Response, send_file, abort
+from flask import render_template, jsonify, request, Blueprint, redirect, url_for, Response, send_file, abort, stream_with_context
 from flask_login import login_required, current_user
 
 sys.path.append('modules')
@@ -465,13 +465,20 @@ def crawlers_domain_download():
         epoch = int(epoch)
     except (ValueError, TypeError):
         epoch = None
+    # max size in MB
+    max_size = request.args.get('max_size')
+    try:
+        max_size = int(max_size) * 1024 * 1024
+    except (ValueError, TypeError):
+        max_size = None
     dom = Domains.Domain(domain)
     if not dom.exists():
         abort(404)
-    zip_file = dom.get_download_zip(epoch=epoch)
-    if not zip_file:
+    zip_stream = dom.get_download_zip(epoch=epoch, max_size=max_size)
+    if not zip_stream:
         abort(404)
-    return send_file(zip_file, download_name=f'{dom.get_id()}.zip', as_attachment=True)
+    return Response(stream_with_context(zip_stream), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={dom.get_id()}.zip'})
 
 
 @crawler_splash.route('/domains/explorer/domain_type_post', methods=['POST'])
@@ -23,6 +23,7 @@ from lib import ail_updates
 from lib import ail_orgs
 from lib import ail_config
 from lib import ail_users
+from lib import ail_queues
 from lib import d4
 from packages import git_status
 
@@ -60,7 +61,38 @@ def get_background_update_metadata_json():
 @login_read_only
 def settings_modules():
     acl_admin = current_user.is_in_role('admin')
-    return render_template("settings/modules.html", acl_admin=acl_admin)
+    queues_stats = ail_queues.get_modules_queues_stats()
+    dead_letters = ail_queues.get_modules_dead_letter_messages()
+    return render_template("settings/modules.html", queues_stats=queues_stats, dead_letters=dead_letters,
+                           acl_admin=acl_admin)
+
+@settings_b.route("/settings/modules/dead_letter/replay", methods=['GET'])
+@login_required
+@login_admin
+def settings_modules_dead_letter_replay():
+    module_name = request.args.get('module')
+    message = request.args.get('message')
+    if module_name not in ail_queues.get_queues_modules():
+        return create_json_response({'status': 'error', 'reason': 'Unknown module'}, 404)
+    if message:
+        ail_queues.replay_dead_letter_message(module_name, message)
+    else:
+        ail_queues.replay_dead_letter_messages(module_name)
+    return redirect(url_for('settings_b.settings_modules'))
+
+@settings_b.route("/settings/modules/dead_letter/delete", methods=['GET'])
+@login_required
+@login_admin
+def settings_modules_dead_letter_delete():
+    module_name = request.args.get('module')
+    message = request.args.get('message')
+    if module_name not in ail_queues.get_queues_modules():
+        return create_json_response({'status': 'error', 'reason': 'Unknown module'}, 404)
+    if message:
+        ail_queues.delete_dead_letter_message(module_name, message)
+    else:
+        ail_queues.delete_dead_letter_messages(module_name)
+    return redirect(url_for('settings_b.settings_modules'))
 
 @settings_b.route("/settings/user/profile", methods=['GET'])
 @login_required